@@ -2,9 +2,16 @@ from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
 import requests
 import os
+import sys
 import json
 import re
 
+# Shared modules live at the project root (bundled via vercel.json includeFiles)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import http_client
+import text_normalize
+import title_parser
+
 app = Flask(__name__)
 CORS(app)
 
@@ -12,40 +19,9 @@ CORS(app)
 # Helper Functions
 # ============================================
 
-def extract_song_info(video_title):
-    """Extract artist and track from video title."""
-    clean_title = video_title
-    
-    patterns_to_remove = [
-        r'\s*[\(\[【「].*?(?:官方|official|mv|music video|lyric|歌詞|完整版|高音質|hd|4k|1080p|live|現場|演唱會).*?[\)\]】」]',
-        r'\s*[\(\[【「].*?[\)\]】」]',
-        r'\s*[-–—]\s*(?:official|mv|music video|lyric|歌詞).*$',
-        r'\s*\|.*$',
-        r'\s*Official\s*(?:Music\s*)?(?:Video)?$',
-    ]
-    for pattern in patterns_to_remove:
-        clean_title = re.sub(pattern, '', clean_title, flags=re.IGNORECASE)
-    clean_title = clean_title.strip()
-    
-    # Pattern 1: Artist《Song》or Artist「Song」
-    match = re.match(r'^(.+?)\s*[《「](.+?)[》」]\s*$', clean_title)
-    if match:
-        return match.group(1).strip(), match.group(2).strip()
-    
-    # Pattern 2: Artist - Song
-    match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', clean_title)
-    if match:
-        return match.group(1).strip(), match.group(2).strip()
-    
-    return '', clean_title
-
-
 def contains_chinese(text):
     """Check if text contains Chinese characters."""
-    for char in text:
-        if '\u4e00' <= char <= '\u9fff':
-            return True
-    return False
+    return text_normalize.has_han(text)
 
 
 def lrc_to_plain_text(lrc_content):
@@ -70,7 +46,7 @@ def search_lyrics_lrclib(artist, track):
         if artist:
             search_url += f"&artist_name={requests.utils.quote(artist)}"
         
-        response = requests.get(search_url, headers=headers, timeout=10)
+        response = http_client.get(search_url, headers=headers, timeout=10)
         
         if response.status_code == 200:
             results = response.json()
@@ -106,7 +82,7 @@ def search_lyrics_genius(artist, track):
         params = {'q': search_term}
         headers = {'User-Agent': 'Mozilla/5.0'}
         
-        response = requests.get(search_url, params=params, headers=headers, timeout=10)
+        response = http_client.get(search_url, params=params, headers=headers, timeout=10)
         
         if response.status_code != 200:
             return None
@@ -123,7 +99,7 @@ def search_lyrics_genius(artist, track):
                     
                     if song_url:
                         # Fetch lyrics from page
-                        page_response = requests.get(song_url, headers=headers, timeout=10)
+                        page_response = http_client.get(song_url, headers=headers, timeout=10)
                         if page_response.status_code == 200:
                             html = page_response.text
                             
@@ -159,7 +135,7 @@ def search_lyrics_ovh(artist, track):
             return None
         
         url = f"https://api.lyrics.ovh/v1/{requests.utils.quote(artist)}/{requests.utils.quote(track)}"
-        response = requests.get(url, timeout=10)
+        response = http_client.get(url, timeout=10)
         
         if response.status_code == 200:
             data = response.json()
@@ -226,7 +202,7 @@ def get_subtitles():
     
     try:
         # Extract song info from title
-        artist, track = extract_song_info(video_title) if video_title else ('', '')
+        artist, track = title_parser.parse_title(video_title) if video_title else ('', '')
         
         # Fetch lyrics
         result = fetch_lyrics(artist, track, video_title)
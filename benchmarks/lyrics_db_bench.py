@@ -0,0 +1,183 @@
+"""
+Micro-benchmark: lyrics cache hit latency and database size, before and
+after per-thread connection reuse (WAL, tuned pragmas) and compressed lyric
+storage.
+
+"before" opens a fresh connection per lookup on a rollback-journal database
+holding plain-text lyrics, as server.py used to; "after" goes through
+server.get_db() and decompresses what it reads. The in-process LRU is
+bypassed so only the database path is measured. A second phase runs reader
+threads against a concurrent writer and counts "database is locked" errors.
+
+Usage: python benchmarks/lyrics_db_bench.py [--rows 2000] [--lookups 5000]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = ('我們 的 愛 你 心 在 這裡 永遠 回憶 天空 晴天 雨 故事 風 夢 '
+         'love you baby tonight heart never forever dance night sky rain').split()
+SELECT = 'SELECT lyrics_text, artist, track, source FROM lyrics_cache WHERE video_id = ?'
+INSERT = '''
+    INSERT OR REPLACE INTO lyrics_cache
+    (video_id, video_title, artist, track, source, lyrics_text, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def make_lyrics(rng):
+    """A song-sized lyric with a repeating chorus, like the real corpus."""
+    verse = lambda n: [' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 9))) for _ in range(n)]
+    chorus = verse(6)
+    return '\n'.join(verse(12) + chorus + verse(10) + chorus + chorus)
+
+
+def populate(conn, rows, encode=lambda text: text):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lyrics_cache (
+            video_id TEXT PRIMARY KEY, video_title TEXT, artist TEXT, track TEXT,
+            source TEXT, lyrics_text TEXT, created_at TEXT, updated_at TEXT
+        )
+    ''')
+    rng = random.Random(42)
+    conn.executemany(INSERT, [
+        (f'vid{i:08d}', f'Title {i}', 'Artist', f'Track {i}', 'lrclib', encode(make_lyrics(rng)), 'now', 'now')
+        for i in range(rows)
+    ])
+    conn.commit()
+
+
+def db_size(conn, path):
+    """(file size, bytes of stored lyric text) after compacting."""
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.execute('VACUUM')
+    payload = conn.execute('SELECT sum(length(CAST(lyrics_text AS BLOB))) FROM lyrics_cache').fetchone()[0]
+    return os.path.getsize(path), payload
+
+
+def legacy_lookup(db_path, video_id):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute(SELECT, (video_id,))
+    row = c.fetchone()
+    conn.close()
+    return row
+
+
+def pooled_lookup(server, video_id):
+    with server.get_db() as conn:
+        row = conn.execute(SELECT, (video_id,)).fetchone()
+    return server.decompress_lyrics(row[0]), row[1], row[2], row[3]
+
+
+def time_lookups(lookup, ids):
+    samples = []
+    for video_id in ids:
+        start = time.perf_counter()
+        lookup(video_id)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        'p50': statistics.median(samples),
+        'p95': samples[int(len(samples) * 0.95)],
+        'mean': statistics.mean(samples),
+    }
+
+
+def contended(lookup, write, ids, readers=4, seconds=2.0):
+    """Readers loop over lookups while one thread keeps writing; count lock errors."""
+    stop = time.time() + seconds
+    counts = {'reads': 0, 'writes': 0, 'locked': 0}
+    lock = threading.Lock()
+
+    def run(fn):
+        while time.time() < stop:
+            try:
+                fn(random.choice(ids))
+                key = 'writes' if fn is write else 'reads'
+            except sqlite3.OperationalError:
+                key = 'locked'
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=run, args=(lookup,)) for _ in range(readers)]
+    threads.append(threading.Thread(target=run, args=(write,)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--lookups', type=int, default=5000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='lyrics-bench-')
+    os.environ['RENDER_DISK_PATH'] = tmp
+    os.environ['LYRICS_LRU_WARM'] = '0'
+    import server  # noqa: E402 - DB location must be set first
+    assert os.path.dirname(server.DB_PATH) == tmp, f'refusing to benchmark against {server.DB_PATH}'
+
+    legacy_path = os.path.join(tmp, 'legacy.db')
+    legacy_conn = sqlite3.connect(legacy_path)
+    populate(legacy_conn, args.rows)
+    legacy_size = db_size(legacy_conn, legacy_path)
+    legacy_conn.close()
+
+    # Compress the way server startup would: zlib, then a trained zstd dictionary if available
+    populate(server.get_db(), args.rows, server.compress_lyrics)
+    with server.get_db() as conn:
+        server.migrate_lyrics_storage(conn.cursor())
+    codec = f"zstd + dictionary #{server._lyrics_dict_id}" if server._lyrics_dict_id else 'zlib'
+    size = db_size(server.get_db(), server.DB_PATH)
+
+    ids = [f'vid{random.randrange(args.rows):08d}' for _ in range(args.lookups)]
+
+    before = time_lookups(lambda v: legacy_lookup(legacy_path, v), ids)
+    after = time_lookups(lambda v: pooled_lookup(server, v), ids)
+
+    print(f"\nCached-hit lookup latency over {args.lookups} lookups, {args.rows} rows (microseconds)")
+    print(f"{'':>28} {'p50':>10} {'p95':>10} {'mean':>10}")
+    for name, r in (('before (connect per call)', before), ('after (get_db, compressed)', after)):
+        print(f"{name:>28} {r['p50']:>10.1f} {r['p95']:>10.1f} {r['mean']:>10.1f}")
+    print(f"{'speedup (p50)':>28} {before['p50'] / after['p50']:>10.1f}x")
+
+    print(f"\nStored lyrics: {legacy_size[1] / 1024:.0f} KiB plain text, "
+          f"{size[1] / 1024:.0f} KiB with {codec} ({legacy_size[1] / size[1]:.1f}x smaller)")
+    # The server file also holds the FTS indexes, which the plain-text baseline lacks
+    print(f"Database file: {legacy_size[0] / 1024:.0f} KiB before, {size[0] / 1024:.0f} KiB after (incl. FTS)")
+
+    lyrics = make_lyrics(random.Random(7))
+
+    def legacy_write(video_id):
+        conn = sqlite3.connect(legacy_path)
+        conn.execute(INSERT, (video_id, 't', 'a', 't', 'x', lyrics, 'now', 'now'))
+        conn.commit()
+        conn.close()
+
+    def pooled_write(video_id):
+        with server.get_db() as conn:
+            conn.execute(INSERT, (video_id, 't', 'a', 't', 'x', server.compress_lyrics(lyrics), 'now', 'now'))
+
+    print("\nFour readers plus one writer for 2s")
+    legacy = contended(lambda v: legacy_lookup(legacy_path, v), legacy_write, ids)
+    pooled = contended(lambda v: pooled_lookup(server, v), pooled_write, ids)
+    for name, c in (('before', legacy), ('after', pooled)):
+        print(f"{name:>8}: {c['reads']} reads, {c['writes']} writes, {c['locked']} 'database is locked'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Micro-benchmark: cache/search key normalization over a synthetic title corpus.
+
+Each song is spelled the way uploads spell it: Traditional or Simplified,
+full-width letters, extra spacing and punctuation, decorated with the usual
+[MV] / (Live) / 【官方】 tags. "before" is the key server.py used to build
+(NFKC + casefold + word split); "after" is text_normalize.name_key(). For
+both, the benchmark reports how many spellings land on the song's canonical
+key (i.e. would hit the cache) and the throughput, with the name_key memo
+cold and warm.
+
+Usage: python benchmarks/text_normalize_bench.py [--titles 200000]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import text_normalize  # noqa: E402
+
+ARTISTS = ['周杰倫', '陳奕迅', '鄧紫棋', '五月天', '林俊傑', '張學友', '王菲', '蘇打綠',
+           '孫燕姿', '蔡依林', '梁靜茹', '張惠妹', 'Taylor Swift', 'Adele', 'Ed Sheeran']
+TRACKS = ['晴天', '十年', '光年之外', '倔強', '江南', '吻別', '紅豆', '小情歌', '遇見',
+          '說愛你', '勇氣', '聽海', '後來', '當愛已成往事', '愛情轉移', '龍捲風', '會呼吸的痛',
+          'Love Story', 'Hello', 'Shape of You']
+DECORATIONS = ['', ' [MV]', ' (Live)', ' 【官方MV】', ' Official Music Video', ' (動態歌詞 Lyrics)', ' KTV']
+SEPARATORS = [' - ', ' – ', '-', ' / ', ' 《{}》']
+
+
+def legacy_key(text):
+    """The key server.py built before text_normalize."""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    return ' '.join(re.findall(r'[^\W_]+', text))
+
+
+_S2T = {}
+for _t, _s in text_normalize._T2S.items():
+    _S2T.setdefault(ord(_s), chr(_t))
+
+
+def spell(name, rng):
+    """A random upload spelling of an artist or track name."""
+    if rng.random() < 0.5:
+        name = name.translate(text_normalize._T2S)  # Simplified
+    elif rng.random() < 0.2:
+        name = name.translate(_S2T)
+    if rng.random() < 0.2:
+        # Full-width ASCII
+        name = ''.join(chr(ord(ch) + 0xFEE0) if '!' <= ch <= '~' else ch for ch in name)
+    if rng.random() < 0.2:
+        name = ' '.join(name) if rng.random() < 0.5 else f' {name}  '
+    if rng.random() < 0.1:
+        name = name + rng.choice(['!', '。', '～', '…'])
+    return name
+
+
+def make_corpus(count, rng):
+    """(canonical (artist, track), spelled (artist, track), full title) triples."""
+    corpus = []
+    for _ in range(count):
+        artist, track = rng.choice(ARTISTS), rng.choice(TRACKS)
+        a, t = spell(artist, rng), spell(track, rng)
+        sep = rng.choice(SEPARATORS)
+        title = f"{a}{sep.format(t)}" if '{}' in sep else f"{a}{sep}{t}"
+        corpus.append(((artist, track), (a, t), title + rng.choice(DECORATIONS)))
+    return corpus
+
+
+def hit_rate(key, corpus):
+    hits = sum(1 for (artist, track), (a, t), _ in corpus
+               if (key(a), key(t)) == (key(artist), key(track)))
+    return hits / len(corpus)
+
+
+def throughput(key, titles):
+    start = time.perf_counter()
+    for title in titles:
+        key(title)
+    return len(titles) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--titles', type=int, default=200000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    corpus = make_corpus(args.titles, rng)
+    titles = [title for _, _, title in corpus]
+    distinct = len(set(titles))
+
+    text_normalize.name_key.cache_clear()
+    rows = [
+        ('before (NFKC + casefold)', hit_rate(legacy_key, corpus), throughput(legacy_key, titles)),
+    ]
+    text_normalize.name_key.cache_clear()
+    cold = throughput(text_normalize.name_key.__wrapped__, titles)
+    warm = throughput(text_normalize.name_key, titles)
+    rows.append(('after, unmemoized', hit_rate(text_normalize.name_key, corpus), cold))
+    rows.append((f'after, memo of {text_normalize.NAME_KEY_CACHE}', None, warm))
+
+    print(f"\n{args.titles} titles ({distinct} distinct spellings) of "
+          f"{len(ARTISTS) * len(TRACKS)} songs")
+    print(f"{'':>26} {'same key as song':>17} {'titles/s':>12}")
+    for name, rate, speed in rows:
+        rate = f"{rate:.1%}" if rate is not None else ''
+        print(f"{name:>26} {rate:>17} {speed:>12,.0f}")
+
+    lyrics_lines = [f"{t} {a}" * 4 for (a, t), _, _ in corpus[:20000]]
+    speed = throughput(text_normalize.fts_text, lyrics_lines)
+    print(f"\nfts_text: {speed:,.0f} lyric lines/s")
+
+
+if __name__ == '__main__':
+    main()
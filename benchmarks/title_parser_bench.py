@@ -0,0 +1,120 @@
+"""
+Micro-benchmark: song title parsing accuracy and throughput.
+
+Accuracy is measured on the labeled titles in benchmarks/title_corpus.tsv
+(title, artist, track; names compared after text_normalize.name_key, so
+width and script differences don't count as errors). "before" is the
+extract_song_info() server.py used to carry; "after" is
+title_parser.parse_title(). Throughput runs over the corpus repeated
+--repeat times, unmemoized and memoized, and as 20-title search pages
+through parse_titles().
+
+Usage: python benchmarks/title_parser_bench.py [--repeat 200] [--show-errors]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import text_normalize  # noqa: E402
+import title_parser  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'title_corpus.tsv')
+PAGE_SIZE = 20
+
+
+def legacy_extract_song_info(video_title):
+    """server.py's parser before title_parser (patterns compiled on every call)."""
+    clean_title = video_title
+    patterns_to_remove = [
+        r'\s*[\(\[【「].*?(?:官方|official|mv|music video|lyric|歌詞|完整版|高音質|hd|4k|1080p|live|現場|演唱會).*?[\)\]】」]',
+        r'\s*[\(\[【「].*?[\)\]】」]',
+        r'\s*[-–—]\s*(?:official|mv|music video|lyric|歌詞).*$',
+        r'\s*\|.*$',
+        r'\s*\/.*$',
+        r'\s*官方.*$',
+        r'\s*MV$',
+        r'\s*Official\s*(?:Music\s*)?(?:Video)?$',
+    ]
+    for pattern in patterns_to_remove:
+        clean_title = re.sub(pattern, '', clean_title, flags=re.IGNORECASE)
+    clean_title = clean_title.strip()
+    match = re.match(r'^(.+?)\s*[《「](.+?)[》」]\s*$', clean_title)
+    if match:
+        return match.group(1).strip(), match.group(2).strip()
+    match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', clean_title)
+    if match:
+        return match.group(1).strip(), match.group(2).strip()
+    return '', clean_title
+
+
+def load_corpus():
+    corpus = []
+    with open(CORPUS, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            title, artist, track = line.rstrip('\n').split('\t')
+            corpus.append((title, artist, track))
+    return corpus
+
+
+def accuracy(parse, corpus, show_errors=False):
+    key = text_normalize.name_key
+    artists = tracks = both = 0
+    for title, artist, track in corpus:
+        got_artist, got_track = parse(title)
+        a_ok, t_ok = key(got_artist) == key(artist), key(got_track) == key(track)
+        artists += a_ok
+        tracks += t_ok
+        both += a_ok and t_ok
+        if show_errors and not (a_ok and t_ok):
+            print(f"  {title}\n    got  {got_artist!r} / {got_track!r}\n    want {artist!r} / {track!r}")
+    n = len(corpus)
+    return artists / n, tracks / n, both / n
+
+
+def throughput(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--show-errors', action='store_true')
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    titles = [title for title, _, _ in corpus] * args.repeat
+
+    print(f"\nAccuracy over {len(corpus)} labeled titles")
+    print(f"{'':>8} {'artist':>8} {'track':>8} {'both':>8}")
+    for name, parse in (('before', legacy_extract_song_info), ('after', title_parser.parse_title)):
+        if args.show_errors:
+            print(f"{name} errors:")
+        a, t, b = accuracy(parse, corpus, args.show_errors)
+        print(f"{name:>8} {a:>8.1%} {t:>8.1%} {b:>8.1%}")
+
+    title_parser.parse_title.cache_clear()
+    pages = [titles[i:i + PAGE_SIZE] for i in range(0, len(titles), PAGE_SIZE)]
+    rows = [
+        ('before', throughput(legacy_extract_song_info, titles)),
+        ('after, unmemoized', throughput(title_parser.parse_title.__wrapped__, titles)),
+        ('after, memoized', throughput(title_parser.parse_title, titles)),
+        ('after, parse_titles', throughput(title_parser.parse_titles, pages) * PAGE_SIZE),
+    ]
+    print(f"\nThroughput over {len(titles)} titles")
+    for name, speed in rows:
+        print(f"{name:>20} {speed:>12,.0f} titles/s")
+
+
+if __name__ == '__main__':
+    main()
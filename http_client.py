@@ -0,0 +1,138 @@
+"""
+Shared HTTP client for all upstream calls (lyrics providers, Piped/Invidious,
+googlevideo streams). Used by both server.py and api/index.py.
+
+A module-level requests.Session keeps a keep-alive connection pool per host,
+so repeated calls to the same provider (e.g. Kugou's search -> krcs ->
+download chain) reuse one TCP+TLS connection instead of handshaking every
+time. Pool sizes, retries and timeouts are configurable via environment.
+
+A Deadline installed with deadline_scope() caps the timeout of every call
+made from that thread, so a whole request can be given one time budget.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Number of distinct hosts whose pools are kept alive, and connections kept per host
+POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 32))
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 8))
+
+# Connection errors and 502/503/504 are retried with exponential backoff;
+# read timeouts are not, since a slow provider is usually still slow on retry.
+RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF', 0.3))
+
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+
+
+def _make_session(retry):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                          max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # Behave like bare requests.get(): no cookies carried between calls
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+_api_session = _make_session(Retry(
+    total=RETRIES,
+    connect=RETRIES,
+    read=0,
+    status=RETRIES,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset(['GET', 'HEAD', 'POST']),
+    backoff_factor=BACKOFF_FACTOR,
+    respect_retry_after_header=False,
+    raise_on_status=False,
+))
+
+# Media streams: only retry failed connects, never replay a partially read body
+_stream_session = _make_session(Retry(
+    total=1,
+    connect=1,
+    read=0,
+    status=0,
+    backoff_factor=BACKOFF_FACTOR,
+    raise_on_status=False,
+))
+
+
+class DeadlineExceeded(requests.Timeout):
+    """Raised instead of sending a request once the deadline has passed."""
+
+
+class Deadline:
+    """Absolute time budget shared by every upstream call made on its behalf."""
+
+    def __init__(self, seconds):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+_context = threading.local()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Apply a Deadline to all calls made from this thread inside the block."""
+    previous = getattr(_context, 'deadline', None)
+    _context.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _context.deadline = previous
+
+
+def current_deadline():
+    """The Deadline installed for this thread, or None."""
+    return getattr(_context, 'deadline', None)
+
+
+def _timeout(timeout):
+    """Turn a single timeout value into a (connect, read) pair, capped by any deadline."""
+    if timeout is None:
+        connect, read = CONNECT_TIMEOUT, READ_TIMEOUT
+    elif isinstance(timeout, (tuple, list)):
+        connect, read = timeout
+    else:
+        connect, read = min(CONNECT_TIMEOUT, timeout), timeout
+
+    deadline = current_deadline()
+    if deadline is not None:
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded('Deadline exceeded before the request was sent')
+        connect, read = min(connect, remaining), min(read, remaining)
+    return (connect, read)
+
+
+def get(url, timeout=None, **kwargs):
+    """GET through the shared pooled session."""
+    return _api_session.get(url, timeout=_timeout(timeout), **kwargs)
+
+
+def post(url, timeout=None, **kwargs):
+    """POST through the shared pooled session."""
+    return _api_session.post(url, timeout=_timeout(timeout), **kwargs)
+
+
+def get_stream(url, timeout=None, **kwargs):
+    """Streaming GET for media bodies; the caller must close the response."""
+    return _stream_session.get(url, timeout=_timeout(timeout), stream=True, **kwargs)
@@ -4,25 +4,49 @@ A Flask-based web server for the karaoke application.
 Run this file to start the web server.
 """
 
-from flask import Flask, jsonify, request, Response, send_from_directory
+from flask import Flask, jsonify, request, Response, send_from_directory, redirect, make_response
 from flask_cors import CORS
 import yt_dlp
 import requests
 import os
+import re
+import atexit
+import hmac
+import shutil
 import sqlite3
 import json
+import math
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
+import http_client
+import text_normalize
+import title_parser
+
+try:
+    import zstandard  # optional: dictionary-trained lyrics compression
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl  # POSIX only: picks the one worker that runs scheduled maintenance
+except ImportError:
+    fcntl = None
+
 app = Flask(__name__, static_folder='web', static_url_path='')
 CORS(app)
 
 # ============================================
 # Database Setup
 # ============================================
-# Use /data directory on Render (persistent disk), fallback to local for development
-DATA_DIR = os.environ.get('RENDER_DISK_PATH', os.path.dirname(__file__))
-if os.path.exists('/data'):
-    DATA_DIR = '/data'
+# An explicit RENDER_DISK_PATH wins; otherwise /data on Render (persistent disk),
+# fallback to local for development
+DATA_DIR = os.environ.get('RENDER_DISK_PATH')
+if not DATA_DIR:
+    DATA_DIR = '/data' if os.path.exists('/data') else os.path.dirname(__file__)
 DB_PATH = os.path.join(DATA_DIR, 'karaoke_lyrics.db')
 
 # Detect Render cloud environment (yt-dlp is bot-detected there; skip it for streaming)
@@ -30,10 +54,172 @@ IS_RENDER = bool(os.environ.get('RENDER'))
 if IS_RENDER:
     print('[CONFIG] Running on Render - yt-dlp streaming disabled, using Piped/Invidious fallback')
 
-def init_db():
-    """Initialize the SQLite database for caching lyrics."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+# Each thread keeps one connection for its lifetime instead of reconnecting
+# per query, so the pragmas below and sqlite3's prepared-statement cache pay
+# off across requests. WAL lets readers proceed while a writer commits, and
+# the busy timeout makes concurrent writers wait instead of failing with
+# "database is locked". Use `with get_db() as conn:` so writes commit (or
+# roll back) at the end of the block.
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))
+SQLITE_CACHE_KIB = int(os.environ.get('SQLITE_CACHE_KIB', 8 * 1024))
+SQLITE_MMAP_BYTES = int(os.environ.get('SQLITE_MMAP_BYTES', 64 * 1024 * 1024))
+SQLITE_STATEMENT_CACHE = 128
+
+_db_local = threading.local()
+
+# Every key (song identities, manual-lyrics and miss search keys) and all
+# full-text input go through text_normalize, so Traditional/Simplified,
+# full-width and differently punctuated spellings of a song coincide. FTS5's
+# unicode61 tokenizer treats a run of CJK characters as one word, so
+# fts_text() also splits every CJK character into its own token and a
+# phrase of adjacent characters matches.
+def fts_text(text):
+    """Folded, tokenized text (lyrics may still be compressed) for FTS5."""
+    if not text:
+        return ''
+    if isinstance(text, bytes):
+        text = decompress_lyrics(text)
+    return text_normalize.fts_text(text)
+
+def normalize_name(text):
+    """Canonical form of an artist/track name for indexed equality lookups."""
+    return text_normalize.name_key(text or '')
+
+def fts_query(text, prefix=True):
+    """Build an FTS5 MATCH expression requiring every token of text (any order)."""
+    terms = []
+    for token in text_normalize.tokens(text):
+        # Prefix-match latin words so partial names still hit
+        if prefix and not text_normalize.is_cjk(token):
+            terms.append(f'"{token}"*')
+        else:
+            terms.append(f'"{token}"')
+    return ' '.join(terms)
+
+def get_db():
+    """Return this thread's SQLite connection, opening and tuning it on first use."""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT,
+                               cached_statements=SQLITE_STATEMENT_CACHE)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)}')
+        conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KIB}')
+        conn.execute(f'PRAGMA mmap_size={SQLITE_MMAP_BYTES}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        # Only takes effect on a new database; run_maintenance converts existing ones
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        # INSERT OR REPLACE must fire the delete triggers that keep FTS in sync
+        conn.execute('PRAGMA recursive_triggers=ON')
+        conn.create_function('fts_text', 1, fts_text, deterministic=True)
+        conn.create_function('normalize_name', 1, normalize_name, deterministic=True)
+        conn.create_function('compress_lyrics', 1, compress_lyrics)
+        conn.create_function('decompress_lyrics', 1, decompress_lyrics, deterministic=True)
+        _db_local.conn = conn
+    return conn
+
+# Lyric text is stored compressed. Each blob starts with a format byte:
+# LYRICS_ZLIB (a zlib stream follows) or LYRICS_ZSTD (a 2-byte dictionary id
+# and a zstd frame follow). The zstd dictionary is trained on our own lyrics,
+# which matters because each song is too short to compress well on its own;
+# it is only used when the optional zstandard package is installed. Rows
+# written before compression existed are TEXT and read back unchanged.
+LYRICS_ZLIB = 0x01
+LYRICS_ZSTD = 0x02
+LYRICS_ZLIB_LEVEL = 9
+# Compression runs on the request path; the dictionary, not the level, does the work
+LYRICS_ZSTD_LEVEL = 3
+LYRICS_DICT_SIZE = 32 * 1024
+LYRICS_DICT_MIN_SAMPLES = int(os.environ.get('LYRICS_DICT_MIN_SAMPLES', 200))
+
+_lyrics_dicts = {}
+_lyrics_dict_id = None  # dictionary that new rows are compressed with
+_zstd_local = threading.local()
+
+def load_lyrics_dicts(c=None):
+    """Load trained zstd dictionaries; the newest one is used for new rows."""
+    global _lyrics_dict_id
+    if zstandard is None:
+        return
+    if c is None:
+        c = get_db().cursor()
+    c.execute('SELECT id, data FROM lyrics_dicts ORDER BY id')
+    for dict_id, data in c.fetchall():
+        if dict_id not in _lyrics_dicts:
+            _lyrics_dicts[dict_id] = zstandard.ZstdCompressionDict(data)
+        _lyrics_dict_id = dict_id
+
+def _zstd_codec(kind, dict_id):
+    """Per-thread zstd compressor/decompressor for a dictionary (they aren't thread-safe)."""
+    codecs = _zstd_local.__dict__.setdefault(kind, {})
+    codec = codecs.get(dict_id)
+    if codec is None:
+        if dict_id not in _lyrics_dicts:
+            load_lyrics_dicts()  # trained by another worker since we started
+        if kind == 'compress':
+            codec = zstandard.ZstdCompressor(level=LYRICS_ZSTD_LEVEL, dict_data=_lyrics_dicts[dict_id])
+        else:
+            codec = zstandard.ZstdDecompressor(dict_data=_lyrics_dicts[dict_id])
+        codecs[dict_id] = codec
+    return codec
+
+def compress_lyrics(text):
+    """Encode lyric text for storage (bytes are assumed to be stored already)."""
+    if text is None or isinstance(text, bytes):
+        return text
+    data = text.encode('utf-8')
+    if _lyrics_dict_id is not None:
+        return (bytes([LYRICS_ZSTD]) + _lyrics_dict_id.to_bytes(2, 'big')
+                + _zstd_codec('compress', _lyrics_dict_id).compress(data))
+    return bytes([LYRICS_ZLIB]) + zlib.compress(data, LYRICS_ZLIB_LEVEL)
+
+def decompress_lyrics(value):
+    """Decode a stored lyrics value back to text."""
+    if value is None or isinstance(value, str):
+        return value
+    if value[0] == LYRICS_ZLIB:
+        return zlib.decompress(value[1:]).decode('utf-8')
+    if value[0] == LYRICS_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('Lyrics were stored with zstd; install the zstandard package')
+        dict_id = int.from_bytes(value[1:3], 'big')
+        return _zstd_codec('decompress', dict_id).decompress(value[3:]).decode('utf-8')
+    raise ValueError(f'Unknown lyrics storage format: {value[0]}')
+
+def train_lyrics_dict(c):
+    """Train a zstd dictionary on the stored lyrics, if there are enough of them."""
+    global _lyrics_dict_id
+    c.execute('SELECT lyrics_text FROM lyrics_cache UNION ALL SELECT lyrics_text FROM manual_lyrics')
+    samples = [decompress_lyrics(row[0]).encode('utf-8') for row in c.fetchall() if row[0]]
+    if len(samples) < LYRICS_DICT_MIN_SAMPLES:
+        return False
+    trained = zstandard.train_dictionary(LYRICS_DICT_SIZE, samples)
+    c.execute('INSERT INTO lyrics_dicts (data, created_at) VALUES (?, ?)',
+              (trained.as_bytes(), datetime.now().isoformat()))
+    _lyrics_dicts[c.lastrowid] = trained
+    _lyrics_dict_id = c.lastrowid
+    print(f"[DB] Trained lyrics dictionary #{c.lastrowid} on {len(samples)} songs")
+    return True
+
+def migrate_lyrics_storage(c):
+    """Compress plain-text lyric rows in place; returns the number of rows rewritten."""
+    load_lyrics_dicts(c)
+    where = "typeof(lyrics_text) = 'text'"
+    if zstandard is not None and _lyrics_dict_id is None and train_lyrics_dict(c):
+        # Re-encode zlib rows with the new dictionary too
+        where += f" OR (typeof(lyrics_text) = 'blob' AND substr(lyrics_text, 1, 1) = x'{LYRICS_ZLIB:02x}')"
+    rewritten = 0
+    for table in ('lyrics_cache', 'manual_lyrics'):
+        c.execute(f'UPDATE {table} SET lyrics_text = compress_lyrics(decompress_lyrics(lyrics_text)) WHERE {where}')
+        rewritten += c.rowcount
+    return rewritten
+
+# Schema changes are numbered migrations tracked in PRAGMA user_version; on
+# startup every migration newer than the database's version runs once, in
+# order, inside the same transaction as the version bump.
+def _schema_v1(c):
+    """Base tables, as they existed before versioning (all IF NOT EXISTS)."""
     c.execute('''
         CREATE TABLE IF NOT EXISTS lyrics_cache (
             video_id TEXT PRIMARY KEY,
@@ -46,6 +232,19 @@ def init_db():
             updated_at TEXT
         )
     ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS instance_health (
+            instance TEXT PRIMARY KEY,
+            successes INTEGER,
+            failures INTEGER,
+            success_rate REAL,
+            avg_latency REAL,
+            consecutive_failures INTEGER,
+            trips INTEGER,
+            open_until REAL,
+            updated_at TEXT
+        )
+    ''')
     c.execute('''
         CREATE TABLE IF NOT EXISTS manual_lyrics (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -56,65 +255,501 @@ def init_db():
             created_at TEXT
         )
     ''')
-    conn.commit()
-    conn.close()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS lyrics_misses (
+            video_id TEXT PRIMARY KEY,
+            search_key TEXT,
+            misses INTEGER,
+            retry_at REAL,
+            updated_at TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_lyrics_misses_search_key ON lyrics_misses (search_key)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS lyrics_dicts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            data BLOB,
+            created_at TEXT
+        )
+    ''')
+    init_fts(c)
+
+def _schema_v2(c):
+    """Normalized artist/track columns plus indexes for lookups and eviction."""
+    # FTS update triggers now fire only when indexed columns change
+    for fts in FTS_TABLES:
+        c.execute(f'DROP TRIGGER IF EXISTS {fts}_au')
+    c.execute('ALTER TABLE lyrics_cache ADD COLUMN artist_norm TEXT')
+    c.execute('ALTER TABLE lyrics_cache ADD COLUMN track_norm TEXT')
+    c.execute('UPDATE lyrics_cache SET artist_norm = normalize_name(artist), track_norm = normalize_name(track)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_lyrics_cache_norm ON lyrics_cache (artist_norm, track_norm)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_lyrics_cache_updated ON lyrics_cache (updated_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_lyrics_misses_retry ON lyrics_misses (retry_at)')
+    init_fts(c)
+
+def _schema_v3(c):
+    """Song identities that every upload of the same song maps onto."""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS songs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            artist_norm TEXT,
+            track_norm TEXT,
+            artist TEXT,
+            track TEXT,
+            video_id TEXT,
+            created_at TEXT,
+            UNIQUE (artist_norm, track_norm)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS video_songs (
+            video_id TEXT PRIMARY KEY,
+            song_id INTEGER,
+            created_at TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_video_songs_song ON video_songs (song_id)')
+    # Seed from what is already cached, preferring manual and then recent rows
+    c.execute('''
+        INSERT OR IGNORE INTO songs (artist_norm, track_norm, artist, track, video_id, created_at)
+        SELECT artist_norm, track_norm, artist, track, video_id, updated_at FROM lyrics_cache
+        WHERE artist_norm != '' AND track_norm != ''
+        ORDER BY source = 'manual' DESC, updated_at DESC
+    ''')
+
+def _schema_v4(c):
+    """Re-derive every key and the FTS indexes with text_normalize's folding."""
+    c.execute('UPDATE lyrics_cache SET artist_norm = normalize_name(artist), track_norm = normalize_name(track)')
+    # Spellings that now fold together keep the first song / manual entry;
+    # the duplicates' uploads are re-mapped on their next lookup
+    c.execute('UPDATE OR IGNORE songs SET artist_norm = normalize_name(artist), track_norm = normalize_name(track)')
+    c.execute('''
+        DELETE FROM songs
+        WHERE artist_norm != normalize_name(artist) OR track_norm != normalize_name(track)
+    ''')
+    c.execute('DELETE FROM video_songs WHERE song_id NOT IN (SELECT id FROM songs)')
+    c.execute("UPDATE OR IGNORE manual_lyrics SET search_key = normalize_name(artist || ' ' || track)")
+    c.execute('UPDATE lyrics_misses SET search_key = normalize_name(search_key)')
+    # Contentless indexes can only delete exactly what was indexed: rebuild them
+    for fts in FTS_TABLES:
+        for trigger in ('ai', 'ad', 'au'):
+            c.execute(f'DROP TRIGGER IF EXISTS {fts}_{trigger}')
+        c.execute(f'DROP TABLE IF EXISTS {fts}')
+    init_fts(c)
+
+MIGRATIONS = [_schema_v1, _schema_v2, _schema_v3, _schema_v4]
+
+def schema_version(c):
+    c.execute('PRAGMA user_version')
+    return c.fetchone()[0]
+
+def init_db():
+    """Initialize the SQLite database, applying pending migrations."""
+    with get_db() as conn:
+        c = conn.cursor()
+        # Workers start together; let one set up (and migrate) at a time
+        c.execute('BEGIN IMMEDIATE')
+        version = schema_version(c)
+        for target in range(version + 1, len(MIGRATIONS) + 1):
+            MIGRATIONS[target - 1](c)
+            c.execute(f'PRAGMA user_version = {target}')
+            print(f"[DB] Migrated schema to version {target}")
+        rewritten = migrate_lyrics_storage(c)
+
+    if rewritten:
+        # Not VACUUMed here: every worker runs this at import; maintenance reclaims the space
+        print(f"[DB] Compressed {rewritten} lyric rows; space is reclaimed by the next maintenance run")
     print("[DB] Database initialized")
 
+# Contentless FTS5 indexes over both lyric tables: the text lives only in the
+# base tables, triggers keep the index in step (deleting needs the values that
+# were indexed, which fts_text() reproduces deterministically).
+FTS_TABLES = {
+    'manual_lyrics_fts': {
+        'table': 'manual_lyrics',
+        'rowid': 'id',
+        'columns': {'artist': 'artist', 'track': 'track', 'lyrics': 'lyrics_text'},
+    },
+    'lyrics_cache_fts': {
+        'table': 'lyrics_cache',
+        'rowid': 'rowid',
+        'columns': {'title': 'video_title', 'artist': 'artist', 'track': 'track', 'lyrics': 'lyrics_text'},
+    },
+}
+
+def init_fts(c):
+    """Create the FTS5 indexes and their sync triggers, backfilling new indexes."""
+    for fts, spec in FTS_TABLES.items():
+        table, rowid = spec['table'], spec['rowid']
+        fts_cols = ', '.join(spec['columns'])
+        new_vals = ', '.join(f"fts_text(new.{col})" for col in spec['columns'].values())
+        old_vals = ', '.join(f"fts_text(old.{col})" for col in spec['columns'].values())
+        src_vals = ', '.join(f"fts_text({col})" for col in spec['columns'].values())
+
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,))
+        exists = c.fetchone()
+        c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({fts_cols}, content='')")
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, {fts_cols}) VALUES (new.{rowid}, {new_vals});
+            END
+        ''')
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {fts_cols}) VALUES ('delete', old.{rowid}, {old_vals});
+            END
+        ''')
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {', '.join(spec['columns'].values())} ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {fts_cols}) VALUES ('delete', old.{rowid}, {old_vals});
+                INSERT INTO {fts} (rowid, {fts_cols}) VALUES (new.{rowid}, {new_vals});
+            END
+        ''')
+        if not exists:
+            c.execute(f"INSERT INTO {fts} (rowid, {fts_cols}) SELECT {rowid}, {src_vals} FROM {table}")
+            print(f"[DB] Built {fts} over {c.rowcount} existing rows")
+
 # Initialize database on startup
 init_db()
 
+# Hot lyrics are kept in a bounded in-process LRU in front of SQLite, so
+# repeat plays don't touch the (network-backed, on Render) disk at all. The
+# TTL bounds how long another worker's /api/save_lyrics can go unseen here.
+LYRICS_LRU_ENTRIES = int(os.environ.get('LYRICS_LRU_ENTRIES', 2000))
+LYRICS_LRU_BYTES = int(os.environ.get('LYRICS_LRU_BYTES', 16 * 1024 * 1024))
+LYRICS_LRU_TTL = int(os.environ.get('LYRICS_LRU_TTL', 300))
+LYRICS_LRU_WARM = int(os.environ.get('LYRICS_LRU_WARM', 200))
+
+class LRUCache:
+    """Thread-safe LRU bounded by entry count and total bytes, with a TTL."""
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        from collections import OrderedDict
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.time():
+                if entry is not None:
+                    self._remove(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.time() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else None,
+                'evictions': self._evictions,
+            }
+
+lyrics_lru = LRUCache(LYRICS_LRU_ENTRIES, LYRICS_LRU_BYTES, LYRICS_LRU_TTL)
+
+def _lyrics_entry_size(entry):
+    return sum(len((v or '').encode('utf-8')) for v in entry.values())
+
+def warm_lyrics_lru(limit=LYRICS_LRU_WARM):
+    """Preload the most recently updated cached lyrics into the LRU."""
+    if limit <= 0:
+        return
+    try:
+        with get_db() as conn:
+            c = conn.cursor()
+            c.execute('''
+                SELECT video_id, lyrics_text, artist, track, source FROM lyrics_cache
+                ORDER BY updated_at DESC LIMIT ?
+            ''', (limit,))
+            rows = c.fetchall()
+        # Oldest first, so the most recent rows end up most recently used
+        for row in reversed(rows):
+            entry = {'lyrics': decompress_lyrics(row[1]), 'artist': row[2], 'track': row[3], 'source': row[4]}
+            lyrics_lru.put(row[0], entry, _lyrics_entry_size(entry))
+        print(f"[DB] Warmed lyrics LRU with {len(rows)} entries")
+    except Exception as e:
+        print(f"[DB ERROR] {e}")
+
+warm_lyrics_lru()
+
+# Cache writes (new lyrics, recorded misses) don't need to be durable before
+# the response goes out, so they are queued for a background writer that
+# commits them in batches - every LYRICS_WRITE_INTERVAL seconds or as soon as
+# LYRICS_WRITE_BATCH are waiting - in one transaction. A newer write for the
+# same key replaces a queued one, readers check pending() before the DB (a
+# write can also be found under alias keys, e.g. the song it creates), and
+# whatever is left is flushed at exit. Each write runs in its own savepoint,
+# so a failing row is retried (up to LYRICS_WRITE_RETRIES) or dropped alone.
+LYRICS_WRITE_INTERVAL = float(os.environ.get('LYRICS_WRITE_INTERVAL', 0.2))
+LYRICS_WRITE_BATCH = int(os.environ.get('LYRICS_WRITE_BATCH', 50))
+LYRICS_WRITE_RETRIES = 3
+
+class WriteBehind:
+    """Background writer that batches queued DB writes into single transactions."""
+
+    def __init__(self, interval, batch_size):
+        from collections import OrderedDict
+        self.interval = interval
+        self.batch_size = batch_size
+        self._cond = threading.Condition()
+        self._queue = OrderedDict()  # key -> [write(cursor), value, attempts, aliases]
+        self._aliases = {}  # alias -> key of the queued write it stands for
+        self._flush_lock = threading.Lock()  # writer thread, atexit and maintenance all flush
+        self._thread = None
+        self._written = 0
+        self._batches = 0
+        self._failed = 0
+        self._coalesced = 0
+
+    def submit(self, key, write, value=None, aliases=()):
+        """Queue write(cursor); value is what pending(key), or pending(alias), returns until it lands."""
+        with self._cond:
+            if self._pop(key) is not None:
+                self._coalesced += 1
+            self._queue[key] = [write, value, 0, tuple(aliases)]
+            for alias in aliases:
+                self._aliases[alias] = key
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self, key):
+        with self._cond:
+            item = self._queue.get(key)
+            if item is None:
+                item = self._queue.get(self._aliases.get(key))
+                if item is None or key not in item[3]:
+                    return None
+            return item[1]
+
+    def discard(self, key):
+        """Drop a queued write that a synchronous write has superseded."""
+        with self._cond:
+            self._pop(key)
+
+    def _pop(self, key):
+        """Remove a queued write and its aliases; caller holds _cond."""
+        item = self._queue.pop(key, None)
+        if item is not None:
+            for alias in item[3]:
+                if self._aliases.get(alias) == key:
+                    del self._aliases[alias]
+        return item
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._queue) >= self.batch_size, timeout=self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write everything queued so far (writer thread, maintenance and exit).
+
+        Every queued write is attempted once per flush; failed ones stay
+        queued for the next flush instead of holding up the rest.
+        """
+        with self._flush_lock:
+            tried = set()
+            while True:
+                with self._cond:
+                    batch = [(key, item) for key, item in self._queue.items()
+                             if id(item) not in tried][:self.batch_size]
+                if not batch:
+                    return
+                tried.update(id(item) for _, item in batch)
+                failed = []
+                try:
+                    with get_db() as conn:
+                        c = conn.cursor()
+                        c.execute('BEGIN IMMEDIATE')
+                        for key, item in batch:
+                            c.execute('SAVEPOINT write_behind')
+                            try:
+                                item[0](c)
+                            except Exception as e:
+                                print(f"[DB SAVE ERROR] Write-behind {key!r} failed: {e}")
+                                c.execute('ROLLBACK TO write_behind')
+                                failed.append((key, item))
+                            c.execute('RELEASE write_behind')
+                except Exception as e:
+                    # Nothing was committed; every row counts an attempt
+                    print(f"[DB SAVE ERROR] Write-behind batch of {len(batch)} failed: {e}")
+                    self._retry(batch)
+                    continue
+                self._retry(failed)
+                with self._cond:
+                    for key, item in batch:
+                        # Leave it queued if it failed or a newer write for the key arrived meanwhile
+                        if self._queue.get(key) is item and (key, item) not in failed:
+                            self._pop(key)
+                    self._written += len(batch) - len(failed)
+                    self._batches += 1
+
+    def close(self):
+        """Final flush at exit; reports whatever could not be written."""
+        self.flush()
+        with self._cond:
+            left = len(self._queue)
+        if left:
+            print(f"[DB SAVE ERROR] Write-behind exiting with {left} unwritten rows")
+
+    def _retry(self, items):
+        """Count a failed attempt for each item; drop those out of retries."""
+        with self._cond:
+            for key, item in items:
+                if self._queue.get(key) is item:
+                    item[2] += 1
+                    if item[2] >= LYRICS_WRITE_RETRIES:
+                        self._pop(key)
+                        self._failed += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'written': self._written,
+                'batches': self._batches,
+                'coalesced': self._coalesced,
+                'failed': self._failed,
+            }
+
+lyrics_writer = WriteBehind(LYRICS_WRITE_INTERVAL, LYRICS_WRITE_BATCH)
+atexit.register(lyrics_writer.close)
+
 def get_cached_lyrics(video_id):
     """Get lyrics from cache if available."""
+    cached = (lyrics_lru.get(video_id) or lyrics_writer.pending(('lyrics', video_id))
+              or lyrics_writer.pending(('video_song', video_id)))
+    if cached:
+        return cached
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('SELECT lyrics_text, artist, track, source FROM lyrics_cache WHERE video_id = ?', (video_id,))
-        row = c.fetchone()
-        conn.close()
+        with get_db() as conn:
+            c = conn.cursor()
+            c.execute('''
+                SELECT lyrics_text, artist, track, source, updated_at, video_id FROM lyrics_cache
+                WHERE video_id = ?
+            ''', (video_id,))
+            row = c.fetchone()
+            if not row:
+                # Another upload of a song we already have lyrics for
+                c.execute('''
+                    SELECT l.lyrics_text, l.artist, l.track, l.source, l.updated_at, l.video_id
+                    FROM video_songs v JOIN songs s ON s.id = v.song_id
+                    JOIN lyrics_cache l ON l.video_id = s.video_id
+                    WHERE v.video_id = ?
+                ''', (video_id,))
+                row = c.fetchone()
         if row:
-            return {
-                'lyrics': row[0],
+            entry = {
+                'lyrics': decompress_lyrics(row[0]),
                 'artist': row[1],
                 'track': row[2],
                 'source': row[3]
             }
+            lyrics_lru.put(video_id, entry, _lyrics_entry_size(entry))
+            touch_cached_lyrics(row[5], row[4])
+            return entry
     except Exception as e:
         print(f"[DB ERROR] {e}")
     return None
 
-def save_lyrics_to_cache(video_id, video_title, artist, track, source, lyrics_text):
-    """Save lyrics to the database cache."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        now = datetime.now().isoformat()
+def save_lyrics_to_cache(video_id, video_title, artist, track, source, lyrics_text, song=None):
+    """Save lyrics to the database cache (written in the background).
+
+    The lyrics become the song's for artist/track and, if given, for the
+    (artist, track) the video title was parsed into.
+    """
+    now = datetime.now().isoformat()
+
+    def write(c):
+        # Manual lyrics win: a provider result queued before /api/save_lyrics must not replace them
         c.execute('''
-            INSERT OR REPLACE INTO lyrics_cache 
-            (video_id, video_title, artist, track, source, lyrics_text, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (video_id, video_title, artist, track, source, lyrics_text, now, now))
-        conn.commit()
-        conn.close()
-        print(f"[DB] Cached lyrics for: {video_title}")
-    except Exception as e:
-        print(f"[DB SAVE ERROR] {e}")
+            INSERT INTO lyrics_cache
+            (video_id, video_title, artist, track, source, lyrics_text, created_at, updated_at,
+             artist_norm, track_norm)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (video_id) DO UPDATE
+            SET video_title = excluded.video_title, artist = excluded.artist, track = excluded.track,
+                source = excluded.source, lyrics_text = excluded.lyrics_text,
+                created_at = excluded.created_at, updated_at = excluded.updated_at,
+                artist_norm = excluded.artist_norm, track_norm = excluded.track_norm
+            WHERE lyrics_cache.source != 'manual' OR excluded.source = 'manual'
+        ''', (video_id, video_title, artist, track, source, compress_lyrics(lyrics_text), now, now,
+              normalize_name(artist), normalize_name(track)))
+        if not c.rowcount:
+            lyrics_lru.pop(video_id)  # drop the provider entry put there at submit time
+            return
+        c.execute('DELETE FROM lyrics_misses WHERE video_id = ?', (video_id,))
+        for song_artist, song_track in songs:
+            save_song(c, song_artist, song_track, video_id)
+
+    songs = {(artist, track), song or (artist, track)}
+    entry = {'lyrics': lyrics_text, 'artist': artist, 'track': track, 'source': source}
+    # Until it lands, find_song_lyrics() sees the song through the alias
+    aliases = [('song',) + key for key in filter(None, (song_key(*s) for s in songs))]
+    lyrics_writer.discard(('miss', video_id))
+    lyrics_writer.submit(('lyrics', video_id), write, entry, aliases)
+    lyrics_lru.put(video_id, entry, _lyrics_entry_size(entry))
+    print(f"[DB] Cached lyrics for: {video_title}")
 
 def search_manual_lyrics(search_key):
     """Search for manually added lyrics."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        # Try exact match first
-        c.execute('SELECT lyrics_text, artist, track FROM manual_lyrics WHERE search_key = ?', (search_key.lower(),))
-        row = c.fetchone()
-        if not row:
-            # Try partial match
-            c.execute('SELECT lyrics_text, artist, track FROM manual_lyrics WHERE search_key LIKE ?', (f'%{search_key.lower()}%',))
+        with get_db() as conn:
+            c = conn.cursor()
+            # Try exact match first
+            c.execute('SELECT lyrics_text, artist, track FROM manual_lyrics WHERE search_key = ?',
+                      (normalize_name(search_key),))
             row = c.fetchone()
-        conn.close()
+            query = fts_query(search_key)
+            if not row and query:
+                # Every word of the key in artist/track, in any order, best match first
+                c.execute('''
+                    SELECT m.lyrics_text, m.artist, m.track FROM manual_lyrics_fts
+                    JOIN manual_lyrics m ON m.id = manual_lyrics_fts.rowid
+                    WHERE manual_lyrics_fts MATCH ? ORDER BY rank LIMIT 1
+                ''', (f'{{artist track}} : ({query})',))
+                row = c.fetchone()
         if row:
             return {
-                'lyrics': row[0],
+                'lyrics': decompress_lyrics(row[0]),
                 'artist': row[1],
                 'track': row[2],
                 'source': 'manual'
@@ -123,6 +758,341 @@ def search_manual_lyrics(search_key):
         print(f"[DB SEARCH ERROR] {e}")
     return None
 
+# The same song is uploaded many times (MV, lyric video, KTV, live), each
+# with its own video_id. Songs are identified by the normalized artist and
+# track parsed from a title; a video_id seen for the first time whose title
+# parses to a known song is mapped onto it in video_songs and served the
+# lyrics already cached for the song, without asking any provider. A song
+# points at the lyrics_cache row that holds its lyrics.
+def song_key(artist, track):
+    """Normalized (artist, track) identifying a song, or None if either is missing."""
+    artist, track = normalize_name(artist), normalize_name(track)
+    if not artist or not track:
+        return None
+    return artist, track
+
+def save_song(c, artist, track, video_id, replace=False):
+    """Point the song at video_id's cached lyrics.
+
+    An existing song keeps its lyrics unless replace is set or its lyrics
+    row has since been evicted.
+    """
+    key = song_key(artist, track)
+    if not key:
+        return
+    c.execute(f'''
+        INSERT INTO songs (artist_norm, track_norm, artist, track, video_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (artist_norm, track_norm) DO UPDATE
+        SET artist = excluded.artist, track = excluded.track, video_id = excluded.video_id
+        {'' if replace else 'WHERE NOT EXISTS (SELECT 1 FROM lyrics_cache WHERE video_id = songs.video_id)'}
+    ''', (*key, artist, track, video_id, datetime.now().isoformat()))
+
+def find_song_lyrics(artist, track):
+    """Cached lyrics of a known song, with its key and song_id (None while still queued), or None."""
+    key = song_key(artist, track)
+    if not key:
+        return None
+    try:
+        with get_db() as conn:
+            c = conn.cursor()
+            c.execute('''
+                SELECT s.id, l.lyrics_text, l.artist, l.track, l.source, l.updated_at, l.video_id
+                FROM songs s JOIN lyrics_cache l ON l.video_id = s.video_id
+                WHERE s.artist_norm = ? AND s.track_norm = ?
+            ''', key)
+            row = c.fetchone()
+        if row:
+            touch_cached_lyrics(row[6], row[5])
+            return {
+                'key': key,
+                'song_id': row[0],
+                'lyrics': decompress_lyrics(row[1]),
+                'artist': row[2],
+                'track': row[3],
+                'source': row[4]
+            }
+    except Exception as e:
+        print(f"[DB ERROR] {e}")
+        return None
+    pending = lyrics_writer.pending(('song',) + key)
+    if pending:
+        return {'key': key, 'song_id': None, **pending}
+    return None
+
+def map_video_to_song(video_id, song):
+    """Record that video_id is an upload of song (written in the background)."""
+    def write(c):
+        # By key: the song row may itself have been queued just ahead of this write
+        c.execute('''
+            INSERT OR REPLACE INTO video_songs (video_id, song_id, created_at)
+            SELECT ?, id, ? FROM songs WHERE artist_norm = ? AND track_norm = ?
+        ''', (video_id, datetime.now().isoformat(), *song['key']))
+
+    entry = {k: song[k] for k in ('lyrics', 'artist', 'track', 'source')}
+    lyrics_writer.submit(('video_song', video_id), write, entry)
+    lyrics_lru.put(video_id, entry, _lyrics_entry_size(entry))
+
+# Videos that no provider has lyrics for are remembered so each play doesn't
+# re-run the whole provider fan-out. The re-check interval doubles with every
+# repeated miss, from LYRICS_MISS_TTL up to LYRICS_MISS_MAX_TTL.
+LYRICS_MISS_TTL = int(os.environ.get('LYRICS_MISS_TTL', 2 * 3600))
+LYRICS_MISS_MAX_TTL = int(os.environ.get('LYRICS_MISS_MAX_TTL', 7 * 24 * 3600))
+
+def get_lyrics_miss(video_id):
+    """Return when a known miss should be re-checked, or None if it's due (or unknown)."""
+    retry_at = lyrics_writer.pending(('miss', video_id))
+    if retry_at:
+        return retry_at
+    try:
+        with get_db() as conn:
+            c = conn.cursor()
+            c.execute('SELECT retry_at FROM lyrics_misses WHERE video_id = ?', (video_id,))
+            row = c.fetchone()
+        if row and row[0] > time.time():
+            return row[0]
+    except Exception as e:
+        print(f"[DB ERROR] {e}")
+    return None
+
+def record_lyrics_miss(video_id, search_key):
+    """Remember that no provider had lyrics, backing off on repeated misses."""
+    def write(c):
+        c.execute('SELECT misses FROM lyrics_misses WHERE video_id = ?', (video_id,))
+        row = c.fetchone()
+        misses = (row[0] if row else 0) + 1
+        ttl = min(LYRICS_MISS_TTL * 2 ** (misses - 1), LYRICS_MISS_MAX_TTL)
+        c.execute('''
+            INSERT OR REPLACE INTO lyrics_misses
+            (video_id, search_key, misses, retry_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (video_id, normalize_name(search_key), misses, time.time() + ttl, datetime.now().isoformat()))
+        print(f"[DB] Recorded lyrics miss #{misses} for {video_id}, re-check in {ttl // 3600}h")
+
+    # The backoff is only known once written; readers meanwhile see the shortest one
+    lyrics_writer.submit(('miss', video_id), write, time.time() + LYRICS_MISS_TTL)
+
+
+# ============================================
+# Lyrics Database Maintenance
+# ============================================
+# lyrics_cache would otherwise grow without bound on a small disk. Provider
+# rows not used for LYRICS_CACHE_MAX_AGE_DAYS are evicted, then the least
+# recently used ones until the stored lyrics fit in LYRICS_CACHE_MAX_MB.
+# Manual entries are never evicted. updated_at doubles as "last used": a DB
+# hit older than LYRICS_TOUCH_AFTER refreshes it through the write-behind
+# queue. Maintenance (eviction, incremental vacuum, ANALYZE, FTS merge) runs
+# every LYRICS_MAINTENANCE_INTERVAL seconds, via POST /api/maintenance, or
+# with `python server.py maintenance`. Only one process runs the schedule:
+# whichever worker holds the MAINTENANCE_LOCK file lock; the others retry it
+# every interval, so the schedule moves on if that worker exits.
+LYRICS_CACHE_MAX_AGE_DAYS = int(os.environ.get('LYRICS_CACHE_MAX_AGE_DAYS', 180))
+LYRICS_CACHE_MAX_MB = int(os.environ.get('LYRICS_CACHE_MAX_MB', 128))
+LYRICS_TOUCH_AFTER = 24 * 3600
+LYRICS_MAINTENANCE_INTERVAL = int(os.environ.get('LYRICS_MAINTENANCE_INTERVAL', 6 * 3600))
+MAINTENANCE_TOKEN = os.environ.get('MAINTENANCE_TOKEN', '')
+MAINTENANCE_LOCK = os.path.join(DATA_DIR, 'maintenance.lock')
+
+def touch_cached_lyrics(video_id, updated_at):
+    """Mark a cached row as recently used so eviction keeps it."""
+    try:
+        last = datetime.fromisoformat(updated_at).timestamp() if updated_at else 0
+    except ValueError:
+        last = 0
+    if time.time() - last < LYRICS_TOUCH_AFTER:
+        return
+
+    def write(c):
+        c.execute('UPDATE lyrics_cache SET updated_at = ? WHERE video_id = ?',
+                  (datetime.now().isoformat(), video_id))
+
+    lyrics_writer.submit(('touch', video_id), write)
+
+def evict_lyrics_cache(c):
+    """Apply the age and size limits to provider rows; returns counts of rows removed."""
+    from datetime import timedelta
+    cutoff = (datetime.now() - timedelta(days=LYRICS_CACHE_MAX_AGE_DAYS)).isoformat()
+    c.execute("DELETE FROM lyrics_cache WHERE source != 'manual' AND updated_at < ?", (cutoff,))
+    by_age = c.rowcount
+
+    c.execute('SELECT COALESCE(SUM(LENGTH(lyrics_text)), 0) FROM lyrics_cache')
+    excess = c.fetchone()[0] - LYRICS_CACHE_MAX_MB * 1024 * 1024
+    by_size = 0
+    if excess > 0:
+        # Oldest provider rows whose running total still falls short of the excess, plus the one crossing it
+        c.execute('''
+            DELETE FROM lyrics_cache WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, LENGTH(lyrics_text) AS size,
+                           SUM(LENGTH(lyrics_text)) OVER (ORDER BY updated_at, rowid) AS running
+                    FROM lyrics_cache WHERE source != 'manual'
+                ) WHERE running - size < ?
+            )
+        ''', (excess,))
+        by_size = c.rowcount
+
+    # Songs whose lyrics were evicted, and uploads mapped onto them
+    c.execute('DELETE FROM songs WHERE video_id NOT IN (SELECT video_id FROM lyrics_cache)')
+    orphaned_songs = c.rowcount
+    c.execute('DELETE FROM video_songs WHERE song_id NOT IN (SELECT id FROM songs)')
+
+    # Misses whose re-check is long overdue carry no backoff information any more
+    c.execute('DELETE FROM lyrics_misses WHERE retry_at < ?', (time.time() - LYRICS_MISS_MAX_TTL,))
+    return {'by_age': by_age, 'by_size': by_size, 'songs': orphaned_songs, 'stale_misses': c.rowcount}
+
+def lyrics_db_stats(c):
+    """Row counts and space usage of the lyrics database."""
+    tables = {}
+    for table in ('lyrics_cache', 'manual_lyrics', 'songs', 'video_songs', 'lyrics_misses', 'lyrics_dicts',
+                  'instance_health'):
+        c.execute(f'SELECT COUNT(*) FROM {table}')
+        tables[table] = c.fetchone()[0]
+    c.execute('SELECT COALESCE(SUM(LENGTH(lyrics_text)), 0) FROM lyrics_cache')
+    lyrics_bytes = c.fetchone()[0]
+    c.execute('SELECT MIN(updated_at) FROM lyrics_cache')
+    oldest = c.fetchone()[0]
+    pragmas = {}
+    for pragma in ('page_count', 'freelist_count', 'page_size'):
+        c.execute(f'PRAGMA {pragma}')
+        pragmas[pragma] = c.fetchone()[0]
+    return {
+        'schema_version': schema_version(c),
+        'rows': tables,
+        'lyrics_bytes': lyrics_bytes,
+        'oldest_cached': oldest,
+        'db_bytes': pragmas['page_count'] * pragmas['page_size'],
+        'free_bytes': pragmas['freelist_count'] * pragmas['page_size'],
+    }
+
+def run_maintenance():
+    """Evict, reclaim free pages and refresh planner statistics; returns a report."""
+    started = time.time()
+    lyrics_writer.flush()
+    conn = get_db()
+    with conn:
+        c = conn.cursor()
+        evicted = evict_lyrics_cache(c)
+        for fts in FTS_TABLES:
+            c.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize')")
+    c.execute('PRAGMA freelist_count')
+    free_pages = c.fetchone()[0]
+    c.execute('PRAGMA auto_vacuum')
+    vacuumed = c.fetchone()[0] != 2
+    if vacuumed:
+        # Only a full VACUUM switches an existing file to incremental auto-vacuum
+        c.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        c.execute('VACUUM')
+    else:
+        c.execute('PRAGMA incremental_vacuum').fetchall()
+    c.execute('ANALYZE')
+    conn.commit()
+    c.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    report = {
+        'evicted': evicted,
+        'freed_pages': free_pages,
+        'vacuumed': vacuumed,
+        'duration': round(time.time() - started, 3),
+        **lyrics_db_stats(c),
+    }
+    print(f"[DB] Maintenance: evicted {evicted}, freed {free_pages} pages in {report['duration']}s")
+    return report
+
+def _take_maintenance_lock():
+    """Exclusively lock MAINTENANCE_LOCK: the open file (True without fcntl), or None if another process has it."""
+    if fcntl is None:
+        return True  # no cross-process locking here; single-process deployments
+    lock_file = open(MAINTENANCE_LOCK, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def _maintenance_loop():
+    lock = None
+    while True:
+        time.sleep(LYRICS_MAINTENANCE_INTERVAL)
+        # Held for the life of the process; released by the OS when it exits
+        lock = lock or _take_maintenance_lock()
+        if not lock:
+            continue
+        try:
+            run_maintenance()
+        except Exception as e:
+            print(f"[DB ERROR] Maintenance failed: {e}")
+
+if LYRICS_MAINTENANCE_INTERVAL > 0:
+    threading.Thread(target=_maintenance_loop, name='db-maintenance', daemon=True).start()
+
+
+# ============================================
+# Request Coalescing
+# ============================================
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait and receive the same result (or exception).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn(*args, **kwargs)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['event'].set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls),
+            }
+
+
+_search_flight = SingleFlight('search')
+_lyrics_flight = SingleFlight('lyrics')
+_stream_flight = SingleFlight('stream')
+
+
+def lyrics_flight_key(video_id, video_title, duration):
+    """Key for _lyrics_flight: only calls with the same video, title and duration share a result.
+
+    The deadline is deliberately not part of it; a follower gets the
+    leader's result within the leader's budget.
+    """
+    return video_id, text_normalize.name_key(video_title), round(duration) if duration else None
+
 
 # Configure yt-dlp
 SEARCH_OPTS = {
@@ -162,30 +1132,8 @@ def search_youtube():
     if not query:
         return jsonify({'error': 'Missing search query'}), 400
 
-    print(f"Searching for: {query}")
     try:
-        with yt_dlp.YoutubeDL(SEARCH_OPTS) as ydl:
-            search_results = ydl.extract_info(f"ytsearch20:{query}", download=False)
-            if not search_results:
-                return jsonify([])
-
-            results = []
-            entries = search_results.get('entries', [])
-            print(f"Found {len(entries)} entries.")
-
-            for entry in entries:
-                if entry:
-                    thumb = entry.get('thumbnail')
-                    if not thumb and entry.get('thumbnails'):
-                        thumb = entry.get('thumbnails')[-1].get('url')
-
-                    results.append({
-                        'id': entry.get('id'),
-                        'title': entry.get('title'),
-                        'thumbnail': thumb,
-                        'url': f"https://www.youtube.com/watch?v={entry.get('id')}"
-                    })
-            return jsonify(results)
+        return jsonify(_search_flight.do(query, search_videos, query))
     except Exception as e:
         import traceback
         print(f"Search error details: {e}")
@@ -193,6 +1141,36 @@ def search_youtube():
         return jsonify({'error': str(e)}), 500
 
 
+def search_videos(query):
+    """Run a yt-dlp YouTube search and return the result cards."""
+    print(f"Searching for: {query}")
+    with yt_dlp.YoutubeDL(SEARCH_OPTS) as ydl:
+        search_results = ydl.extract_info(f"ytsearch20:{query}", download=False)
+        if not search_results:
+            return []
+
+        results = []
+        entries = [entry for entry in search_results.get('entries', []) if entry]
+        print(f"Found {len(entries)} entries.")
+
+        parsed = title_parser.parse_titles([entry.get('title') or '' for entry in entries])
+        for entry, (artist, track) in zip(entries, parsed):
+            thumb = entry.get('thumbnail')
+            if not thumb and entry.get('thumbnails'):
+                thumb = entry.get('thumbnails')[-1].get('url')
+
+            results.append({
+                'id': entry.get('id'),
+                'title': entry.get('title'),
+                'artist': artist,
+                'track': track,
+                'duration': entry.get('duration'),
+                'thumbnail': thumb,
+                'url': f"https://www.youtube.com/watch?v={entry.get('id')}"
+            })
+        return results
+
+
 @app.route('/api/video_info', methods=['GET'])
 def get_video_info():
     """Get info for a single video from a direct URL."""
@@ -214,6 +1192,7 @@ def get_video_info():
             return jsonify({
                 'id': info.get('id'),
                 'title': info.get('title'),
+                'duration': info.get('duration'),
                 'thumbnail': thumb,
                 'url': url
             })
@@ -229,34 +1208,62 @@ def get_stream_url():
     We signal proxy_unavailable so the client can fall back to YouTube embed quickly.
     """
     video_id = request.args.get('id', '').strip()
+    mode = 'audio' if request.args.get('mode') == 'audio' else 'av'
     if not video_id:
         return jsonify({'error': 'Missing video ID'}), 400
+    key = media_key(video_id, mode)
 
     if IS_RENDER:
+        cached = get_cached_stream(key)
+        if cached:
+            print(f"[STREAM_URL] Render: returning cached {cached['source']} stream URL")
+            return jsonify({'url': cached['url'], 'direct': True})
+
         # Try to resolve a direct stream URL from Piped/Invidious right here
         # so the client gets a usable URL without an extra round-trip
-        piped = get_piped_stream(video_id)
-        if piped and piped.get('url'):
-            stream_url = piped['url']
-            if piped.get('type') == 'hls':
-                print(f"[STREAM_URL] Render: returning HLS URL via Piped")
-                return jsonify({'url': stream_url, 'direct': True})
-            print(f"[STREAM_URL] Render: returning direct Piped stream URL")
-            return jsonify({'url': stream_url, 'direct': True})
-
-        inv = get_invidious_stream(video_id)
-        if inv and inv.get('url'):
-            print(f"[STREAM_URL] Render: returning direct Invidious stream URL")
-            return jsonify({'url': inv['url'], 'direct': True})
+        if STREAM_RESOLVER_MODE == 'hedged':
+            resolved = _stream_flight.do(f"hedged:{key}", resolve_stream_hedged, video_id, mode)
+            if resolved:
+                cache_stream(key, resolved)
+                print(f"[STREAM_URL] Render: returning {resolved['type']} {resolved['source']} stream URL")
+                return jsonify({'url': resolved['url'], 'direct': True})
+        else:
+            piped = _stream_flight.do(f"piped:{key}", resolve_stream_piped, video_id, mode)
+            if piped:
+                cache_stream(key, piped)
+                if piped.get('type') == 'hls':
+                    print(f"[STREAM_URL] Render: returning HLS URL via Piped")
+                    return jsonify({'url': piped['url'], 'direct': True})
+                print(f"[STREAM_URL] Render: returning direct Piped stream URL")
+                return jsonify({'url': piped['url'], 'direct': True})
+
+            inv = _stream_flight.do(f"invidious:{key}", resolve_stream_invidious, video_id, mode)
+            if inv:
+                cache_stream(key, inv)
+                print(f"[STREAM_URL] Render: returning direct Invidious stream URL")
+                return jsonify({'url': inv['url'], 'direct': True})
 
         # No external stream found – tell the client to use YouTube embed
         print(f"[STREAM_URL] Render: no stream found, signalling proxy_unavailable")
         return jsonify({'error': 'proxy_unavailable', 'proxy_unavailable': True}), 503
 
     # Local/non-Render: use the server-side proxy (yt-dlp works fine)
+    if mode == 'audio':
+        return jsonify({'url': f"/proxy_stream?v={video_id}&mode=audio"})
     return jsonify({'url': f"/proxy_stream?v={video_id}"})
 
 
+def duration_arg():
+    """The optional ?duration= (seconds); None if absent, ValueError unless finite and positive."""
+    raw = request.args.get('duration', '').strip()
+    if not raw:
+        return None
+    duration = float(raw)
+    if not math.isfinite(duration) or duration <= 0:
+        raise ValueError(f"duration must be a positive number of seconds, got {raw!r}")
+    return duration
+
+
 @app.route('/api/subtitles', methods=['GET'])
 def get_subtitles():
     """Get lyrics for a YouTube video - returns plain text for scroll view."""
@@ -265,137 +1272,166 @@ def get_subtitles():
     
     if not video_id:
         return jsonify({'error': 'Missing video ID'}), 400
+    try:
+        duration = duration_arg()  # Optional: video length in seconds
+    except ValueError:
+        return jsonify({'error': 'Invalid duration'}), 400
     
+    # The budget starts when the request arrives and bounds every provider call
+    deadline = http_client.Deadline(LYRICS_BUDGET)
+    try:
+        return jsonify(_lyrics_flight.do(lyrics_flight_key(video_id, video_title, duration),
+                                         lookup_lyrics, video_id, video_title, deadline, duration))
+    except Exception as e:
+        import traceback
+        print(f"[LYRICS ERROR] {e}")
+        traceback.print_exc()
+        return jsonify({'available': False, 'error': str(e)})
+
+
+def lookup_lyrics(video_id, video_title='', deadline=None, duration=None):
+    """Resolve lyrics for a video (cache, manual DB, then providers) as a response dict.
+
+    Providers share the deadline (LYRICS_BUDGET by default); if it runs out,
+    the best result found so far is returned with 'partial' set. The video's
+    duration (seconds), when known, helps providers pick the right version.
+    """
+    deadline = deadline or http_client.Deadline(LYRICS_BUDGET)
     url = f"https://www.youtube.com/watch?v={video_id}"
     print(f"--- [LYRICS] Fetching for: {video_id} ---")
     
-    try:
-        # Check database cache first
-        cached = get_cached_lyrics(video_id)
-        if cached:
-            print(f"[LYRICS] Found in cache: {cached['source']}")
-            return jsonify({
-                'available': True,
-                'lyrics': cached['lyrics'],
-                'artist': cached['artist'],
-                'track': cached['track'],
-                'source': cached['source'] + ' (cached)'
-            })
-        
-        artist = ''
-        track = ''
-        
-        # If title provided, use it directly (faster)
-        if video_title:
-            print(f"[LYRICS] Using provided title: {video_title}")
-        elif IS_RENDER:
-            # On Render, yt-dlp is bot-detected – skip it.
-            # The client always passes ?title=... so this is a last-resort guard.
-            print(f"[LYRICS] Render: no title provided and yt-dlp disabled, using video_id as fallback key")
-            video_title = video_id  # triggers extract_song_info with an ID, which returns nothing useful but won't crash
-        else:
-            # Get video info via yt-dlp (slower, local only)
-            try:
-                with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    video_title = info.get('title', '')
-                    artist = info.get('artist', '') or info.get('creator', '') or ''
-                    track = info.get('track', '')
-            except Exception as e:
-                print(f"[LYRICS] yt-dlp failed: {e}")
-                return jsonify({
-                    'available': False,
-                    'lyrics': '',
-                    'artist': '',
-                    'track': '',
-                    'source': 'error'
-                })
-        
-        print(f"[LYRICS] Video: {video_title}, Artist: {artist}, Track: {track}")
-        
-        # Extract song info from title
-        extracted_artist, extracted_track = extract_song_info(video_title)
-        if not artist:
-            artist = extracted_artist
-        if not track:
-            track = extracted_track
-        
-        # Check for manual lyrics in database
-        search_key = f"{artist} {track}".strip() or video_title
-        manual = search_manual_lyrics(search_key)
-        if manual:
-            print(f"[LYRICS] Found manual lyrics in database")
-            save_lyrics_to_cache(video_id, video_title, manual['artist'], manual['track'], 'manual', manual['lyrics'])
-            return jsonify({
-                'available': True,
-                'lyrics': manual['lyrics'],
-                'artist': manual['artist'],
-                'track': manual['track'],
-                'source': 'database'
-            })
-        
-        # Try to fetch from external sources
-        lyrics_text = None
-        source = None
-
-        # Step 1: Try LRCLIB first for ALL songs - global, fast, covers Chinese & English
+    # Check database cache first
+    cached = get_cached_lyrics(video_id)
+    if cached:
+        print(f"[LYRICS] Found in cache: {cached['source']}")
+        return {
+            'available': True,
+            'lyrics': cached['lyrics'],
+            'artist': cached['artist'],
+            'track': cached['track'],
+            'source': cached['source'] + ' (cached)'
+        }
+    
+    artist = ''
+    track = ''
+    
+    # If title provided, use it directly (faster)
+    if video_title:
+        print(f"[LYRICS] Using provided title: {video_title}")
+    elif IS_RENDER:
+        # On Render, yt-dlp is bot-detected – skip it.
+        # The client always passes ?title=... so this is a last-resort guard.
+        print(f"[LYRICS] Render: no title provided and yt-dlp disabled, using video_id as fallback key")
+        video_title = video_id  # parses to a track named after the ID, which returns nothing useful but won't crash
+    else:
+        # Get video info via yt-dlp (slower, local only)
         try:
-            lrclib_result = search_lyrics_lrclib_simple(artist, track, video_title)
-            if lrclib_result and lrclib_result.get('lyrics'):
-                lyrics_text = lrclib_result['lyrics']
-                source = lrclib_result['source']
-                artist = lrclib_result.get('artist', artist)
-                track = lrclib_result.get('track', track)
-                print(f'[LYRICS] LRCLIB hit: {artist} - {track}')
+            ydl_opts = {'quiet': True, 'no_warnings': True,
+                        'socket_timeout': max(deadline.remaining(), 1)}
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+                video_title = info.get('title', '')
+                artist = info.get('artist', '') or info.get('creator', '') or ''
+                track = info.get('track', '')
+                duration = duration or info.get('duration')
         except Exception as e:
-            print(f'[LYRICS] LRCLIB failed: {e}')
-
-        # Step 2: If LRCLIB missed, use language-specific sources (fetched in parallel)
-        if not lyrics_text:
-            is_chinese = contains_chinese(video_title)
-
-            if is_chinese:
-                result = fetch_chinese_lyrics_parallel(artist, track, video_title)
-                if result:
-                    lyrics_text = result['lyrics']
-                    source = result['source']
-                    artist = result.get('artist', artist)
-                    track = result.get('track', track)
-
-        if not lyrics_text:
-            result = fetch_english_lyrics(artist, track, video_title)
-            if result:
-                lyrics_text = result['lyrics']
-                source = result['source']
-                artist = result.get('artist', artist)
-                track = result.get('track', track)
-        
-        if lyrics_text:
-            # Save to cache
-            save_lyrics_to_cache(video_id, video_title, artist, track, source, lyrics_text)
-            return jsonify({
-                'available': True,
-                'lyrics': lyrics_text,
-                'artist': artist,
-                'track': track,
-                'source': source
-            })
-        
+            print(f"[LYRICS] yt-dlp failed: {e}")
+            return {
+                'available': False,
+                'lyrics': '',
+                'artist': '',
+                'track': '',
+                'source': 'error'
+            }
+    
+    duration = duration or cached_stream_duration(video_id)
+    print(f"[LYRICS] Video: {video_title}, Artist: {artist}, Track: {track}, Duration: {duration}")
+    
+    # Extract song info from title
+    extracted_artist, extracted_track = title_parser.parse_title(video_title)
+    if not artist:
+        artist = extracted_artist
+    if not track:
+        track = extracted_track
+    
+    # Check for manual lyrics in database
+    search_key = f"{artist} {track}".strip() or video_title
+    manual = search_manual_lyrics(search_key)
+    if manual:
+        print(f"[LYRICS] Found manual lyrics in database")
+        save_lyrics_to_cache(video_id, video_title, manual['artist'], manual['track'], 'manual', manual['lyrics'],
+                             song=(artist, track))
+        return {
+            'available': True,
+            'lyrics': manual['lyrics'],
+            'artist': manual['artist'],
+            'track': manual['track'],
+            'source': 'database'
+        }
+    
+    # Another upload of a song that already has lyrics
+    song = find_song_lyrics(artist, track)
+    if song:
+        print(f"[LYRICS] Found song {song['artist']} - {song['track']} (song #{song['song_id'] or 'pending'})")
+        map_video_to_song(video_id, song)
+        return {
+            'available': True,
+            'lyrics': song['lyrics'],
+            'artist': song['artist'],
+            'track': song['track'],
+            'source': song['source'] + ' (cached)'
+        }
+
+    # Known miss: don't go upstream again until its re-check time
+    retry_at = get_lyrics_miss(video_id)
+    if retry_at:
+        print(f"[LYRICS] Known miss, re-check in {int(retry_at - time.time())}s")
+        return {
+            'available': False,
+            'lyrics': '',
+            'artist': artist,
+            'track': track,
+            'source': 'none (cached)'
+        }
+
+    # Try to fetch from external sources
+    lyrics_text = None
+    source = None
+    title_song = (artist, track)
+
+    result, complete = resolve_lyrics(artist, track, video_title, deadline, duration)
+    if result:
+        lyrics_text = result['lyrics']
+        source = result['source']
+        artist = result.get('artist', artist)
+        track = result.get('track', track)
+
+    if lyrics_text:
+        # Save to cache
+        save_lyrics_to_cache(video_id, video_title, artist, track, source, lyrics_text, song=title_song)
+        response = {
+            'available': True,
+            'lyrics': lyrics_text,
+            'artist': artist,
+            'track': track,
+            'source': source
+        }
+    else:
         # No lyrics found
         print(f"[LYRICS] No lyrics found for: {video_title}")
-        return jsonify({
+        if complete:
+            # Only a definite miss from every provider counts; errors and cut-off searches are retried next time
+            record_lyrics_miss(video_id, search_key)
+        response = {
             'available': False,
             'lyrics': '',
             'artist': artist,
             'track': track,
             'source': 'none'
-        })
-            
-    except Exception as e:
-        import traceback
-        print(f"[LYRICS ERROR] {e}")
-        traceback.print_exc()
-        return jsonify({'available': False, 'error': str(e)})
+        }
+    if not complete:
+        response['partial'] = True
+    return response
 
 
 @app.route('/api/save_lyrics', methods=['POST'])
@@ -413,30 +1449,42 @@ def save_lyrics():
     if not lyrics:
         return jsonify({'error': 'No lyrics provided'}), 400
     
+    # This write wins over any provider result or miss still queued for the video
+    lyrics_writer.discard(('lyrics', video_id))
+    lyrics_writer.discard(('miss', video_id))
+    lyrics_writer.discard(('video_song', video_id))
+
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        now = datetime.now().isoformat()
+        with get_db() as conn:
+            c = conn.cursor()
+            now = datetime.now().isoformat()
         
-        # Save to manual_lyrics table
-        search_key = f"{artist} {track}".strip().lower()
-        if search_key:
-            c.execute('''
-                INSERT OR REPLACE INTO manual_lyrics 
-                (search_key, artist, track, lyrics_text, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (search_key, artist, track, lyrics, now))
+            # Save to manual_lyrics table
+            search_key = text_normalize.search_key(artist, track)
+            if search_key:
+                c.execute('''
+                    INSERT OR REPLACE INTO manual_lyrics 
+                    (search_key, artist, track, lyrics_text, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (search_key, artist, track, compress_lyrics(lyrics), now))
         
-        # Also save to cache if video_id provided
-        if video_id:
-            c.execute('''
-                INSERT OR REPLACE INTO lyrics_cache 
-                (video_id, video_title, artist, track, source, lyrics_text, created_at, updated_at)
-                VALUES (?, ?, ?, ?, 'manual', ?, ?, ?)
-            ''', (video_id, f"{artist} - {track}", artist, track, lyrics, now, now))
+            # New lyrics end any backoff on this video or song
+            c.execute('DELETE FROM lyrics_misses WHERE video_id = ? OR search_key = ?', (video_id, search_key))
+
+            # Also save to cache if video_id provided
+            if video_id:
+                c.execute('''
+                    INSERT OR REPLACE INTO lyrics_cache 
+                    (video_id, video_title, artist, track, source, lyrics_text, created_at, updated_at,
+                     artist_norm, track_norm)
+                    VALUES (?, ?, ?, ?, 'manual', ?, ?, ?, ?, ?)
+                ''', (video_id, f"{artist} - {track}", artist, track, compress_lyrics(lyrics), now, now,
+                      normalize_name(artist), normalize_name(track)))
+                # Other uploads of this song now get the manual lyrics too
+                save_song(c, artist, track, video_id, replace=True)
         
-        conn.commit()
-        conn.close()
+        if video_id:
+            lyrics_lru.pop(video_id)
         
         print(f"[DB] Saved manual lyrics: {artist} - {track}")
         return jsonify({'success': True, 'message': 'Lyrics saved'})
@@ -446,84 +1494,355 @@ def save_lyrics():
         return jsonify({'error': str(e)}), 500
 
 
-def fetch_chinese_lyrics(artist, track, video_title):
-    """Fetch Chinese lyrics from multiple sources sequentially (kept for compatibility)."""
-    return fetch_chinese_lyrics_parallel(artist, track, video_title)
+@app.route('/api/lyrics_search', methods=['GET'])
+def lyrics_search():
+    """Find songs in the lyrics database by a remembered lyric line."""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    if not query:
+        return jsonify({'error': 'Missing query'}), 400
+
+    try:
+        return jsonify({'results': search_lyrics_text(query, limit)})
+    except Exception as e:
+        print(f"[DB SEARCH ERROR] {e}")
+        return jsonify({'error': str(e)}), 500
+
 
+def search_lyrics_text(query, limit=10):
+    """Rank cached and manual lyrics containing every word of query."""
+    match = fts_query(query)
+    if not match:
+        return []
+    match = f'{{lyrics}} : ({match})'
 
-def fetch_chinese_lyrics_parallel(artist, track, video_title):
-    """Fetch Chinese lyrics from multiple sources IN PARALLEL to avoid timeouts."""
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    print(f"[CHINESE] Parallel search: artist='{artist}', track='{track}'")
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT l.video_id, l.video_title, l.artist, l.track, l.source, l.lyrics_text, rank
+            FROM lyrics_cache_fts JOIN lyrics_cache l ON l.rowid = lyrics_cache_fts.rowid
+            WHERE lyrics_cache_fts MATCH ? ORDER BY rank LIMIT ?
+        ''', (match, limit))
+        cached = c.fetchall()
+        c.execute('''
+            SELECT m.artist, m.track, m.lyrics_text, rank
+            FROM manual_lyrics_fts JOIN manual_lyrics m ON m.id = manual_lyrics_fts.rowid
+            WHERE manual_lyrics_fts MATCH ? ORDER BY rank LIMIT ?
+        ''', (match, limit))
+        manual = c.fetchall()
 
-    def try_netease():
-        try:
-            return search_lyrics_netease(artist, track)
-        except Exception as e:
-            print(f"[CHINESE] NetEase error: {e}")
-            return None
+    hits = [(row[6], {'video_id': row[0], 'title': row[1], 'artist': row[2], 'track': row[3],
+                      'source': row[4], 'line': matching_line(row[5], query)})
+            for row in cached]
+    # Manual entries are usually also cached under a video; list them once
+    seen = {text_normalize.search_key(h['artist'], h['track']) for _, h in hits}
+    for artist, track, lyrics, rank in manual:
+        if text_normalize.search_key(artist, track) not in seen:
+            hits.append((rank, {'video_id': None, 'title': f"{artist} - {track}", 'artist': artist,
+                                'track': track, 'source': 'manual', 'line': matching_line(lyrics, query)}))
 
-    def try_netease_track_only():
-        if not artist:
-            return None
-        try:
-            return search_lyrics_netease('', track)
-        except Exception as e:
-            print(f"[CHINESE] NetEase (track-only) error: {e}")
-            return None
+    hits.sort(key=lambda hit: hit[0])
+    return [hit for _, hit in hits[:limit]]
 
-    def try_genius():
-        try:
-            return search_lyrics_genius(artist, track)
-        except Exception as e:
-            print(f"[CHINESE] Genius error: {e}")
-            return None
 
-    def try_kugou():
+def matching_line(lyrics, query):
+    """The lyric line sharing the most words with query."""
+    wanted = set(text_normalize.tokens(query))
+    best, best_score = None, 0
+    for line in (decompress_lyrics(lyrics) or '').split('\n'):
+        score = len(wanted & set(text_normalize.tokens(line)))
+        if score > best_score:
+            best, best_score = line.strip(), score
+    return best
+
+
+# ============================================
+# Lyrics Resolution
+# ============================================
+# Every provider that applies to a song is started at once on a shared pool
+# and the results are taken in priority order: a hit is returned as soon as
+# every higher-priority provider has finished without one. A total miss then
+# costs the slowest provider instead of the sum of all of them. Calls are
+# memoized per request so the same provider/arguments never run twice.
+#
+# Once a request has its answer (or its LYRICS_BUDGET runs out and it settles
+# for the best result so far) it signals its remaining calls to stop: queued
+# ones are skipped and running ones bail out at their next lyrics_cancelled()
+# check, so stragglers don't hold pool threads for nothing. The request's
+# deadline is installed around each call, so every upstream timeout is capped
+# by the budget that is left.
+LYRICS_POOL_SIZE = int(os.environ.get('LYRICS_POOL_SIZE', 12))
+LYRICS_BUDGET = float(os.environ.get('LYRICS_BUDGET', 10))
+
+# Providers that search first and then fetch lyrics per candidate (NetEase,
+# Kugou) evaluate their top candidates concurrently. That runs on a separate
+# pool: a provider blocking on lyrics_pool for its own sub-tasks could starve
+# it. The result is taken in search-rank order, the first acceptable one
+# wins and the remaining candidates are cancelled.
+CANDIDATE_POOL_SIZE = int(os.environ.get('CANDIDATE_POOL_SIZE', 16))
+NETEASE_CANDIDATES = int(os.environ.get('NETEASE_CANDIDATES', 3))
+KUGOU_CANDIDATES = int(os.environ.get('KUGOU_CANDIDATES', 5))
+CANDIDATE_POLL = 0.25
+
+# Candidates are ranked by how closely their artist/track names match the
+# song and, when the video's duration is known, how close their length is.
+# Videos often run a little longer than the audio (intros, outros), so the
+# penalty grows gradually: CANDIDATE_DURATION_SCALE seconds off costs as
+# much as a completely different name.
+CANDIDATE_DURATION_SCALE = 30
+
+_provider_context = threading.local()
+
+
+class ProviderError(Exception):
+    """A provider could not answer (network error, bad status, cut off).
+
+    Unlike a provider returning None, this is not evidence that the song has
+    no lyrics, so it is never recorded as a miss.
+    """
+
+
+def require_ok(response, name, misses=(404,)):
+    """True on 200, False when the status means "not found"; ProviderError otherwise."""
+    if response.status_code == 200:
+        return True
+    if response.status_code in misses:
+        return False
+    raise ProviderError(f"{name} returned HTTP {response.status_code}")
+
+
+def lyrics_cancelled():
+    """True when the request a provider call is serving no longer needs it."""
+    cancel = getattr(_provider_context, 'cancel', None)
+    if cancel is not None and cancel.is_set():
+        return True
+    deadline = http_client.current_deadline()
+    return deadline is not None and deadline.expired()
+
+
+class ProviderPool:
+    """Process-wide pool for lyrics provider calls, with saturation counters."""
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lyrics')
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._peak_active = 0
+        self._submitted = 0
+        self._saturated = 0
+        self._skipped = 0
+        self._stragglers = 0
+
+    def submit(self, fn, args, cancel, deadline=None):
+        with self._lock:
+            self._submitted += 1
+            if self._active + self._queued >= self.max_workers:
+                # No idle thread: this call waits behind others
+                self._saturated += 1
+            self._queued += 1
+        return self._executor.submit(self._run, fn, args, cancel, deadline)
+
+    def _run(self, fn, args, cancel, deadline):
+        with self._lock:
+            self._queued -= 1
+            if cancel.is_set():
+                self._skipped += 1
+                raise ProviderError('cancelled before it started')
+            self._active += 1
+            self._peak_active = max(self._peak_active, self._active)
+
+        _provider_context.cancel = cancel
         try:
-            return search_lyrics_kugou(artist, track)
-        except Exception as e:
-            print(f"[CHINESE] Kugou error: {e}")
-            return None
+            with http_client.deadline_scope(deadline):
+                result = fn(*args)
+                if result is None and lyrics_cancelled():
+                    # Gave up early; says nothing about whether lyrics exist
+                    raise ProviderError('cancelled')
+                return result
+        finally:
+            _provider_context.cancel = None
+            with self._lock:
+                self._active -= 1
+                if cancel.is_set():
+                    self._stragglers += 1
 
-    # Run all sources in parallel; return the first successful result
-    tasks = [try_netease, try_genius, try_kugou, try_netease_track_only]
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = {executor.submit(fn): fn.__name__ for fn in tasks}
-        for future in as_completed(futures, timeout=12):
-            try:
-                result = future.result()
-                if result and result.get('lyrics'):
-                    print(f"[CHINESE] Got result from {futures[future]}")
+    def stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'active': self._active,
+                'queued': self._queued,
+                'peak_active': self._peak_active,
+                'submitted': self._submitted,
+                'saturated': self._saturated,
+                'skipped': self._skipped,
+                'stragglers': self._stragglers,
+            }
+
+
+lyrics_pool = ProviderPool(LYRICS_POOL_SIZE)
+candidate_pool = ProviderPool(CANDIDATE_POOL_SIZE)
+
+
+def first_candidate(name, fetch, candidates):
+    """Run fetch(candidate) for every candidate at once; best-ranked hit, or None.
+
+    Candidates share the calling provider's deadline and are cancelled as
+    soon as a hit is settled or the provider itself is cancelled. If no
+    candidate hits and any of them failed, raises ProviderError.
+    """
+    cancel = threading.Event()
+    futures = [candidate_pool.submit(fetch, (candidate,), cancel, http_client.current_deadline())
+               for candidate in candidates]
+    try:
+        while True:
+            # Rank order: a hit counts once every better-ranked candidate missed
+            failed = 0
+            for future in futures:
+                if not future.done():
+                    break
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"[{name}] Candidate failed: {e}")
+                    failed += 1
+                    continue
+                if result:
                     return result
-            except Exception as e:
-                print(f"[CHINESE] Future {futures[future]} raised: {e}")
+            else:
+                if failed:
+                    raise ProviderError(f"{failed} of {len(futures)} candidates failed")
+                return None
+            if lyrics_cancelled():
+                return None
+            wait([f for f in futures if not f.done()], timeout=CANDIDATE_POLL, return_when=FIRST_COMPLETED)
+    finally:
+        cancel.set()
 
-    return None
 
+def candidate_score(artist, track, duration, cand_artist, cand_track, cand_duration):
+    """How well a search result matches the song: name similarity, less a duration penalty."""
+    from difflib import SequenceMatcher
 
-def fetch_english_lyrics(artist, track, video_title):
-    """Fetch English lyrics from multiple sources, return plain text."""
-    print(f"[ENGLISH] Searching: artist='{artist}', track='{track}'")
-    
-    # Try LRCLIB first (usually most reliable)
-    result = search_lyrics_lrclib_simple(artist, track, video_title)
-    if result and result.get('lyrics'):
-        return result
-    
-    # Try Genius API
-    result = search_lyrics_genius(artist, track)
-    if result and result.get('lyrics'):
-        return result
-    
-    # Try lyrics.ovh as fallback
-    result = search_lyrics_ovh_simple(artist, track)
+    def similarity(a, b):
+        a, b = text_normalize.name_key(a), text_normalize.name_key(b)
+        return SequenceMatcher(None, a, b).ratio() if a and b else 0.0
+
+    score = similarity(track, cand_track)
+    if artist:
+        score = (2 * score + similarity(artist, cand_artist)) / 3
+    if duration and cand_duration:
+        score -= min(abs(duration - cand_duration) / CANDIDATE_DURATION_SCALE, 1.0)
+    return score
+
+
+def rank_candidates(candidates, describe, artist, track, duration=None):
+    """Candidates best first; describe(candidate) returns its (artist, track, seconds).
+
+    Equal scores keep the provider's own search order.
+    """
+    return sorted(candidates, key=lambda c: -candidate_score(artist, track, duration, *describe(c)))
+
+
+class ProviderCalls:
+    """Per-request memo of provider calls, keyed by function and arguments."""
+
+    def __init__(self, deadline=None):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.cancel = threading.Event()
+        self.deadline = deadline
+
+    def submit(self, fn, *args):
+        key = (fn.__name__,) + args
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = lyrics_pool.submit(fn, args, self.cancel, self.deadline)
+                self._calls[key] = future
+            return future
+
+
+def lyrics_plan(artist, track, video_title, duration=None):
+    """Providers applicable to a song as (name, fn, args), highest priority first."""
+    # LRCLIB is global, fast and covers Chinese and English alike
+    plan = [('lrclib', search_lyrics_lrclib_simple, (artist, track, video_title, duration))]
+    if contains_chinese(video_title):
+        plan.append(('netease', search_lyrics_netease, (artist, track, duration)))
+        plan.append(('kugou', search_lyrics_kugou, (artist, track, duration)))
+        if artist:
+            plan.append(('netease (track only)', search_lyrics_netease, ('', track, duration)))
+    plan.append(('genius', search_lyrics_genius, (artist, track)))
+    plan.append(('lyrics.ovh', search_lyrics_ovh_simple, (artist, track)))
+    return plan
+
+
+def provider_result(name, future):
+    """Result of a finished provider call, or None if it missed or failed."""
+    try:
+        result = future.result()
+    except Exception as e:
+        print(f"[LYRICS] {name} failed: {e}")
+        return None
     if result and result.get('lyrics'):
         return result
-    
     return None
 
 
+def resolve_lyrics(artist, track, video_title, deadline=None, duration=None):
+    """Run all applicable providers concurrently within the deadline.
+
+    Returns (result, complete): the best hit or None, and whether every
+    provider gave a definite answer before the deadline (a ProviderError,
+    e.g. an upstream outage or a call cut off by the budget, is not one).
+    """
+    deadline = deadline or http_client.Deadline(LYRICS_BUDGET)
+    calls = ProviderCalls(deadline)
+    plan = [(name, calls.submit(fn, *args))
+            for name, fn, args in lyrics_plan(artist, track, video_title, duration)]
+    started = time.time()
+    print(f"[LYRICS] Racing {', '.join(name for name, _ in plan)}")
+
+    try:
+        while True:
+            # Walk in priority order; stop at the first provider still running
+            for name, future in plan:
+                if not future.done():
+                    break
+                result = provider_result(name, future)
+                if result:
+                    print(f"[LYRICS] {name} hit after {time.time() - started:.1f}s")
+                    return result, True
+            else:
+                failed = [name for name, future in plan if future.exception() is not None]
+                if failed:
+                    print(f"[LYRICS] No hit after {time.time() - started:.1f}s; "
+                          f"{', '.join(failed)} failed")
+                    return None, False
+                print(f"[LYRICS] All providers missed after {time.time() - started:.1f}s")
+                return None, True
+
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                break
+            wait([f for _, f in plan if not f.done()], timeout=remaining, return_when=FIRST_COMPLETED)
+
+        # Out of budget: settle for the best hit among the providers that finished
+        waiting = [name for name, future in plan if not future.done()]
+        print(f"[LYRICS] Budget spent after {time.time() - started:.1f}s waiting for {', '.join(waiting)}")
+        for name, future in plan:
+            if future.done():
+                result = provider_result(name, future)
+                if result:
+                    print(f"[LYRICS] Using {name} result")
+                    return result, False
+        return None, False
+    finally:
+        calls.cancel.set()
+
+
 def search_lyrics_genius(artist, track):
     """Search for lyrics using Genius API."""
     try:
@@ -540,9 +1859,9 @@ def search_lyrics_genius(artist, track):
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         }
         
-        response = requests.get(search_url, params=params, headers=headers, timeout=10)
+        response = http_client.get(search_url, params=params, headers=headers, timeout=10)
         
-        if response.status_code != 200:
+        if not require_ok(response, 'Genius search'):
             print(f"[GENIUS] Search failed: {response.status_code}")
             return None
         
@@ -559,7 +1878,7 @@ def search_lyrics_genius(artist, track):
                     song_title = song.get('title', track)
                     song_artist = song.get('primary_artist', {}).get('name', artist)
                     
-                    if song_url:
+                    if song_url and not lyrics_cancelled():
                         # Fetch lyrics from page
                         lyrics = fetch_genius_lyrics_page(song_url)
                         if lyrics:
@@ -574,7 +1893,7 @@ def search_lyrics_genius(artist, track):
         
     except Exception as e:
         print(f"[GENIUS ERROR] {e}")
-        return None
+        raise ProviderError(str(e)) from e
 
 
 def fetch_genius_lyrics_page(url):
@@ -586,8 +1905,8 @@ def fetch_genius_lyrics_page(url):
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         }
         
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.status_code != 200:
+        response = http_client.get(url, headers=headers, timeout=10)
+        if not require_ok(response, 'Genius page'):
             return None
         
         html = response.text
@@ -625,66 +1944,15 @@ def fetch_genius_lyrics_page(url):
         
     except Exception as e:
         print(f"[GENIUS PAGE ERROR] {e}")
-        return None
+        raise ProviderError(str(e)) from e
 
 
 def contains_chinese(text):
     """Check if text contains Chinese characters."""
-    for char in text:
-        if '\u4e00' <= char <= '\u9fff':
-            return True
-    return False
-
-
-def extract_song_info(video_title):
-    """Extract artist and track from video title with better parsing."""
-    import re
-    
-    original_title = video_title
-    clean_title = video_title
-    
-    # Remove common video title patterns
-    patterns_to_remove = [
-        r'\s*[\(\[【「].*?(?:官方|official|mv|music video|lyric|歌詞|完整版|高音質|hd|4k|1080p|live|現場|演唱會).*?[\)\]】」]',
-        r'\s*[\(\[【「].*?[\)\]】」]',
-        r'\s*[-–—]\s*(?:official|mv|music video|lyric|歌詞).*$',
-        r'\s*\|.*$',
-        r'\s*\/.*$',
-        r'\s*官方.*$',
-        r'\s*MV$',
-        r'\s*Official\s*(?:Music\s*)?(?:Video)?$',
-    ]
-    for pattern in patterns_to_remove:
-        clean_title = re.sub(pattern, '', clean_title, flags=re.IGNORECASE)
-    clean_title = clean_title.strip()
-    
-    artist = ''
-    track = ''
-    
-    # Pattern 1: Artist《Song》or Artist「Song」
-    match = re.match(r'^(.+?)\s*[《「](.+?)[》」]\s*$', clean_title)
-    if match:
-        artist = match.group(1).strip()
-        track = match.group(2).strip()
-        return artist, track
-    
-    # Pattern 2: Artist - Song
-    match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', clean_title)
-    if match:
-        artist = match.group(1).strip()
-        track = match.group(2).strip()
-        return artist, track
-    
-    # Pattern 3: Song - Artist (reverse)
-    # For cases like "歌名 - 歌手"
-    
-    # No separator found, use whole title as track
-    track = clean_title
-    
-    return artist, track
+    return text_normalize.has_han(text)
 
 
-def search_lyrics_netease(artist, track):
+def search_lyrics_netease(artist, track, duration=None):
     """Search for lyrics from NetEase Music API (163 Music) - returns plain text."""
     try:
         import json
@@ -710,9 +1978,9 @@ def search_lyrics_netease(artist, track):
         }
         
         print(f"[NETEASE] Searching: '{search_term}'")
-        response = requests.post(search_url, data=params, headers=headers, timeout=5)
+        response = http_client.post(search_url, data=params, headers=headers, timeout=5)
         
-        if response.status_code != 200:
+        if not require_ok(response, 'NetEase search'):
             print(f"[NETEASE] Search failed: {response.status_code}")
             return None
         
@@ -723,12 +1991,15 @@ def search_lyrics_netease(artist, track):
             return None
         songs = result.get('songs', []) if isinstance(result, dict) else []
         
+        if not songs and lyrics_cancelled():
+            return None
+
         if not songs:
             # Try with just track name (remove artist)
             if artist and track:
                 params['s'] = track
-                response = requests.post(search_url, data=params, headers=headers, timeout=8)
-                if response.status_code == 200:
+                response = http_client.post(search_url, data=params, headers=headers, timeout=8)
+                if require_ok(response, 'NetEase search'):
                     data = response.json()
                     result = data.get('result', {})
                     songs = result.get('songs', []) if isinstance(result, dict) else []
@@ -737,8 +2008,9 @@ def search_lyrics_netease(artist, track):
             print(f"[NETEASE] No songs found")
             return None
         
-        # Try to find lyrics for each song (limit to 3 to keep total time down)
-        for song in songs[:3]:
+        def fetch(song):
+            if lyrics_cancelled():
+                return None
             song_id = song.get('id')
             song_name = song.get('name', '')
             artists = song.get('artists', [])
@@ -746,10 +2018,10 @@ def search_lyrics_netease(artist, track):
             
             # Get lyrics using a different endpoint
             lyrics_url = f"https://music.163.com/api/song/lyric?id={song_id}&lv=1&kv=1&tv=-1"
-            lyrics_response = requests.get(lyrics_url, headers=headers, timeout=4)
+            lyrics_response = http_client.get(lyrics_url, headers=headers, timeout=4)
             
-            if lyrics_response.status_code != 200:
-                continue
+            if not require_ok(lyrics_response, 'NetEase lyrics'):
+                return None
             
             lyrics_data = lyrics_response.json()
             lrc_content = lyrics_data.get('lrc', {}).get('lyric', '')
@@ -765,12 +2037,19 @@ def search_lyrics_netease(artist, track):
                         'track': song_name,
                         'artist': artist_name,
                     }
+            return None
         
-        return None
+        def describe(song):
+            artists = song.get('artists') or [{}]
+            return artists[0].get('name', ''), song.get('name', ''), (song.get('duration') or 0) / 1000
+
+        # Fetch lyrics for the best-matching candidates concurrently
+        ranked = rank_candidates(songs, describe, artist, track, duration)
+        return first_candidate('NETEASE', fetch, ranked[:NETEASE_CANDIDATES])
         
     except Exception as e:
         print(f"[NETEASE ERROR] {e}")
-        return None
+        raise ProviderError(str(e)) from e
 
 
 def lrc_to_plain_text(lrc_content):
@@ -817,7 +2096,7 @@ def search_lyrics_qq(artist, track):
         }
         
         print(f"[QQMUSIC] Searching: '{search_term}'")
-        response = requests.post(search_url, json=payload, headers=headers, timeout=5)
+        response = http_client.post(search_url, json=payload, headers=headers, timeout=5)
         
         if response.status_code != 200:
             print(f"[QQMUSIC] Search failed: {response.status_code}")
@@ -852,7 +2131,7 @@ def search_lyrics_qq(artist, track):
                 'Referer': 'https://y.qq.com/'
             }
             
-            lyrics_response = requests.get(lyrics_url, params=lyrics_params, headers=lyrics_headers, timeout=3)
+            lyrics_response = http_client.get(lyrics_url, params=lyrics_params, headers=lyrics_headers, timeout=3)
             
             if lyrics_response.status_code == 200:
                 try:
@@ -899,7 +2178,7 @@ def search_lyrics_qq(artist, track):
         return None
 
 
-def search_lyrics_kugou(artist, track):
+def search_lyrics_kugou(artist, track, duration=None):
     """Search for synced lyrics from Kugou Music API."""
     try:
         import json
@@ -923,9 +2202,9 @@ def search_lyrics_kugou(artist, track):
         }
         
         print(f"[KUGOU] Searching: '{search_term}'")
-        response = requests.get(search_url, params=params, headers=headers, timeout=5)
+        response = http_client.get(search_url, params=params, headers=headers, timeout=5)
         
-        if response.status_code != 200:
+        if not require_ok(response, 'Kugou search'):
             print(f"[KUGOU] Search failed: {response.status_code}")
             return None
         
@@ -936,13 +2215,12 @@ def search_lyrics_kugou(artist, track):
             print(f"[KUGOU] No songs found")
             return None
         
-        for song in songs[:5]:
+        def fetch(song):
             song_hash = song.get('hash')
             song_name = song.get('songname', '')
             artist_name = song.get('singername', '')
-            
-            if not song_hash:
-                continue
+            if lyrics_cancelled():
+                return None
             
             # Get lyrics - Kugou requires a hash-based lookup
             # First get the accesskey
@@ -956,124 +2234,135 @@ def search_lyrics_kugou(artist, track):
                 'hash': song_hash
             }
             
-            lyrics_response = requests.get(lyrics_search_url, params=lyrics_params, headers=headers, timeout=5)
+            lyrics_response = http_client.get(lyrics_search_url, params=lyrics_params, headers=headers, timeout=5)
+            if not require_ok(lyrics_response, 'Kugou krcs'):
+                return None
             
-            if lyrics_response.status_code == 200:
-                try:
-                    lyrics_data = lyrics_response.json()
-                    candidates = lyrics_data.get('candidates', [])
+            try:
+                candidates = lyrics_response.json().get('candidates', [])
+                if not candidates:
+                    return None
+                
+                # Get the first candidate's lyrics
+                candidate = candidates[0]
+                access_key = candidate.get('accesskey')
+                lrc_id = candidate.get('id')
+                if not access_key or not lrc_id or lyrics_cancelled():
+                    return None
+                
+                # Download the actual lyrics
+                download_url = "https://lyrics.kugou.com/download"
+                download_params = {
+                    'ver': 1,
+                    'client': 'pc',
+                    'id': lrc_id,
+                    'accesskey': access_key,
+                    'fmt': 'lrc',
+                    'charset': 'utf8'
+                }
+                
+                download_response = http_client.get(download_url, params=download_params, headers=headers, timeout=5)
+                if not require_ok(download_response, 'Kugou download'):
+                    return None
+                
+                lrc_content_b64 = download_response.json().get('content', '')
+                if lrc_content_b64:
+                    import base64
+                    lrc_content = base64.b64decode(lrc_content_b64).decode('utf-8')
+                    captions = parse_lrc(lrc_content)
                     
-                    if candidates:
-                        # Get the first candidate's lyrics
-                        candidate = candidates[0]
-                        access_key = candidate.get('accesskey')
-                        lrc_id = candidate.get('id')
-                        
-                        if access_key and lrc_id:
-                            # Download the actual lyrics
-                            download_url = "https://lyrics.kugou.com/download"
-                            download_params = {
-                                'ver': 1,
-                                'client': 'pc',
-                                'id': lrc_id,
-                                'accesskey': access_key,
-                                'fmt': 'lrc',
-                                'charset': 'utf8'
-                            }
-                            
-                            download_response = requests.get(download_url, params=download_params, headers=headers, timeout=5)
-                            
-                            if download_response.status_code == 200:
-                                dl_data = download_response.json()
-                                lrc_content_b64 = dl_data.get('content', '')
-                                
-                                if lrc_content_b64:
-                                    import base64
-                                    lrc_content = base64.b64decode(lrc_content_b64).decode('utf-8')
-                                    captions = parse_lrc(lrc_content)
-                                    
-                                    if captions and len(captions) > 3:
-                                        print(f"[KUGOU] Found lyrics: {artist_name} - {song_name}")
-                                        # Convert LRC to plain text
-                                        plain_lyrics = lrc_to_plain_text(lrc_content)
-                                        return {
-                                            'lyrics': plain_lyrics,
-                                            'source': 'kugou',
-                                            'track': song_name,
-                                            'artist': artist_name,
-                                        }
-                except Exception as e:
-                    print(f"[KUGOU] Lyrics parse error: {e}")
-                    continue
+                    if captions and len(captions) > 3:
+                        print(f"[KUGOU] Found lyrics: {artist_name} - {song_name}")
+                        # Convert LRC to plain text
+                        plain_lyrics = lrc_to_plain_text(lrc_content)
+                        return {
+                            'lyrics': plain_lyrics,
+                            'source': 'kugou',
+                            'track': song_name,
+                            'artist': artist_name,
+                        }
+            except ProviderError:
+                raise
+            except Exception as e:
+                print(f"[KUGOU] Lyrics parse error: {e}")
+                raise ProviderError(str(e)) from e
+            return None
         
-        return None
+        def describe(song):
+            return song.get('singername', ''), song.get('songname', ''), song.get('duration') or 0
+
+        # Walk the search -> krcs -> download chain for the best-matching candidates concurrently
+        candidates = rank_candidates([song for song in songs if song.get('hash')], describe,
+                                     artist, track, duration)
+        return first_candidate('KUGOU', fetch, candidates[:KUGOU_CANDIDATES])
         
     except Exception as e:
         print(f"[KUGOU ERROR] {e}")
-        return None
+        raise ProviderError(str(e)) from e
+
 
+def search_lyrics_lrclib_simple(artist, track, video_title, duration=None):
+    """Search for lyrics from LRCLIB API - returns plain text.
+
+    With an artist and the video's duration, LRCLIB's exact /api/get lookup
+    is tried first (one record rather than a result list); the broad search
+    is the fallback, closest duration first.
+    """
+    def accept(result):
+        # Prefer synced lyrics, but also accept plain
+        synced_lyrics = result.get('syncedLyrics')
+        plain_lyrics = result.get('plainLyrics')
+        lyrics = lrc_to_plain_text(synced_lyrics) if synced_lyrics else plain_lyrics
+        if lyrics and len(lyrics.split('\n')) > 3:
+            print(f"[LRCLIB] Found lyrics: {result.get('artistName')} - {result.get('trackName')}")
+            return {
+                'lyrics': lyrics,
+                'source': 'lrclib',
+                'track': result.get('trackName', track),
+                'artist': result.get('artistName', artist),
+            }
+        return None
 
-def search_lyrics_lrclib_simple(artist, track, video_title):
-    """Search for lyrics from LRCLIB API - returns plain text."""
     try:
-        import re
-        
-        # Clean up title if no track provided
+        # Parse the title if no track provided
         if not track:
-            clean_title = video_title
-            patterns_to_remove = [
-                r'\s*[\(\[【「].*?[\)\]】」]',
-                r'\s*[-–—]\s*(?:official|mv|music video|lyric|歌詞).*$',
-                r'\s*\|.*$',
-            ]
-            for pattern in patterns_to_remove:
-                clean_title = re.sub(pattern, '', clean_title, flags=re.IGNORECASE)
-            
-            match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', clean_title.strip())
-            if match:
-                if not artist:
-                    artist = match.group(1).strip()
-                track = match.group(2).strip()
-            else:
-                track = clean_title.strip()
+            parsed_artist, track = title_parser.parse_title(video_title)
+            artist = artist or parsed_artist
+        
+        headers = {'User-Agent': 'KaraokeShen/1.0'}
+        
+        if artist and track and duration:
+            print(f"[LRCLIB] Exact lookup: track='{track}', artist='{artist}', duration={round(duration)}s")
+            params = {'track_name': track, 'artist_name': artist, 'duration': round(duration)}
+            response = http_client.get("https://lrclib.net/api/get", params=params, headers=headers, timeout=5)
+            if require_ok(response, 'LRCLIB get'):
+                result = accept(response.json())
+                if result:
+                    return result
+            if lyrics_cancelled():
+                return None
         
         print(f"[LRCLIB] Searching: track='{track}', artist='{artist}'")
         
-        headers = {'User-Agent': 'KaraokeShen/1.0'}
         search_url = f"https://lrclib.net/api/search?track_name={requests.utils.quote(track)}"
         if artist:
             search_url += f"&artist_name={requests.utils.quote(artist)}"
         
-        response = requests.get(search_url, headers=headers, timeout=5)
+        response = http_client.get(search_url, headers=headers, timeout=5)
         
-        if response.status_code == 200:
-            results = response.json()
-            if results and len(results) > 0:
-                for result in results:
-                    # Prefer synced lyrics, but also accept plain
-                    synced_lyrics = result.get('syncedLyrics')
-                    plain_lyrics = result.get('plainLyrics')
-                    
-                    if synced_lyrics:
-                        lyrics = lrc_to_plain_text(synced_lyrics)
-                    elif plain_lyrics:
-                        lyrics = plain_lyrics
-                    else:
-                        continue
-                    
-                    if lyrics and len(lyrics.split('\n')) > 3:
-                        print(f"[LRCLIB] Found lyrics: {result.get('artistName')} - {result.get('trackName')}")
-                        return {
-                            'lyrics': lyrics,
-                            'source': 'lrclib',
-                            'track': result.get('trackName', track),
-                            'artist': result.get('artistName', artist),
-                        }
+        if require_ok(response, 'LRCLIB search'):
+            results = response.json() or []
+            if duration:
+                results.sort(key=lambda r: abs((r.get('duration') or 0) - duration))
+            for result in results:
+                result = accept(result)
+                if result:
+                    return result
         return None
         
     except Exception as e:
         print(f"[LRCLIB ERROR] {e}")
-        return None
+        raise ProviderError(str(e)) from e
 
 
 def search_lyrics_ovh_simple(artist, track):
@@ -1085,9 +2374,9 @@ def search_lyrics_ovh_simple(artist, track):
         print(f"[LYRICS.OVH] Searching: artist='{artist}', track='{track}'")
         
         url = f"https://api.lyrics.ovh/v1/{requests.utils.quote(artist)}/{requests.utils.quote(track)}"
-        response = requests.get(url, timeout=10)
+        response = http_client.get(url, timeout=10)
         
-        if response.status_code == 200:
+        if require_ok(response, 'lyrics.ovh'):
             data = response.json()
             lyrics = data.get('lyrics', '')
             if lyrics and len(lyrics.split('\n')) > 3:
@@ -1102,7 +2391,7 @@ def search_lyrics_ovh_simple(artist, track):
         
     except Exception as e:
         print(f"[LYRICS.OVH ERROR] {e}")
-        return None
+        raise ProviderError(str(e)) from e
 
 
 def search_lyrics_chinese(video_title, artist='', track=''):
@@ -1111,16 +2400,22 @@ def search_lyrics_chinese(video_title, artist='', track=''):
     
     # Extract song info if not provided
     if not artist or not track:
-        extracted_artist, extracted_track = extract_song_info(video_title)
+        extracted_artist, extracted_track = title_parser.parse_title(video_title)
         if not artist:
             artist = extracted_artist
         if not track:
             track = extracted_track
     
     print(f"[CHINESE] Searching: artist='{artist}', track='{track}'")
+
+    def attempt(search, *args):
+        try:
+            return search(*args)
+        except ProviderError:
+            return None
     
     # Try NetEase Music first (most reliable for Chinese)
-    result = search_lyrics_netease(artist, track)
+    result = attempt(search_lyrics_netease, artist, track)
     if result:
         return result
     
@@ -1130,13 +2425,13 @@ def search_lyrics_chinese(video_title, artist='', track=''):
         return result
     
     # Try Kugou Music
-    result = search_lyrics_kugou(artist, track)
+    result = attempt(search_lyrics_kugou, artist, track)
     if result:
         return result
     
     # Try with just track name if artist search failed
     if artist:
-        result = search_lyrics_netease('', track)
+        result = attempt(search_lyrics_netease, '', track)
         if result:
             return result
         
@@ -1144,7 +2439,7 @@ def search_lyrics_chinese(video_title, artist='', track=''):
         if result:
             return result
         
-        result = search_lyrics_kugou('', track)
+        result = attempt(search_lyrics_kugou, '', track)
         if result:
             return result
     
@@ -1152,7 +2447,7 @@ def search_lyrics_chinese(video_title, artist='', track=''):
     try:
         search_term = f"{artist} {track}".strip() if artist else track
         gecimi_url = f"http://gecimi.com/api/lyric/{requests.utils.quote(search_term)}"
-        response = requests.get(gecimi_url, timeout=5, headers={'User-Agent': 'Mozilla/5.0'})
+        response = http_client.get(gecimi_url, timeout=5, headers={'User-Agent': 'Mozilla/5.0'})
         
         if response.status_code == 200:
             data = response.json()
@@ -1160,7 +2455,7 @@ def search_lyrics_chinese(video_title, artist='', track=''):
                 for item in data['result']:
                     lrc_url = item.get('lrc')
                     if lrc_url:
-                        lrc_response = requests.get(lrc_url, timeout=5)
+                        lrc_response = http_client.get(lrc_url, timeout=5)
                         if lrc_response.status_code == 200:
                             captions = parse_lrc(lrc_response.text)
                             if captions:
@@ -1183,29 +2478,10 @@ def search_lyrics_chinese(video_title, artist='', track=''):
 def search_lyrics_lrclib(video_title, artist='', track=''):
     """Search for synced lyrics from LRCLIB API with short timeout."""
     try:
-        import re
-        clean_title = video_title
-        # Remove common video title patterns
-        patterns_to_remove = [
-            r'\s*[\(\[【「].*?(?:官方|official|mv|music video|lyric|歌詞|完整版|高音質|hd|4k|1080p).*?[\)\]】」]',
-            r'\s*[\(\[【「].*?[\)\]】」]\s*$',
-            r'\s*-\s*(?:official|mv|music video|lyric|歌詞).*$',
-            r'\s*\|.*$',
-            r'\s*\/.*$',
-        ]
-        for pattern in patterns_to_remove:
-            clean_title = re.sub(pattern, '', clean_title, flags=re.IGNORECASE)
-        clean_title = clean_title.strip()
-        
         # Extract artist and track
         if not track:
-            match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', clean_title)
-            if match:
-                if not artist:
-                    artist = match.group(1).strip()
-                track = match.group(2).strip()
-            else:
-                track = clean_title
+            parsed_artist, track = title_parser.parse_title(video_title)
+            artist = artist or parsed_artist
         
         print(f"[LRCLIB] Searching: track='{track}', artist='{artist}'")
         
@@ -1216,7 +2492,7 @@ def search_lyrics_lrclib(video_title, artist='', track=''):
             search_url += f"&artist_name={requests.utils.quote(artist)}"
         
         # Short timeout
-        response = requests.get(search_url, headers=headers, timeout=5)
+        response = http_client.get(search_url, headers=headers, timeout=5)
         
         if response.status_code == 200:
             results = response.json()
@@ -1245,24 +2521,12 @@ def search_lyrics_lrclib(video_title, artist='', track=''):
 def search_lyrics_ovh(video_title, artist='', track=''):
     """Search for lyrics from lyrics.ovh API."""
     try:
-        import re
-        
-        # Clean and extract artist/track
-        clean_title = video_title
-        patterns_to_remove = [
-            r'\s*[\(\[【「].*?[\)\]】」]',
-            r'\s*-\s*(?:official|mv|music video|lyric|歌詞).*$',
-            r'\s*\|.*$',
-        ]
-        for pattern in patterns_to_remove:
-            clean_title = re.sub(pattern, '', clean_title, flags=re.IGNORECASE)
-        clean_title = clean_title.strip()
-        
+        # Extract artist and track
         if not track or not artist:
-            match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', clean_title)
-            if match:
-                artist = artist or match.group(1).strip()
-                track = track or match.group(2).strip()
+            parsed_artist, parsed_track = title_parser.parse_title(video_title)
+            if parsed_artist:
+                artist = artist or parsed_artist
+                track = track or parsed_track
         
         if not artist or not track:
             return None
@@ -1271,7 +2535,7 @@ def search_lyrics_ovh(video_title, artist='', track=''):
         
         # lyrics.ovh API
         api_url = f"https://api.lyrics.ovh/v1/{requests.utils.quote(artist)}/{requests.utils.quote(track)}"
-        response = requests.get(api_url, timeout=5)
+        response = http_client.get(api_url, timeout=5)
         
         if response.status_code == 200:
             data = response.json()
@@ -1395,7 +2659,7 @@ def get_youtube_captions(video_id, lang='zh-TW,zh-Hant,zh,zh-Hans,en,ja,ko'):
                 return {'available': False, 'languages': list(all_subs.keys()), 'captions': []}
             
             headers = {'User-Agent': 'Mozilla/5.0'}
-            sub_response = requests.get(sub_url, headers=headers, timeout=10)
+            sub_response = http_client.get(sub_url, headers=headers, timeout=10)
             
             if sub_response.status_code != 200:
                 return {'available': False, 'error': 'Failed to fetch subtitle content'}
@@ -1481,296 +2745,1226 @@ INVIDIOUS_INSTANCES = [
 ]
 
 
-def get_invidious_stream(video_id):
-    """Try to get stream URL from Invidious API instances."""
-    for instance in INVIDIOUS_INSTANCES:
-        try:
-            api_url = f"{instance}/api/v1/videos/{video_id}"
-            print(f"[INVIDIOUS] Trying: {instance}")
-            
-            resp = requests.get(api_url, timeout=10, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            })
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                
-                # Get format streams (combined audio+video)
-                format_streams = data.get('formatStreams', [])
-                
-                best_stream = None
-                for stream in format_streams:
-                    # Look for 360p or 480p mp4
-                    quality = stream.get('qualityLabel', '')
-                    container = stream.get('container', '')
-                    if container == 'mp4' and ('360p' in quality or '480p' in quality):
-                        best_stream = stream
-                        break
-                    if container == 'mp4' and not best_stream:
-                        best_stream = stream
-                
-                if best_stream:
-                    print(f"[INVIDIOUS] Found stream: {best_stream.get('qualityLabel', 'unknown')}")
-                    return {
-                        'url': best_stream.get('url'),
-                        'quality': best_stream.get('qualityLabel'),
-                        'instance': instance
-                    }
-                    
-        except Exception as e:
-            print(f"[INVIDIOUS] {instance} failed: {str(e)[:50]}")
-            continue
-    
-    return None
+# ============================================
+# Instance Health Registry
+# ============================================
+# Piped/Invidious instances come and go. Each attempt records its outcome and
+# latency; attempts are then ordered by score (smoothed success rate, penalised
+# by latency) and an instance that keeps failing is skipped for a cool-down
+# that doubles on every repeated trip. When every breaker is open, the
+# least-recently-failed instance is let through as a half-open probe (at most
+# once per HEALTH_PROBE_INTERVAL), so recovery doesn't wait out the cool-down.
+# Scores are persisted to SQLite so a restart does not have to relearn which
+# instances are dead.
+HEALTH_EWMA_ALPHA = 0.3
+HEALTH_LATENCY_SCALE = 3.0  # seconds; an instance this slow scores half as well
+HEALTH_BREAKER_THRESHOLD = int(os.environ.get('HEALTH_BREAKER_THRESHOLD', 3))
+HEALTH_BREAKER_COOLDOWN = int(os.environ.get('HEALTH_BREAKER_COOLDOWN', 60))
+HEALTH_BREAKER_MAX_COOLDOWN = 30 * 60
+HEALTH_PROBE_INTERVAL = 10
+HEALTH_PERSIST_INTERVAL = 30
 
 
-def get_piped_stream(video_id):
-    """Try to get stream URL from Piped API instances."""
-    for instance in PIPED_INSTANCES:
+class InstanceHealth:
+    """Tracks success rate, latency and circuit-breaker state per instance."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._dirty = set()
+        self._last_persist = 0
+
+    def _entry(self, instance):
+        entry = self._stats.get(instance)
+        if entry is None:
+            # Unknown instances start optimistic so they get tried
+            entry = {
+                'successes': 0,
+                'failures': 0,
+                'success_rate': 0.75,
+                'avg_latency': 2.0,
+                'consecutive_failures': 0,
+                'trips': 0,
+                'open_until': 0.0,
+                'failed_at': 0.0,
+                'probed_at': 0.0,
+            }
+            self._stats[instance] = entry
+        return entry
+
+    def score(self, instance):
+        with self._lock:
+            entry = self._entry(instance)
+            return entry['success_rate'] / (1 + entry['avg_latency'] / HEALTH_LATENCY_SCALE)
+
+    def is_open(self, instance, now=None):
+        with self._lock:
+            return self._entry(instance)['open_until'] > (now or time.time())
+
+    def order(self, instances):
+        """Instances to try, best first, leaving out those whose breaker is open.
+
+        If every breaker is open, returns the least-recently-failed instance
+        alone as a probe, unless it was probed within HEALTH_PROBE_INTERVAL.
+        """
+        now = time.time()
+        available = [i for i in instances if not self.is_open(i, now)]
+        skipped = len(instances) - len(available)
+        if instances and not available:
+            return self._probe(instances, now)
+        if skipped:
+            print(f"[HEALTH] Skipping {skipped} instance(s) with open circuit breaker")
+        return sorted(available, key=lambda i: (-self.score(i), instances.index(i)))
+
+    def _probe(self, instances, now):
+        with self._lock:
+            candidates = [i for i in instances if now - self._entry(i)['probed_at'] >= HEALTH_PROBE_INTERVAL]
+            if not candidates:
+                return []
+            probe = min(candidates, key=lambda i: self._entry(i)['failed_at'])
+            self._entry(probe)['probed_at'] = now
+        print(f"[HEALTH] All circuit breakers open, probing {probe}")
+        return [probe]
+
+    def record_success(self, instance, latency):
+        with self._lock:
+            entry = self._entry(instance)
+            entry['successes'] += 1
+            entry['success_rate'] += HEALTH_EWMA_ALPHA * (1 - entry['success_rate'])
+            entry['avg_latency'] += HEALTH_EWMA_ALPHA * (latency - entry['avg_latency'])
+            recovered = entry['trips'] > 0
+            entry['consecutive_failures'] = 0
+            entry['trips'] = 0
+            entry['open_until'] = 0.0
+            self._dirty.add(instance)
+        if recovered:
+            print(f"[HEALTH] {instance} recovered, circuit closed")
+        self._maybe_persist(force=recovered)
+
+    def record_failure(self, instance, latency):
+        tripped = False
+        with self._lock:
+            entry = self._entry(instance)
+            entry['failures'] += 1
+            entry['success_rate'] -= HEALTH_EWMA_ALPHA * entry['success_rate']
+            entry['avg_latency'] += HEALTH_EWMA_ALPHA * (latency - entry['avg_latency'])
+            entry['consecutive_failures'] += 1
+            entry['failed_at'] = time.time()
+            if entry['consecutive_failures'] >= HEALTH_BREAKER_THRESHOLD:
+                cooldown = min(HEALTH_BREAKER_COOLDOWN * (2 ** entry['trips']), HEALTH_BREAKER_MAX_COOLDOWN)
+                entry['open_until'] = time.time() + cooldown
+                entry['trips'] += 1
+                tripped = True
+            self._dirty.add(instance)
+        if tripped:
+            print(f"[HEALTH] {instance} circuit opened for {cooldown}s")
+        self._maybe_persist(force=tripped)
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {
+                instance: {
+                    'score': round(entry['success_rate'] / (1 + entry['avg_latency'] / HEALTH_LATENCY_SCALE), 3),
+                    'success_rate': round(entry['success_rate'], 3),
+                    'avg_latency': round(entry['avg_latency'], 3),
+                    'successes': entry['successes'],
+                    'failures': entry['failures'],
+                    'open_for': max(0, round(entry['open_until'] - now)),
+                }
+                for instance, entry in self._stats.items()
+            }
+
+    def load(self):
+        """Restore persisted scores from the database."""
         try:
-            api_url = f"{instance}/streams/{video_id}"
-            print(f"[PIPED] Trying: {instance}")
-            
-            resp = requests.get(api_url, timeout=10, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            })
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                
-                # Get video streams (combined audio+video)
-                video_streams = data.get('videoStreams', [])
-                audio_streams = data.get('audioStreams', [])
-                
-                # Find a good quality mp4 stream with audio
-                best_stream = None
-                
-                # First try to find streams with both video and audio (360p or 480p preferred)
-                for stream in video_streams:
-                    if stream.get('videoOnly', True):
-                        continue  # Skip video-only streams
-                    mime = stream.get('mimeType', '')
-                    if 'video/mp4' in mime or 'video/webm' in mime:
-                        quality = stream.get('quality', '')
-                        # Prefer 360p or 480p for bandwidth
-                        if '360p' in quality or '480p' in quality:
-                            best_stream = stream
-                            break
-                        if not best_stream:
-                            best_stream = stream
-                
-                # If no combined stream, try HLS
-                hls_url = data.get('hls')
-                if hls_url and not best_stream:
-                    print(f"[PIPED] Using HLS stream")
-                    return {'url': hls_url, 'type': 'hls', 'instance': instance}
-                
-                if best_stream:
-                    print(f"[PIPED] Found stream: {best_stream.get('quality', 'unknown')}")
-                    return {
-                        'url': best_stream.get('url'),
-                        'type': 'direct',
-                        'quality': best_stream.get('quality'),
-                        'instance': instance
-                    }
-                    
+            with get_db() as conn:
+                c = conn.cursor()
+                c.execute('''
+                    SELECT instance, successes, failures, success_rate, avg_latency,
+                           consecutive_failures, trips, open_until
+                    FROM instance_health
+                ''')
+                rows = c.fetchall()
+        except Exception as e:
+            print(f"[HEALTH] Load failed: {e}")
+            return
+        with self._lock:
+            for row in rows:
+                self._stats[row[0]] = {
+                    'successes': row[1],
+                    'failures': row[2],
+                    'success_rate': row[3],
+                    'avg_latency': row[4],
+                    'consecutive_failures': row[5],
+                    'trips': row[6],
+                    'open_until': row[7],
+                    'failed_at': 0.0,
+                    'probed_at': 0.0,
+                }
+        if rows:
+            print(f"[HEALTH] Loaded scores for {len(rows)} instances")
+
+    def flush(self):
+        """Persist any unsaved scores now (used at shutdown)."""
+        self._maybe_persist(force=True)
+
+    def _maybe_persist(self, force=False):
+        with self._lock:
+            now = time.time()
+            if not self._dirty or (not force and now - self._last_persist < HEALTH_PERSIST_INTERVAL):
+                return
+            rows = [
+                (instance, e['successes'], e['failures'], e['success_rate'], e['avg_latency'],
+                 e['consecutive_failures'], e['trips'], e['open_until'], datetime.now().isoformat())
+                for instance, e in ((i, self._stats[i]) for i in self._dirty)
+            ]
+            self._dirty.clear()
+            self._last_persist = now
+        try:
+            with get_db() as conn:
+                c = conn.cursor()
+                c.executemany('''
+                    INSERT OR REPLACE INTO instance_health
+                    (instance, successes, failures, success_rate, avg_latency,
+                     consecutive_failures, trips, open_until, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
         except Exception as e:
-            print(f"[PIPED] {instance} failed: {str(e)[:50]}")
+            print(f"[HEALTH] Persist failed: {e}")
+
+
+instance_health = InstanceHealth()
+instance_health.load()
+atexit.register(instance_health.flush)
+
+
+def fetch_invidious_instance(instance, video_id, timeout=10, mode='av'):
+    """Ask one Invidious instance for a combined (or audio-only) stream; raises if the instance misbehaves."""
+    api_url = f"{instance}/api/v1/videos/{video_id}"
+    resp = http_client.get(api_url, timeout=timeout, headers={
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    })
+    if resp.status_code != 200:
+        raise RuntimeError(f"HTTP {resp.status_code}")
+
+    data = resp.json()
+
+    if mode == 'audio':
+        # Adaptive audio formats; itag 140 is AAC in m4a
+        audio = [f for f in data.get('adaptiveFormats', [])
+                 if f.get('type', '').startswith('audio/') and f.get('url')]
+        best_audio = next((f for f in audio if str(f.get('itag')) == '140'), None) or \
+            next((f for f in audio if f.get('type', '').startswith('audio/mp4')), None) or \
+            next(iter(audio), None)
+        if not best_audio:
+            return None
+        print(f"[INVIDIOUS] Found audio stream: itag {best_audio.get('itag')}")
+        return {'url': best_audio['url'], 'quality': 'audio', 'instance': instance,
+                'duration': data.get('lengthSeconds')}
+
+    # Get format streams (combined audio+video)
+    format_streams = data.get('formatStreams', [])
+
+    best_stream = None
+    for stream in format_streams:
+        # Look for 360p or 480p mp4
+        quality = stream.get('qualityLabel', '')
+        container = stream.get('container', '')
+        if container == 'mp4' and ('360p' in quality or '480p' in quality):
+            best_stream = stream
+            break
+        if container == 'mp4' and not best_stream:
+            best_stream = stream
+
+    if best_stream:
+        print(f"[INVIDIOUS] Found stream: {best_stream.get('qualityLabel', 'unknown')}")
+        return {
+            'url': best_stream.get('url'),
+            'quality': best_stream.get('qualityLabel'),
+            'instance': instance,
+            'duration': data.get('lengthSeconds'),
+        }
+    return None
+
+
+def fetch_piped_instance(instance, video_id, timeout=10, mode='av'):
+    """Ask one Piped instance for a combined, HLS or audio-only stream; raises if the instance misbehaves."""
+    api_url = f"{instance}/streams/{video_id}"
+    resp = http_client.get(api_url, timeout=timeout, headers={
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    })
+    if resp.status_code != 200:
+        raise RuntimeError(f"HTTP {resp.status_code}")
+
+    data = resp.json()
+
+    if mode == 'audio':
+        audio = [a for a in data.get('audioStreams', []) if a.get('url')]
+        best_audio = next((a for a in audio if a.get('itag') == 140), None) or \
+            next((a for a in audio if 'audio/mp4' in a.get('mimeType', '')), None) or \
+            next(iter(audio), None)
+        if not best_audio:
+            return None
+        print(f"[PIPED] Found audio stream: {best_audio.get('quality', 'unknown')}")
+        return {'url': best_audio['url'], 'type': 'direct', 'quality': 'audio', 'instance': instance,
+                'duration': data.get('duration')}
+
+    # Get video streams (combined audio+video)
+    video_streams = data.get('videoStreams', [])
+
+    # Find a good quality mp4 stream with audio
+    best_stream = None
+
+    # First try to find streams with both video and audio (360p or 480p preferred)
+    for stream in video_streams:
+        if stream.get('videoOnly', True):
+            continue  # Skip video-only streams
+        mime = stream.get('mimeType', '')
+        if 'video/mp4' in mime or 'video/webm' in mime:
+            quality = stream.get('quality', '')
+            # Prefer 360p or 480p for bandwidth
+            if '360p' in quality or '480p' in quality:
+                best_stream = stream
+                break
+            if not best_stream:
+                best_stream = stream
+
+    # If no combined stream, try HLS
+    hls_url = data.get('hls')
+    if hls_url and not best_stream:
+        print(f"[PIPED] Using HLS stream")
+        return {'url': hls_url, 'type': 'hls', 'instance': instance, 'duration': data.get('duration')}
+
+    if best_stream:
+        print(f"[PIPED] Found stream: {best_stream.get('quality', 'unknown')}")
+        return {
+            'url': best_stream.get('url'),
+            'type': 'direct',
+            'quality': best_stream.get('quality'),
+            'instance': instance,
+            'duration': data.get('duration'),
+        }
+    return None
+
+
+def try_instance(fetch, instance, video_id, tag, timeout=10, mode='av'):
+    """Run one instance fetch and record its outcome in the health registry."""
+    started = time.time()
+    try:
+        print(f"[{tag}] Trying: {instance}")
+        result = fetch(instance, video_id, timeout=timeout, mode=mode)
+    except Exception as e:
+        instance_health.record_failure(instance, time.time() - started)
+        print(f"[{tag}] {instance} failed: {str(e)[:50]}")
+        return None
+    instance_health.record_success(instance, time.time() - started)
+    return result
+
+
+def get_invidious_stream(video_id, mode='av'):
+    """Try to get stream URL from Invidious API instances, healthiest first."""
+    for instance in instance_health.order(INVIDIOUS_INSTANCES):
+        result = try_instance(fetch_invidious_instance, instance, video_id, 'INVIDIOUS', mode=mode)
+        if result:
+            return result
+    return None
+
+
+def get_piped_stream(video_id, mode='av'):
+    """Try to get stream URL from Piped API instances, healthiest first."""
+    for instance in instance_health.order(PIPED_INSTANCES):
+        result = try_instance(fetch_piped_instance, instance, video_id, 'PIPED', mode=mode)
+        if result:
+            return result
+    return None
+
+
+# ============================================
+# Media Disk Cache
+# ============================================
+# Proxied media is stored on disk in fixed-size, block-aligned pieces so later
+# Range requests (replays, seeks) can be answered without going upstream.
+# Each cache key gets its own directory holding meta.json (total size and
+# content type) plus one file per downloaded block; once every block is
+# present they are assembled into a single media.bin which is then served
+# with send_file (sendfile under gunicorn) and Range support from werkzeug.
+# Blocks are written with an atomic rename, so several workers can fill the
+# same entry without locking.
+MEDIA_CACHE_DIR = os.path.join(DATA_DIR, 'media_cache')
+MEDIA_CACHE_BLOCK_SIZE = 1024 * 1024
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+MEDIA_CACHE_EVICT_EVERY = 64 * 1024 * 1024  # Check the size cap after this many new bytes
+_MEDIA_KEY_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}(\.[a-z]+)?$')
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+_media_cache_lock = threading.Lock()
+_media_cache_bytes_since_evict = 0
+
+
+def _media_dir(key):
+    """Directory for one cached media entry (key is validated against path tricks)."""
+    if not _MEDIA_KEY_RE.match(key or ''):
+        return None
+    return os.path.join(MEDIA_CACHE_DIR, key)
+
+
+def _media_block_path(entry_dir, index):
+    return os.path.join(entry_dir, f"{index}.blk")
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def get_media_cache_meta(key):
+    """Read the size/content-type record of a cached media entry."""
+    entry_dir = _media_dir(key)
+    if not entry_dir:
+        return None
+    try:
+        with open(os.path.join(entry_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _touch_media_entry(entry_dir):
+    """Record an access for LRU eviction."""
+    try:
+        os.utime(os.path.join(entry_dir, 'meta.json'))
+    except OSError:
+        pass
+
+
+def _read_media_block(entry_dir, index, block_size):
+    """Read one block, from its block file or from the assembled file."""
+    try:
+        with open(_media_block_path(entry_dir, index), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        with open(os.path.join(entry_dir, 'media.bin'), 'rb') as f:
+            f.seek(index * block_size)
+            return f.read(block_size)
+
+
+def _assemble_media_entry(entry_dir, meta):
+    """Join a fully downloaded entry's blocks into media.bin."""
+    size = meta['size']
+    block_size = meta['block_size']
+    last_index = (size - 1) // block_size
+    if not all(os.path.exists(_media_block_path(entry_dir, i)) for i in range(last_index + 1)):
+        return False
+
+    final_path = os.path.join(entry_dir, 'media.bin')
+    tmp_path = f"{final_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as out:
+            for i in range(last_index + 1):
+                with open(_media_block_path(entry_dir, i), 'rb') as f:
+                    out.write(f.read())
+        if os.path.getsize(tmp_path) != size:
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, final_path)
+    except OSError:
+        # Another worker assembled it first and removed the blocks
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return os.path.exists(final_path)
+
+    for i in range(last_index + 1):
+        try:
+            os.remove(_media_block_path(entry_dir, i))
+        except OSError:
+            pass
+    print(f"[MEDIA CACHE] Fully cached: {os.path.basename(entry_dir)} ({size} bytes)")
+    return True
+
+
+def evict_media_cache():
+    """Drop least recently used entries until the cache fits MEDIA_CACHE_MAX_BYTES."""
+    entries = []
+    total = 0
+    try:
+        names = os.listdir(MEDIA_CACHE_DIR)
+    except OSError:
+        return
+    for name in names:
+        entry_dir = os.path.join(MEDIA_CACHE_DIR, name)
+        try:
+            size = sum(e.stat().st_size for e in os.scandir(entry_dir) if e.is_file())
+            last_used = os.path.getmtime(os.path.join(entry_dir, 'meta.json'))
+        except OSError:
             continue
-    
+        entries.append((last_used, size, entry_dir))
+        total += size
+
+    entries.sort()
+    for last_used, size, entry_dir in entries:
+        if total <= MEDIA_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+        print(f"[MEDIA CACHE] Evicted {os.path.basename(entry_dir)} ({size} bytes)")
+
+
+def _note_media_bytes_written(count):
+    global _media_cache_bytes_since_evict
+    with _media_cache_lock:
+        _media_cache_bytes_since_evict += count
+        if _media_cache_bytes_since_evict < MEDIA_CACHE_EVICT_EVERY:
+            return
+        _media_cache_bytes_since_evict = 0
+    evict_media_cache()
+
+
+def parse_range_header(range_header, size):
+    """Parse a single-range `Range: bytes=a-b` header into inclusive (start, end)."""
+    if not range_header:
+        return 0, size - 1
+    match = _RANGE_RE.match(range_header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    if not match.group(1):
+        # Suffix range: the last N bytes
+        start = max(size - int(match.group(2)), 0)
+        return start, size - 1
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else size - 1
+    return start, min(end, size - 1)
+
+
+def serve_from_media_cache(key):
+    """Serve a request from the disk cache, or None if it is not cached.
+
+    A request without a Range header is only served when every block is on
+    disk, since it must get the whole body with a 200.
+    """
+    from flask import send_file
+    meta = get_media_cache_meta(key)
+    if not meta:
+        return None
+    entry_dir = _media_dir(key)
+    full_path = os.path.join(entry_dir, 'media.bin')
+
+    if os.path.exists(full_path):
+        _touch_media_entry(entry_dir)
+        print(f"[MEDIA CACHE] Serving {key} from disk")
+        response = send_file(full_path, mimetype=meta.get('content_type', 'video/mp4'),
+                             conditional=True, max_age=0)
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    size = meta['size']
+    block_size = meta['block_size']
+    range_header = request.headers.get('Range')
+    byte_range = parse_range_header(range_header, size)
+    if not byte_range or byte_range[0] > byte_range[1]:
+        return None
+    start, end = byte_range
+
+    # Serve the contiguous run of cached blocks starting at `start`; the
+    # browser issues a follow-up Range request for whatever comes after it.
+    first_index = start // block_size
+    last_index = end // block_size
+    index = first_index
+    while index <= last_index and os.path.exists(_media_block_path(entry_dir, index)):
+        index += 1
+    if index == first_index or (not range_header and index <= last_index):
+        return None
+    end = min(end, index * block_size - 1)
+    _touch_media_entry(entry_dir)
+    print(f"[MEDIA CACHE] Serving {key} bytes {start}-{end} from disk")
+
+    def generate():
+        offset = start
+        while offset <= end:
+            block_index = offset // block_size
+            block = _read_media_block(entry_dir, block_index, block_size)
+            block_start = offset - block_index * block_size
+            chunk = block[block_start:block_start + (end - offset + 1)]
+            if not chunk:
+                break
+            yield chunk
+            offset += len(chunk)
+
+    response_headers = {
+        'Content-Type': meta.get('content_type', 'video/mp4'),
+        'Accept-Ranges': 'bytes',
+        'Access-Control-Allow-Origin': '*',
+        'Cache-Control': 'no-cache',
+        'Content-Length': str(end - start + 1),
+    }
+    if not range_header:
+        return Response(generate(), status=200, headers=response_headers)
+    response_headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    return Response(generate(), status=206, headers=response_headers)
+
+
+class MediaCacheWriter:
+    """Collects bytes streamed from upstream and stores every complete aligned block."""
+
+    def __init__(self, key, start, size, content_type):
+        self.entry_dir = _media_dir(key)
+        self.size = size
+        self.block_size = MEDIA_CACHE_BLOCK_SIZE
+        self.offset = start
+        self.buffer = bytearray()
+        self.enabled = bool(self.entry_dir)
+        if not self.enabled:
+            return
+
+        meta = get_media_cache_meta(key)
+        if meta and (meta.get('size') != size or meta.get('block_size') != self.block_size):
+            # A different rendition is already cached under this key
+            self.enabled = False
+            return
+        if not meta:
+            os.makedirs(self.entry_dir, exist_ok=True)
+            _write_atomic(os.path.join(self.entry_dir, 'meta.json'), json.dumps({
+                'size': size,
+                'block_size': self.block_size,
+                'content_type': content_type,
+            }).encode())
+        self.meta = {'size': size, 'block_size': self.block_size}
+
+        # Skip the head of a block we joined mid-way; it can't be stored whole
+        remainder = start % self.block_size
+        self.skip = (self.block_size - remainder) if remainder else 0
+
+    def feed(self, chunk):
+        if not self.enabled:
+            return
+        if self.skip:
+            if len(chunk) <= self.skip:
+                self.skip -= len(chunk)
+                self.offset += len(chunk)
+                return
+            chunk = chunk[self.skip:]
+            self.offset += self.skip
+            self.skip = 0
+
+        self.buffer.extend(chunk)
+        while True:
+            index = self.offset // self.block_size
+            block_len = min(self.block_size, self.size - index * self.block_size)
+            if block_len <= 0 or len(self.buffer) < block_len:
+                break
+            self._store_block(index, bytes(self.buffer[:block_len]))
+            del self.buffer[:block_len]
+            self.offset += block_len
+
+    def _store_block(self, index, data):
+        path = _media_block_path(self.entry_dir, index)
+        if os.path.exists(path) or os.path.exists(os.path.join(self.entry_dir, 'media.bin')):
+            return
+        try:
+            _write_atomic(path, data)
+        except OSError as e:
+            print(f"[MEDIA CACHE] Block write failed: {e}")
+            self.enabled = False
+            return
+        _note_media_bytes_written(len(data))
+        if index == (self.size - 1) // self.block_size:
+            _assemble_media_entry(self.entry_dir, self.meta)
+
+    def close(self):
+        self.buffer = bytearray()
+        if self.enabled and not os.path.exists(os.path.join(self.entry_dir, 'media.bin')):
+            _assemble_media_entry(self.entry_dir, self.meta)
+
+
+def media_cache_writer_for(key, upstream):
+    """Create a cache writer for an upstream 200/206 response, if its size is known."""
+    if not key:
+        return None
+    content_type = upstream.headers.get('Content-Type', 'video/mp4')
+    if upstream.status_code == 206:
+        match = _CONTENT_RANGE_RE.match(upstream.headers.get('Content-Range', ''))
+        if not match:
+            return None
+        start, size = int(match.group(1)), int(match.group(3))
+    else:
+        length = upstream.headers.get('Content-Length')
+        if not length or not length.isdigit():
+            return None
+        start, size = 0, int(length)
+    if size <= 0:
+        return None
+    writer = MediaCacheWriter(key, start, size, content_type)
+    return writer if writer.enabled else None
+
+
+# ============================================
+# Stream URL Cache
+# ============================================
+# googlevideo URLs carry their own expiry (`expire=<unix time>`), so a resolved
+# URL can be reused for every Range request (seek) until shortly before then
+# instead of paying for a fresh yt-dlp extraction each time.
+STREAM_URL_DEFAULT_TTL = int(os.environ.get('STREAM_URL_DEFAULT_TTL', 1800))
+STREAM_URL_EXPIRY_MARGIN = 60
+STREAM_URL_CACHE_MAX = 256
+_EXPIRE_PARAM_RE = re.compile(r'[?&/]expire[=/](\d+)')
+
+_stream_url_cache = {}
+_stream_url_cache_lock = threading.Lock()
+
+DEFAULT_STREAM_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+}
+
+PIPED_STREAM_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Referer': 'https://piped.video/',
+}
+
+INVIDIOUS_STREAM_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*',
+}
+
+
+def stream_url_expiry(stream_url):
+    """Return the unix time after which a resolved stream URL should not be reused."""
+    match = _EXPIRE_PARAM_RE.search(stream_url or '')
+    if match:
+        return int(match.group(1)) - STREAM_URL_EXPIRY_MARGIN
+    return time.time() + STREAM_URL_DEFAULT_TTL
+
+
+def media_key(video_id, mode='av'):
+    """Cache key for one variant of a video: plain id for audio+video, "<id>.<mode>" otherwise."""
+    return video_id if mode == 'av' else f"{video_id}.{mode}"
+
+
+def get_cached_stream(key):
+    """Get a previously resolved stream for a media key if it has not expired."""
+    with _stream_url_cache_lock:
+        entry = _stream_url_cache.get(key)
+        if not entry:
+            return None
+        if entry['expires'] <= time.time():
+            del _stream_url_cache[key]
+            return None
+        return entry
+
+
+def cache_stream(key, resolved):
+    """Remember a resolved stream (URL + upstream headers) until it expires."""
+    entry = dict(resolved)
+    entry['expires'] = stream_url_expiry(resolved.get('url'))
+    if entry['expires'] <= time.time():
+        return
+    with _stream_url_cache_lock:
+        _stream_url_cache[key] = entry
+        if len(_stream_url_cache) > STREAM_URL_CACHE_MAX:
+            now = time.time()
+            for stale in [k for k, v in _stream_url_cache.items() if v['expires'] <= now]:
+                del _stream_url_cache[stale]
+            while len(_stream_url_cache) > STREAM_URL_CACHE_MAX:
+                oldest = min(_stream_url_cache, key=lambda k: _stream_url_cache[k]['expires'])
+                del _stream_url_cache[oldest]
+
+
+def cached_stream_duration(video_id):
+    """Video length in seconds from an already resolved stream, or None."""
+    for mode in ('av', 'audio'):
+        entry = get_cached_stream(media_key(video_id, mode))
+        if entry and entry.get('duration'):
+            return entry['duration']
+    return None
+
+
+def invalidate_cached_stream(key):
+    """Forget a cached stream, e.g. after upstream rejected its URL."""
+    with _stream_url_cache_lock:
+        _stream_url_cache.pop(key, None)
+
+
+def select_ytdlp_format(formats, mode='av'):
+    """Pick the format to proxy: legacy combined mp4 for 'av', m4a/opus audio for 'audio'."""
+    if mode == 'audio':
+        # 140 = AAC in m4a (plays everywhere), 251 = Opus in webm
+        for fid in ['140', '251']:
+            f = next((f for f in formats if f.get('format_id') == fid), None)
+            if f:
+                return f
+        audio_only = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+        return next((f for f in audio_only if f.get('ext') == 'm4a'), None) or \
+            next(iter(audio_only), None)
+
+    # Select format 18 or 22 (legacy combined audio+video)
+    for fid in ['18', '22']:
+        f = next((f for f in formats if f.get('format_id') == fid), None)
+        if f:
+            return f
+
+    for f in formats:
+        if f.get('ext') == 'mp4' and f.get('vcodec') != 'none' and f.get('acodec') != 'none':
+            return f
+
+    for f in formats:
+        if f.get('vcodec') != 'none':
+            return f
     return None
 
 
+def _ytdlp_resolved(f, duration=None):
+    ytdl_headers = f.get('http_headers', {})
+    return {
+        'url': f.get('url'),
+        'headers': dict(ytdl_headers) if ytdl_headers else dict(DEFAULT_STREAM_HEADERS),
+        'type': 'direct',
+        'source': 'yt-dlp',
+        'format_id': f.get('format_id'),
+        'duration': duration,
+    }
+
+
+def resolve_stream_ytdlp(video_id, mode='av'):
+    """Resolve a direct stream with yt-dlp: combined audio+video, or audio only.
+
+    Returns (resolved, last_error); resolved is None if every player client failed.
+    The other variant from the same extraction is cached too, so switching
+    between video and audio-only playback costs no second extraction.
+    """
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    info = None
+    last_error = None
+
+    player_clients = [
+        ['android'],
+        ['ios'],
+        ['web'],
+        ['mweb'],
+    ]
+
+    for clients in player_clients:
+        try:
+            opts = {
+                'format': '18/22/best[ext=mp4][vcodec^=avc1][acodec^=mp4a]/best[ext=mp4]/best',
+                'quiet': True,
+                'no_warnings': True,
+                'nocheckcertificate': True,
+                'youtube_include_dash_manifest': False,
+                'youtube_include_hls_manifest': False,
+                'noplaylist': True,
+                'extractor_args': {'youtube': {'player_client': clients}},
+                'socket_timeout': 10,
+            }
+
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+                if info and info.get('formats'):
+                    print(f"[PROXY] yt-dlp success with client: {clients}")
+                    break
+        except Exception as e:
+            last_error = e
+            error_str = str(e)
+            print(f"[PROXY] yt-dlp client {clients} failed: {error_str[:80]}")
+            if 'Sign in to confirm' in error_str or 'not a bot' in error_str:
+                print("[PROXY] Bot detection encountered, skipping remaining clients")
+                break
+            continue
+
+    if not info or not info.get('formats'):
+        return None, last_error
+
+    formats = info.get('formats', [])
+    best_f = select_ytdlp_format(formats, mode)
+    if not best_f or not best_f.get('url'):
+        return None, last_error
+
+    print(f"[PROXY] yt-dlp format: {best_f.get('format_id')} - {best_f.get('format_note', 'N/A')}")
+
+    other_mode = 'audio' if mode == 'av' else 'av'
+    other_f = select_ytdlp_format(formats, other_mode)
+    if other_f and other_f.get('url'):
+        cache_stream(media_key(video_id, other_mode), _ytdlp_resolved(other_f, info.get('duration')))
+
+    return _ytdlp_resolved(best_f, info.get('duration')), last_error
+
+
+def piped_to_resolved(piped):
+    """Describe a Piped result as a resolved stream."""
+    return {
+        'url': piped['url'],
+        'headers': dict(PIPED_STREAM_HEADERS),
+        'type': piped.get('type', 'direct'),
+        'source': 'piped',
+        'instance': piped.get('instance'),
+        'duration': piped.get('duration'),
+    }
+
+
+def invidious_to_resolved(inv):
+    """Describe an Invidious result as a resolved stream."""
+    return {
+        'url': inv['url'],
+        'headers': dict(INVIDIOUS_STREAM_HEADERS),
+        'type': 'direct',
+        'source': 'invidious',
+        'instance': inv.get('instance'),
+        'duration': inv.get('duration'),
+    }
+
+
+def resolve_stream_piped(video_id, mode='av'):
+    """Resolve a stream through the Piped instances."""
+    piped = get_piped_stream(video_id, mode)
+    if not piped or not piped.get('url'):
+        return None
+    return piped_to_resolved(piped)
+
+
+def resolve_stream_invidious(video_id, mode='av'):
+    """Resolve a stream through the Invidious instances."""
+    inv = get_invidious_stream(video_id, mode)
+    if not inv or not inv.get('url'):
+        return None
+    return invidious_to_resolved(inv)
+
+
+# ============================================
+# Hedged Stream Resolution
+# ============================================
+# Walking every Piped instance and then every Invidious instance one by one
+# can take minutes when instances are down. In hedged mode the healthiest
+# instances of both backends are raced instead: a new attempt starts every
+# HEDGE_DELAY seconds (or right away when one fails), the first direct stream
+# wins, and the whole race is bounded by HEDGE_DEADLINE so the client can
+# fall back to the YouTube embed within a few seconds.
+STREAM_RESOLVER_MODE = os.environ.get('STREAM_RESOLVER', 'hedged' if IS_RENDER else 'sequential')
+HEDGE_TOP_N = int(os.environ.get('HEDGE_TOP_N', 3))
+HEDGE_DELAY = float(os.environ.get('HEDGE_DELAY', 0.75))
+HEDGE_DEADLINE = float(os.environ.get('HEDGE_DEADLINE', 6))
+
+_hedge_executor = ThreadPoolExecutor(max_workers=2 * HEDGE_TOP_N, thread_name_prefix='hedge')
+
+
+def resolve_stream_hedged(video_id, mode='av', deadline=None):
+    """Race the top Piped and Invidious instances; return the first usable stream."""
+    piped = [(fetch_piped_instance, i, 'PIPED', piped_to_resolved)
+             for i in instance_health.order(PIPED_INSTANCES)[:HEDGE_TOP_N]]
+    invidious = [(fetch_invidious_instance, i, 'INVIDIOUS', invidious_to_resolved)
+                 for i in instance_health.order(INVIDIOUS_INSTANCES)[:HEDGE_TOP_N]]
+
+    # Alternate backends so one bad backend can't hold up the race
+    candidates = []
+    for pair in zip(piped, invidious):
+        candidates.extend(pair)
+    candidates.extend(piped[len(invidious):] or invidious[len(piped):])
+    if not candidates:
+        print("[HEDGE] No healthy instances to race")
+        return None
+
+    started = time.time()
+    end = started + (deadline or HEDGE_DEADLINE)
+    pending = {}
+    fallback = None
+    next_launch = started
+
+    try:
+        while True:
+            now = time.time()
+            if now >= end:
+                print(f"[HEDGE] Deadline reached after {now - started:.1f}s")
+                break
+
+            if candidates and now >= next_launch:
+                fetch, instance, tag, to_resolved = candidates.pop(0)
+                future = _hedge_executor.submit(try_instance, fetch, instance, video_id, tag,
+                                                timeout=max(end - now, 1), mode=mode)
+                pending[future] = to_resolved
+                next_launch = now + HEDGE_DELAY
+                continue
+
+            if not pending:
+                if not candidates:
+                    break
+                time.sleep(max(next_launch - now, 0))
+                continue
+
+            wait_for = end - now
+            if candidates:
+                wait_for = min(wait_for, max(next_launch - now, 0))
+            done, _ = wait(list(pending), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                to_resolved = pending.pop(future)
+                result = future.result()
+                if not result or not result.get('url'):
+                    # A failed attempt hands its slot to the next candidate right away
+                    next_launch = time.time()
+                    continue
+                resolved = to_resolved(result)
+                if resolved['type'] == 'direct':
+                    print(f"[HEDGE] Winner: {resolved['instance']} after {time.time() - started:.1f}s")
+                    return resolved
+                fallback = fallback or resolved
+    finally:
+        for future in pending:
+            future.cancel()
+
+    if fallback:
+        print(f"[HEDGE] Using HLS fallback from {fallback['instance']}")
+    return fallback
+
+
+# ============================================
+# Stream Admission Control
+# ============================================
+# Each proxied stream holds a worker thread for the whole song. Without a cap,
+# WORKER_THREADS viewers take every thread and /api/search, /api/subtitles etc.
+# queue behind them. Streams are admitted up to MAX_CONCURRENT_STREAMS per
+# worker (by default leaving API_RESERVED_THREADS free for the API); beyond
+# that a few requests wait up to STREAM_QUEUE_TIMEOUT for a slot and the rest
+# get a 503 with Retry-After, which the client answers by switching to the
+# YouTube embed. A queued request holds a worker thread too, so the active
+# streams and the queue share the STREAM_THREADS left after the API reserve:
+# by default the queue gets its STREAM_QUEUE_SIZE and streams the rest.
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 4))
+API_RESERVED_THREADS = int(os.environ.get('API_RESERVED_THREADS', 2))
+STREAM_THREADS = max(WORKER_THREADS - API_RESERVED_THREADS, 1)
+_stream_queue_wanted = int(os.environ.get('STREAM_QUEUE_SIZE', 2))
+MAX_CONCURRENT_STREAMS = int(os.environ.get(
+    'MAX_CONCURRENT_STREAMS', max(STREAM_THREADS - _stream_queue_wanted, 1)))
+STREAM_QUEUE_SIZE = min(_stream_queue_wanted, max(STREAM_THREADS - MAX_CONCURRENT_STREAMS, 0))
+STREAM_QUEUE_TIMEOUT = float(os.environ.get('STREAM_QUEUE_TIMEOUT', 5))
+STREAM_RETRY_AFTER = 10
+
+
+class StreamGate:
+    """Counting semaphore with a bounded, timed wait queue and counters."""
+
+    def __init__(self, limit, queue_size, queue_timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queued = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    def acquire(self):
+        """Take a stream slot, waiting in the queue if needed. Returns False if refused."""
+        with self._cond:
+            if self._active < self.limit and not self._queued:
+                self._active += 1
+                self._admitted += 1
+                return True
+            if self._queued >= self.queue_size:
+                self._rejected += 1
+                return False
+
+            self._queued += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self._active < self.limit,
+                                               timeout=self.queue_timeout)
+            finally:
+                self._queued -= 1
+            if not admitted:
+                self._timed_out += 1
+                return False
+            self._active += 1
+            self._admitted += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self._active,
+                'queued': self._queued,
+                'limit': self.limit,
+                'queue_size': self.queue_size,
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+            }
+
+
+stream_gate = StreamGate(MAX_CONCURRENT_STREAMS, STREAM_QUEUE_SIZE, STREAM_QUEUE_TIMEOUT)
+
+
+def proxy_upstream(stream_url, headers, cache_key=None):
+    """Open a stream upstream and relay it, or return None if upstream refused it.
+
+    With a cache_key, the relayed bytes are also written to the media disk cache.
+    """
+    req_headers = dict(headers or DEFAULT_STREAM_HEADERS)
+    if request.headers.get('Range'):
+        req_headers['Range'] = request.headers.get('Range')
+
+    req = http_client.get_stream(stream_url, headers=req_headers, timeout=30)
+    print(f"[PROXY] Upstream response status: {req.status_code}")
+
+    if req.status_code not in [200, 206]:
+        req.close()
+        return None
+
+    response_headers = {
+        'Content-Type': req.headers.get('Content-Type', 'video/mp4'),
+        'Accept-Ranges': 'bytes',
+        'Access-Control-Allow-Origin': '*',
+        'Cache-Control': 'no-cache'
+    }
+
+    if 'Content-Range' in req.headers:
+        response_headers['Content-Range'] = req.headers['Content-Range']
+    if 'Content-Length' in req.headers:
+        response_headers['Content-Length'] = req.headers['Content-Length']
+
+    try:
+        writer = media_cache_writer_for(cache_key, req)
+    except OSError as e:
+        print(f"[MEDIA CACHE] Disabled for this request: {e}")
+        writer = None
+
+    def generate():
+        try:
+            for chunk in req.iter_content(chunk_size=512 * 1024):
+                if writer:
+                    writer.feed(chunk)
+                yield chunk
+        finally:
+            req.close()
+            if writer:
+                writer.close()
+
+    return Response(generate(), status=req.status_code, headers=response_headers)
+
+
+def serve_resolved_stream(key, resolved):
+    """Relay a resolved stream to the client, caching its URL if it works."""
+    if resolved.get('type') == 'hls':
+        # For HLS streams, redirect directly
+        cache_stream(key, resolved)
+        return redirect(resolved['url'])
+
+    resp = proxy_upstream(resolved['url'], resolved.get('headers'), cache_key=key)
+    if resp is not None:
+        cache_stream(key, resolved)
+    return resp
+
+
 @app.route('/proxy_stream')
 def proxy_stream():
-    """Proxy the video stream to bypass CORS."""
+    """Proxy the video stream to bypass CORS.
+
+    mode=audio relays an audio-only format (lyrics-only playback), mode=karaoke
+    serves the server-side vocal-removed rendition.
+    """
     video_id = request.args.get('v')
+    mode = request.args.get('mode', 'av')
     if not video_id:
         return "Missing video id", 400
+    if mode not in ('av', 'audio', 'karaoke'):
+        return f"Unknown mode: {mode}", 400
+
+    if not stream_gate.acquire():
+        print(f"[PROXY] Stream limit reached, refusing {video_id} ({stream_gate.stats()})")
+        return (jsonify({'error': 'Too many concurrent streams', 'busy': True}), 503,
+                {'Retry-After': str(STREAM_RETRY_AFTER)})
+
+    # The slot is held until the server has finished sending the body
+    try:
+        resp = make_response(proxy_stream_admitted(video_id, mode))
+    except BaseException:
+        stream_gate.release()
+        raise
+    resp.call_on_close(stream_gate.release)
+    return resp
+
 
-    print(f"--- [PROXY] Streaming: {video_id} ---")
+def proxy_stream_admitted(video_id, mode):
+    """Serve /proxy_stream once a stream slot has been taken."""
+    print(f"--- [PROXY] Streaming: {video_id} ({mode}) ---")
 
     try:
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        info = None
         last_error = None
 
-        # Method 1: Try yt-dlp (skip on Render - YouTube bot-detects cloud IPs)
-        if not IS_RENDER:
-            player_clients = [
-                ['android'],
-                ['ios'],
-                ['web'],
-                ['mweb'],
-            ]
+        if mode == 'karaoke':
+            # Server-side instrumental rendition, built once per video
+            state = request_rendition(video_id)
+            if state == 'ready':
+                rendition = serve_from_media_cache(rendition_key(video_id))
+                if rendition is not None:
+                    return rendition
+            elif state in ('failed', 'unavailable'):
+                # Retrying won't help (until RENDITION_RETRY_AFTER for 'failed')
+                return jsonify({'error': 'rendition_unavailable', 'state': state}), 404
+            return jsonify({'error': 'rendition_pending', 'pending': True}), 503, {'Retry-After': '5'}
 
-            for clients in player_clients:
-                try:
-                    opts = {
-                        'format': '18/22/best[ext=mp4][vcodec^=avc1][acodec^=mp4a]/best[ext=mp4]/best',
-                        'quiet': True,
-                        'no_warnings': True,
-                        'nocheckcertificate': True,
-                        'youtube_include_dash_manifest': False,
-                        'youtube_include_hls_manifest': False,
-                        'noplaylist': True,
-                        'extractor_args': {'youtube': {'player_client': clients}},
-                        'socket_timeout': 10,
-                    }
+        key = media_key(video_id, mode)
 
-                    with yt_dlp.YoutubeDL(opts) as ydl:
-                        info = ydl.extract_info(url, download=False)
-                        if info and info.get('formats'):
-                            print(f"[PROXY] yt-dlp success with client: {clients}")
-                            break
-                except Exception as e:
-                    last_error = e
-                    error_str = str(e)
-                    print(f"[PROXY] yt-dlp client {clients} failed: {error_str[:80]}")
-                    if 'Sign in to confirm' in error_str or 'not a bot' in error_str:
-                        print("[PROXY] Bot detection encountered, skipping remaining clients")
-                        break
-                    continue
-        else:
-            print("[PROXY] Render detected - skipping yt-dlp, using Piped/Invidious directly")
-        
-        if info and info.get('formats'):
-            # Select format 18 or 22 (legacy combined audio+video)
-            best_f = None
-            for fid in ['18', '22']:
-                best_f = next((f for f in info.get('formats', []) if f.get('format_id') == fid), None)
-                if best_f:
-                    break
+        # Fully or partially cached on disk: no upstream traffic at all
+        cached_response = serve_from_media_cache(key)
+        if cached_response is not None:
+            return cached_response
 
-            if not best_f:
-                for f in info.get('formats', []):
-                    if f.get('ext') == 'mp4' and f.get('vcodec') != 'none' and f.get('acodec') != 'none':
-                        best_f = f
-                        break
-
-            if not best_f:
-                for f in info.get('formats', []):
-                    if f.get('vcodec') != 'none':
-                        best_f = f
-                        break
-
-            if best_f:
-                stream_url = best_f.get('url')
-                print(f"[PROXY] yt-dlp format: {best_f.get('format_id')} - {best_f.get('format_note', 'N/A')}")
-
-                ytdl_headers = best_f.get('http_headers', {})
-                req_headers = dict(ytdl_headers) if ytdl_headers else {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                }
-                
-                if request.headers.get('Range'):
-                    req_headers['Range'] = request.headers.get('Range')
+        # Method 0: Reuse a previously resolved URL (seeks, replays)
+        cached = get_cached_stream(key)
+        if cached:
+            print(f"[PROXY] Using cached {cached['source']} stream URL")
+            resp = serve_resolved_stream(key, cached)
+            if resp is not None:
+                return resp
+            print("[PROXY] Cached stream URL rejected upstream, re-resolving")
+            invalidate_cached_stream(key)
 
-                req = requests.get(stream_url, headers=req_headers, stream=True, timeout=30)
-                print(f"[PROXY] yt-dlp response status: {req.status_code}")
-                
-                if req.status_code in [200, 206]:
-                    response_headers = {
-                        'Content-Type': 'video/mp4',
-                        'Accept-Ranges': 'bytes',
-                        'Access-Control-Allow-Origin': '*',
-                        'Cache-Control': 'no-cache'
-                    }
+        # Method 1: Try yt-dlp (skip on Render - YouTube bot-detects cloud IPs)
+        if not IS_RENDER:
+            resolved, last_error = _stream_flight.do(f"yt-dlp:{key}", resolve_stream_ytdlp, video_id, mode)
+            if resolved:
+                resp = serve_resolved_stream(key, resolved)
+                if resp is not None:
+                    return resp
+        else:
+            print("[PROXY] Render detected - skipping yt-dlp, using Piped/Invidious directly")
 
-                    if 'Content-Range' in req.headers:
-                        response_headers['Content-Range'] = req.headers['Content-Range']
-                    if 'Content-Length' in req.headers:
-                        response_headers['Content-Length'] = req.headers['Content-Length']
+        if STREAM_RESOLVER_MODE == 'hedged':
+            # Method 2: Race Piped and Invidious instances against a deadline
+            print("[PROXY] yt-dlp failed, racing Piped/Invidious...")
+            resolved = _stream_flight.do(f"hedged:{key}", resolve_stream_hedged, video_id, mode)
+            if resolved:
+                print(f"[PROXY] Using {resolved['source']} stream from {resolved.get('instance', 'unknown')}")
+                resp = serve_resolved_stream(key, resolved)
+                if resp is not None:
+                    return resp
+        else:
+            # Method 2: Try Piped API as fallback
+            print("[PROXY] yt-dlp failed, trying Piped...")
+            resolved = _stream_flight.do(f"piped:{key}", resolve_stream_piped, video_id, mode)
+            if resolved:
+                print(f"[PROXY] Using Piped stream from {resolved.get('instance', 'unknown')}")
+                resp = serve_resolved_stream(key, resolved)
+                if resp is not None:
+                    return resp
 
-                    def generate():
-                        for chunk in req.iter_content(chunk_size=512 * 1024):
-                            yield chunk
+            # Method 3: Try Invidious API
+            print("[PROXY] Piped failed, trying Invidious...")
+            resolved = _stream_flight.do(f"invidious:{key}", resolve_stream_invidious, video_id, mode)
+            if resolved:
+                print(f"[PROXY] Using Invidious stream from {resolved.get('instance', 'unknown')}")
+                resp = serve_resolved_stream(key, resolved)
+                if resp is not None:
+                    return resp
 
-                    return Response(generate(), status=req.status_code, headers=response_headers)
-        
-        # Method 2: Try Piped API as fallback
-        print("[PROXY] yt-dlp failed, trying Piped...")
-        piped_result = get_piped_stream(video_id)
-        
-        if piped_result and piped_result.get('url'):
-            stream_url = piped_result['url']
-            print(f"[PROXY] Using Piped stream from {piped_result.get('instance', 'unknown')}")
-            
-            # For HLS streams, redirect directly
-            if piped_result.get('type') == 'hls':
-                return redirect(stream_url)
-            
-            # For direct streams, proxy with proper headers
-            req_headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': '*/*',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Referer': 'https://piped.video/',
-            }
-            
-            if request.headers.get('Range'):
-                req_headers['Range'] = request.headers.get('Range')
-            
-            req = requests.get(stream_url, headers=req_headers, stream=True, timeout=30)
-            print(f"[PROXY] Piped response status: {req.status_code}")
-            
-            if req.status_code in [200, 206]:
-                response_headers = {
-                    'Content-Type': req.headers.get('Content-Type', 'video/mp4'),
-                    'Accept-Ranges': 'bytes',
-                    'Access-Control-Allow-Origin': '*',
-                    'Cache-Control': 'no-cache'
-                }
-                
-                if 'Content-Range' in req.headers:
-                    response_headers['Content-Range'] = req.headers['Content-Range']
-                if 'Content-Length' in req.headers:
-                    response_headers['Content-Length'] = req.headers['Content-Length']
-                
-                def generate():
-                    for chunk in req.iter_content(chunk_size=512 * 1024):
-                        yield chunk
-                
-                return Response(generate(), status=req.status_code, headers=response_headers)
-        
-        # Method 2: Try Invidious API
-        print("[PROXY] Piped failed, trying Invidious...")
-        invidious_result = get_invidious_stream(video_id)
-        
-        if invidious_result and invidious_result.get('url'):
-            stream_url = invidious_result['url']
-            print(f"[PROXY] Using Invidious stream from {invidious_result.get('instance', 'unknown')}")
-            
-            req_headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': '*/*',
-            }
-            
-            if request.headers.get('Range'):
-                req_headers['Range'] = request.headers.get('Range')
-            
-            req = requests.get(stream_url, headers=req_headers, stream=True, timeout=30)
-            print(f"[PROXY] Invidious response status: {req.status_code}")
-            
-            if req.status_code in [200, 206]:
-                response_headers = {
-                    'Content-Type': req.headers.get('Content-Type', 'video/mp4'),
-                    'Accept-Ranges': 'bytes',
-                    'Access-Control-Allow-Origin': '*',
-                    'Cache-Control': 'no-cache'
-                }
-                
-                if 'Content-Range' in req.headers:
-                    response_headers['Content-Range'] = req.headers['Content-Range']
-                if 'Content-Length' in req.headers:
-                    response_headers['Content-Length'] = req.headers['Content-Length']
-                
-                def generate():
-                    for chunk in req.iter_content(chunk_size=512 * 1024):
-                        yield chunk
-                
-                return Response(generate(), status=req.status_code, headers=response_headers)
-        
         # All methods failed - return proxy_unavailable so client falls back to YouTube embed gracefully
         error_msg = str(last_error) if last_error else "Unknown error"
         if 'Sign in to confirm' in error_msg or 'not a bot' in error_msg:
@@ -1790,6 +3984,317 @@ def proxy_stream():
         return jsonify({'error': f'Proxy error: {str(e)[:100]}'}), 500
 
 
+# ============================================
+# Next-Song Prefetch
+# ============================================
+# The client calls /api/prefetch for the upcoming playlist entry so that by
+# the time the song starts its stream URL is resolved and cached, the first
+# few MB of media are on disk and the lyrics are in the database cache.
+PREFETCH_BYTES = int(os.environ.get('PREFETCH_BYTES', 4 * 1024 * 1024))
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+_prefetch_in_flight = set()  # (video_id, stream mode or None for lyrics only)
+_prefetch_lock = threading.Lock()
+
+
+def resolve_stream(video_id, mode='av'):
+    """Resolve (or reuse) a stream for a video without proxying it."""
+    key = media_key(video_id, mode)
+    cached = get_cached_stream(key)
+    if cached:
+        return cached
+
+    resolved = None
+    if not IS_RENDER:
+        resolved, _ = _stream_flight.do(f"yt-dlp:{key}", resolve_stream_ytdlp, video_id, mode)
+    if not resolved and STREAM_RESOLVER_MODE == 'hedged':
+        resolved = _stream_flight.do(f"hedged:{key}", resolve_stream_hedged, video_id, mode)
+    elif not resolved:
+        resolved = _stream_flight.do(f"piped:{key}", resolve_stream_piped, video_id, mode)
+        if not resolved:
+            resolved = _stream_flight.do(f"invidious:{key}", resolve_stream_invidious, video_id, mode)
+    if resolved:
+        cache_stream(key, resolved)
+    return resolved
+
+
+def prefetch_media_head(key, resolved):
+    """Pull the first PREFETCH_BYTES of a stream into the media disk cache."""
+    if resolved.get('type') == 'hls':
+        return
+    meta = get_media_cache_meta(key)
+    entry_dir = _media_dir(key)
+    if meta and entry_dir and (
+            os.path.exists(os.path.join(entry_dir, 'media.bin')) or
+            os.path.exists(_media_block_path(entry_dir, 0))):
+        return
+
+    req_headers = dict(resolved.get('headers') or DEFAULT_STREAM_HEADERS)
+    req_headers['Range'] = f"bytes=0-{PREFETCH_BYTES - 1}"
+    req = http_client.get_stream(resolved['url'], headers=req_headers, timeout=30)
+    try:
+        if req.status_code not in [200, 206]:
+            print(f"[PREFETCH] Upstream refused stream ({req.status_code}), dropping cached URL")
+            invalidate_cached_stream(key)
+            return
+        writer = media_cache_writer_for(key, req)
+        if not writer:
+            return
+        received = 0
+        for chunk in req.iter_content(chunk_size=512 * 1024):
+            writer.feed(chunk)
+            received += len(chunk)
+            if received >= PREFETCH_BYTES:
+                break
+        writer.close()
+        print(f"[PREFETCH] Cached first {received} bytes of {key}")
+    finally:
+        req.close()
+
+
+def run_prefetch(video_id, video_title, with_stream, mode='av', duration=None):
+    """Background job: warm the stream URL, media head and lyrics for a video."""
+    try:
+        if with_stream:
+            try:
+                resolved = resolve_stream(video_id, mode)
+                if resolved and not IS_RENDER:
+                    prefetch_media_head(media_key(video_id, mode), resolved)
+            except Exception as e:
+                print(f"[PREFETCH] Stream warmup failed for {video_id}: {e}")
+        try:
+            _lyrics_flight.do(lyrics_flight_key(video_id, video_title, duration),
+                              lookup_lyrics, video_id, video_title, None, duration)
+        except Exception as e:
+            print(f"[PREFETCH] Lyrics warmup failed for {video_id}: {e}")
+    finally:
+        with _prefetch_lock:
+            _prefetch_in_flight.discard((video_id, mode if with_stream else None))
+
+
+@app.route('/api/prefetch', methods=['GET'])
+def prefetch():
+    """Warm caches for the next playlist entry in the background."""
+    video_id = request.args.get('id', '').strip()
+    video_title = request.args.get('title', '').strip()
+    with_stream = request.args.get('stream', '0') == '1'
+    mode = 'audio' if request.args.get('mode') == 'audio' else 'av'
+
+    if not video_id:
+        return jsonify({'error': 'Missing video ID'}), 400
+    try:
+        duration = duration_arg()
+    except ValueError:
+        return jsonify({'error': 'Invalid duration'}), 400
+
+    # A lyrics-only job in flight must not block a later one that also warms the stream;
+    # the lyrics half of the two is coalesced by _lyrics_flight
+    job = (video_id, mode if with_stream else None)
+    with _prefetch_lock:
+        if job in _prefetch_in_flight:
+            return jsonify({'queued': False, 'reason': 'in_progress'}), 202
+        _prefetch_in_flight.add(job)
+
+    print(f"[PREFETCH] Queued: {video_id} (stream={with_stream})")
+    _prefetch_executor.submit(run_prefetch, video_id, video_title, with_stream, mode, duration)
+    return jsonify({'queued': True}), 202
+
+
+# ============================================
+# Karaoke Renditions (server-side vocal removal)
+# ============================================
+# Instead of cancelling vocals in the browser with Web Audio (which breaks
+# when CORS blocks createMediaElementSource and is heavy on weak tablets),
+# ffmpeg renders an instrumental version of each song once. Above
+# KARAOKE_BASS_CUTOFF the centre channel is cancelled (L-R), below it the
+# original mix is kept so bass and kick drum survive. The video track is
+# copied unchanged. Renditions live in the media disk cache under the key
+# "<video_id>.karaoke", so they share its LRU size cap and Range serving.
+FFMPEG_PATH = shutil.which('ffmpeg')
+KARAOKE_BASS_CUTOFF = int(os.environ.get('KARAOKE_BASS_CUTOFF', 150))
+RENDITION_TIMEOUT = int(os.environ.get('RENDITION_TIMEOUT', 600))
+RENDITION_RETRY_AFTER = 300
+
+_rendition_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rendition')
+_rendition_jobs = {}
+_rendition_lock = threading.Lock()
+
+
+def rendition_key(video_id, mode='karaoke'):
+    return media_key(video_id, mode)
+
+
+def rendition_ready(video_id, mode='karaoke'):
+    entry_dir = _media_dir(rendition_key(video_id, mode))
+    return bool(entry_dir) and os.path.exists(os.path.join(entry_dir, 'media.bin'))
+
+
+def karaoke_filter():
+    """ffmpeg filter graph: keep the bass, cancel the centre channel above it."""
+    cutoff = KARAOKE_BASS_CUTOFF
+    return (
+        f"[0:a]aformat=channel_layouts=stereo,asplit=2[low][high];"
+        f"[low]lowpass=f={cutoff},lowpass=f={cutoff}[bass];"
+        f"[high]highpass=f={cutoff},highpass=f={cutoff},"
+        f"pan=stereo|c0=c0-c1|c1=c1-c0[side];"
+        f"[bass][side]amix=inputs=2:normalize=0,alimiter=limit=0.95[out]"
+    )
+
+
+def render_karaoke(video_id):
+    """Render and store the instrumental rendition of a video. Returns True on success."""
+    import subprocess
+    key = rendition_key(video_id)
+    entry_dir = _media_dir(key)
+    if not entry_dir:
+        return False
+
+    # Prefer the fully cached original over another upstream download
+    source_dir = _media_dir(video_id)
+    cached_source = os.path.join(source_dir, 'media.bin') if source_dir else None
+    input_args = []
+    if cached_source and os.path.exists(cached_source):
+        input_args = ['-i', cached_source]
+        print(f"[RENDITION] Rendering {video_id} from disk cache")
+    else:
+        resolved = resolve_stream(video_id)
+        if not resolved:
+            print(f"[RENDITION] No stream available for {video_id}")
+            return False
+        headers = ''.join(f"{k}: {v}\r\n" for k, v in (resolved.get('headers') or {}).items())
+        if headers:
+            input_args += ['-headers', headers]
+        input_args += ['-i', resolved['url']]
+        print(f"[RENDITION] Rendering {video_id} from {resolved['source']}")
+
+    os.makedirs(entry_dir, exist_ok=True)
+    final_path = os.path.join(entry_dir, 'media.bin')
+    tmp_path = f"{final_path}.{os.getpid()}.tmp"
+    cmd = [
+        FFMPEG_PATH, '-hide_banner', '-loglevel', 'error', '-y',
+        *input_args,
+        '-filter_complex', karaoke_filter(),
+        '-map', '0:v:0?', '-map', '[out]',
+        '-c:v', 'copy', '-c:a', 'aac', '-b:a', '160k',
+        '-movflags', '+faststart', '-f', 'mp4', tmp_path,
+    ]
+    started = time.time()
+    try:
+        proc = subprocess.run(cmd, capture_output=True, timeout=RENDITION_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        print(f"[RENDITION] ffmpeg timed out for {video_id}")
+        proc = None
+    if not proc or proc.returncode != 0 or not os.path.exists(tmp_path):
+        if proc:
+            print(f"[RENDITION] ffmpeg failed for {video_id}: {proc.stderr.decode(errors='ignore')[-300:]}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    size = os.path.getsize(tmp_path)
+    _write_atomic(os.path.join(entry_dir, 'meta.json'), json.dumps({
+        'size': size,
+        'block_size': MEDIA_CACHE_BLOCK_SIZE,
+        'content_type': 'video/mp4',
+    }).encode())
+    os.replace(tmp_path, final_path)
+    print(f"[RENDITION] {video_id} ready in {time.time() - started:.1f}s ({size} bytes)")
+    _note_media_bytes_written(size)
+    return True
+
+
+def _run_rendition_job(video_id):
+    try:
+        ok = render_karaoke(video_id)
+    except Exception as e:
+        print(f"[RENDITION] Error for {video_id}: {e}")
+        ok = False
+    with _rendition_lock:
+        if ok:
+            _rendition_jobs.pop(video_id, None)
+        else:
+            _rendition_jobs[video_id] = {'state': 'failed', 'at': time.time()}
+
+
+def request_rendition(video_id):
+    """Start rendering if needed; returns 'ready', 'pending', 'failed' or 'unavailable'."""
+    if rendition_ready(video_id):
+        return 'ready'
+    if not FFMPEG_PATH:
+        return 'unavailable'
+    with _rendition_lock:
+        job = _rendition_jobs.get(video_id)
+        if job and job['state'] == 'pending':
+            return 'pending'
+        if job and job['state'] == 'failed' and time.time() - job['at'] < RENDITION_RETRY_AFTER:
+            return 'failed'
+        _rendition_jobs[video_id] = {'state': 'pending', 'at': time.time()}
+    _rendition_executor.submit(_run_rendition_job, video_id)
+    return 'pending'
+
+
+@app.route('/api/rendition', methods=['GET'])
+def get_rendition():
+    """Get (or start building) the server-side karaoke rendition of a video."""
+    video_id = request.args.get('id', '').strip()
+    mode = request.args.get('mode', 'karaoke')
+    if not video_id or not _media_dir(rendition_key(video_id)):
+        return jsonify({'error': 'Missing video ID'}), 400
+    if mode != 'karaoke':
+        return jsonify({'error': f'Unknown rendition mode: {mode}'}), 400
+
+    state = request_rendition(video_id)
+    if state == 'ready':
+        return jsonify({'ready': True, 'url': f"/proxy_stream?v={video_id}&mode=karaoke"})
+    return jsonify({'ready': False, 'state': state}), 202 if state == 'pending' else 200
+
+
+# ============================================
+# Runtime Stats
+# ============================================
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Report in-process cache and concurrency counters for this worker."""
+    return jsonify({
+        'pid': os.getpid(),
+        'single_flight': {
+            flight.name: flight.stats()
+            for flight in (_search_flight, _lyrics_flight, _stream_flight)
+        },
+        'instances': instance_health.snapshot(),
+        'streams': stream_gate.stats(),
+        'lyrics_pool': lyrics_pool.stats(),
+        'candidate_pool': candidate_pool.stats(),
+        'lyrics_lru': lyrics_lru.stats(),
+        'lyrics_writer': lyrics_writer.stats(),
+    })
+
+
+@app.route('/api/maintenance', methods=['GET', 'POST'])
+def maintenance():
+    """GET reports lyrics database stats; POST runs eviction, vacuum and ANALYZE.
+
+    Disabled (403) unless MAINTENANCE_TOKEN is set; callers send it as
+    X-Maintenance-Token.
+    """
+    token = request.headers.get('X-Maintenance-Token', '')
+    if not MAINTENANCE_TOKEN or not hmac.compare_digest(token.encode(), MAINTENANCE_TOKEN.encode()):
+        return jsonify({'error': 'Invalid maintenance token'}), 403
+
+    if request.method == 'GET':
+        try:
+            return jsonify(lyrics_db_stats(get_db().cursor()))
+        except Exception as e:
+            print(f"[DB ERROR] {e}")
+            return jsonify({'error': str(e)}), 500
+
+    try:
+        return jsonify(run_maintenance())
+    except Exception as e:
+        print(f"[DB ERROR] Maintenance failed: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 def main():
     """Start the Flask web server."""
     port = int(os.environ.get('PORT', 8080))
@@ -1809,4 +4314,8 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    import sys
+    if sys.argv[1:2] == ['maintenance']:
+        print(json.dumps(run_maintenance(), indent=2))
+    else:
+        main()
@@ -0,0 +1,66 @@
+"""
+Stream admission: a request arriving while every stream slot is taken waits
+in the queue and is admitted when a slot frees, instead of getting a 503.
+
+Run with: python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('RENDER_DISK_PATH', tempfile.mkdtemp(prefix='karaoke-test-'))
+os.environ.setdefault('LYRICS_LRU_WARM', '0')
+os.environ.setdefault('LYRICS_MAINTENANCE_INTERVAL', '0')
+
+import server  # noqa: E402 - environment must be set first
+
+
+def test_default_config_leaves_room_for_a_queue():
+    assert server.STREAM_QUEUE_SIZE >= 1
+    assert server.MAX_CONCURRENT_STREAMS + server.STREAM_QUEUE_SIZE <= server.STREAM_THREADS
+
+
+def test_queued_stream_is_admitted_when_a_slot_frees(monkeypatch):
+    gate = server.StreamGate(limit=1, queue_size=1, queue_timeout=5)
+    monkeypatch.setattr(server, 'stream_gate', gate)
+    monkeypatch.setattr(server, 'proxy_stream_admitted', lambda video_id, mode: 'streamed')
+
+    assert gate.acquire()  # the one slot is busy with another song
+    result = {}
+
+    def request_stream():
+        with server.app.test_client() as client:
+            response = client.get('/proxy_stream?v=abcdefghijk')
+            result['status'] = response.status_code
+            result['body'] = response.get_data(as_text=True)
+            response.close()
+
+    waiter = threading.Thread(target=request_stream)
+    waiter.start()
+    deadline = time.time() + 2
+    while gate.stats()['queued'] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert gate.stats()['queued'] == 1
+
+    gate.release()
+    waiter.join(timeout=5)
+
+    assert result == {'status': 200, 'body': 'streamed'}
+    stats = gate.stats()
+    assert (stats['admitted'], stats['rejected'], stats['timed_out']) == (2, 0, 0)
+    assert stats['active'] == 0
+
+
+def test_full_queue_is_refused_with_retry_after(monkeypatch):
+    gate = server.StreamGate(limit=1, queue_size=0, queue_timeout=5)
+    monkeypatch.setattr(server, 'stream_gate', gate)
+    assert gate.acquire()
+
+    response = server.app.test_client().get('/proxy_stream?v=abcdefghijk')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(server.STREAM_RETRY_AFTER)
@@ -0,0 +1,109 @@
+"""
+Song title parsing: turn a YouTube video title into (artist, track). Used by
+server.py and api/index.py.
+
+Titles come in a handful of shapes - "Artist - Track (Official Video)",
+"Artist《Track》官方MV", "Artist Name【Track Name】Official MV",
+"ARTIST 'Track' M/V", "【KTV】Artist - Track | Live" - with full-width
+punctuation mixed in. parse_title() width-folds the title, drops leading tag
+brackets, tries the "Artist <bracketed track>" shapes, and otherwise strips
+decorations and splits on the artist/track dash. All patterns are compiled
+once at import, results are memoized per raw title, and parse_titles()
+parses a whole page of search results in one call.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+PARSE_CACHE = 4096
+
+# Words that mark a bracket or suffix as decoration rather than part of a name
+_NOISE_LATIN = (r'official|music|video|mv|m/v|lyrics?|audio|visualizer|hd|hq|4k|1080p|720p|'
+                r'live|karaoke|ktv|instrumental|remaster(?:ed)?|version|ver\.?|cover|'
+                r'feat\.?|ft\.|prod\.?|ost|teaser|performance|dance practice')
+_NOISE_CJK = (r'官方|歌詞|歌词|字幕|完整版|高音質|高音质|現場|现场|演唱會|演唱会|伴奏|純音樂|纯音乐|'
+              r'翻唱|主題曲|主题曲|片尾曲|片头曲|片頭曲|插曲|電影|电影|電視劇|电视剧|動態|动态|版')
+_NOISE_RE = re.compile(rf'(?<![a-z])(?:{_NOISE_LATIN})(?![a-z])|{_NOISE_CJK}', re.IGNORECASE)
+# Trailing decoration outside brackets: "Official Music Video", "官方MV", "Lyrics"
+_NOISE_SUFFIX_RE = re.compile(
+    rf'(?:(?:^|\s+|(?<=[^\x00-\x7f]))(?:{_NOISE_LATIN})|\s*(?:{_NOISE_CJK}))+\s*$', re.IGNORECASE)
+
+# Brackets that wrap a song name rather than a tag
+_TITLE_BRACKETS = '《「『〈'
+_BRACKET_RE = re.compile(r'[(\[【《「『〈{]([^()\[\]【】《》「」『』〈〉{}]*)[)\]】》」』〉}]')
+_LEADING_TAG_RE = re.compile(r'^\s*[\[【]([^\]】]*)[\]】]\s*')
+_ROUND_RE = re.compile(r'\s*\([^()]*\)')
+# "Artist《Track》...", "Artist【Track】..." and "Artist 'Track' ..."
+_BRACKETED_TRACK_RE = re.compile(
+    r'^(?P<artist>[^(\[【《「『〈"“]+?)\s*'
+    r'(?:(?P<open>[\[【《「『〈])(?P<track>[^\]】》」』〉]+)[\]】》」』〉]'
+    r'|(?<=\s)(?P<quote>["“\'‘])(?P<qtrack>[^"”\'’]+)["”\'’](?=\s|$))')
+_SPACED_DASH_RE = re.compile(r'^(.+?)\s+[-–—―~_]+\s+(.+)$')
+_DASH_RE = re.compile(r'^(.+?)\s*[-–—―]+\s*(.+)$')
+_SLASH_RE = re.compile(r'^(.+?)\s+/\s+(.+)$')
+_CUT_RE = re.compile(r'\s*\|.*$')
+_SLASH_CUT_RE = re.compile(r'\s+/\s+.*$')
+_FEAT_RE = re.compile(r'\s+(?:feat\.?|ft\.)\s.*$', re.IGNORECASE)
+_QUOTES = '"\'“”‘’'
+_SPACE_RE = re.compile(r'\s+')
+
+
+def _is_noise(text):
+    return bool(_NOISE_RE.search(text))
+
+
+def _strip_noise(name):
+    """Drop trailing decoration words, unless that would leave nothing."""
+    stripped = _NOISE_SUFFIX_RE.sub('', name).strip(' -–—:' + _QUOTES)
+    return stripped or name.strip()
+
+
+def _strip_brackets(text):
+    """Remove tag brackets; unwrap title brackets that hold a name."""
+    def replace(match):
+        inner = match.group(1)
+        if match.group(0)[0] in _TITLE_BRACKETS and inner.strip() and not _is_noise(inner):
+            return f' {inner} '
+        return ' '
+    previous = None
+    while previous != text:  # innermost first, for nested brackets
+        previous, text = text, _BRACKET_RE.sub(replace, text)
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+@lru_cache(maxsize=PARSE_CACHE)
+def parse_title(title):
+    """Split a video title into (artist, track); artist is '' when there is none."""
+    text = _SPACE_RE.sub(' ', unicodedata.normalize('NFKC', title or '')).strip()
+
+    # "【KTV】Artist - Track", "[MV] Artist - Track"
+    while True:
+        match = _LEADING_TAG_RE.match(text)
+        if not match or match.end() == len(text):
+            break
+        text = text[match.end():]
+
+    # Round brackets hold asides ("BTS (방탄소년단) 'Dynamite'"), never the track
+    match = _BRACKETED_TRACK_RE.match(_ROUND_RE.sub('', text))
+    if match and not _SPACED_DASH_RE.match(match.group('artist')):
+        track = match.group('track') or match.group('qtrack')
+        artist = _strip_noise(_strip_brackets(match.group('artist')))
+        if artist and not _is_noise(track):
+            return artist, _strip_noise(_FEAT_RE.sub('', track.strip()))
+
+    clean = _CUT_RE.sub('', _strip_brackets(text))
+    match = _SPACED_DASH_RE.match(clean) or _DASH_RE.match(clean) or _SLASH_RE.match(clean)
+    if match:
+        track = _SLASH_CUT_RE.sub('', _FEAT_RE.sub('', match.group(2)))
+        artist, track = _strip_noise(match.group(1)), _strip_noise(track)
+        if ' ' in track and _NOISE_SUFFIX_RE.fullmatch(' ' + track):
+            # "Track - Karaoke Version": the dash only introduced decoration
+            return '', artist
+        return artist, track
+    return '', _strip_noise(_FEAT_RE.sub('', clean))
+
+
+def parse_titles(titles):
+    """parse_title() for a batch of titles (e.g. a page of search results)."""
+    return [parse_title(title) for title in titles]
@@ -159,10 +159,11 @@ const API = {
         }
     },
 
-    // Get stream URL for video
-    getStreamUrl: async (videoId) => {
+    // Get stream URL for video ('audio' mode streams an audio-only format)
+    getStreamUrl: async (videoId, mode = 'av') => {
         if (API.isWebMode()) {
-            const response = await fetch(`/api/stream_url?id=${encodeURIComponent(videoId)}`);
+            const modeParam = mode === 'audio' ? '&mode=audio' : '';
+            const response = await fetch(`/api/stream_url?id=${encodeURIComponent(videoId)}${modeParam}`);
             const data = await response.json();
             // Server signals that proxy is not available (e.g. on Render)
             if (data.proxy_unavailable) {
@@ -180,10 +181,11 @@ const API = {
     },
 
     // Get subtitles/captions for video
-    getSubtitles: async (videoId, title = '') => {
+    getSubtitles: async (videoId, title = '', duration = 0) => {
         if (API.isWebMode()) {
             const titleParam = title ? `&title=${encodeURIComponent(title)}` : '';
-            const response = await fetch(`/api/subtitles?id=${encodeURIComponent(videoId)}${titleParam}`);
+            const durationParam = duration ? `&duration=${duration}` : '';
+            const response = await fetch(`/api/subtitles?id=${encodeURIComponent(videoId)}${titleParam}${durationParam}`);
             if (!response.ok) {
                 return { available: false, lyrics: '' };
             }
@@ -192,6 +194,22 @@ const API = {
             // For desktop mode, we'd need to implement this in main.py
             return { available: false, lyrics: '' };
         }
+    },
+
+    // Get (or start building) the server-side vocal-removed rendition
+    getRendition: async (videoId) => {
+        if (!API.isWebMode()) return { ready: false, state: 'unavailable' };
+        const response = await fetch(`/api/rendition?id=${encodeURIComponent(videoId)}&mode=karaoke`);
+        return response.json();
+    },
+
+    // Ask the server to warm stream/lyrics caches for an upcoming song
+    prefetch: async (videoId, title = '', withStream = false, mode = 'av', duration = 0) => {
+        if (!API.isWebMode()) return;
+        const titleParam = title ? `&title=${encodeURIComponent(title)}` : '';
+        const streamParam = withStream ? `&stream=1&mode=${mode}` : '';
+        const durationParam = duration ? `&duration=${duration}` : '';
+        await fetch(`/api/prefetch?id=${encodeURIComponent(videoId)}${titleParam}${streamParam}${durationParam}`);
     }
 };
 
@@ -228,6 +246,43 @@ if (lyricsBtn) {
     });
 }
 
+// Toggle video visibility - with the video hidden, the proxy player
+// switches to an audio-only stream (roughly a tenth of the bytes)
+const videoBtn = document.getElementById('video-btn');
+const videoWrapper = document.getElementById('video-wrapper');
+let videoVisible = true;
+
+function currentStreamMode() {
+    return videoVisible ? 'av' : 'audio';
+}
+
+if (videoBtn) {
+    videoBtn.addEventListener('click', () => {
+        videoVisible = !videoVisible;
+        if (videoWrapper) videoWrapper.classList.toggle('collapsed', !videoVisible);
+        videoBtn.classList.toggle('active', !videoVisible);
+        videoBtn.innerHTML = videoVisible
+            ? '<i class="fas fa-video-slash"></i> Hide Video'
+            : '<i class="fas fa-video"></i> Show Video';
+        switchStreamMode();
+    });
+}
+
+async function switchStreamMode() {
+    // Only the proxied HTML5 player can change which format it pulls
+    if (useYouTubePlayer || usingServerKaraoke || !currentVideoId || !currentStreamUrl) return;
+    const videoId = currentVideoId;
+    try {
+        const url = await API.getStreamUrl(videoId, currentStreamMode());
+        if (videoId !== currentVideoId || !url || url === currentStreamUrl) return;
+        logDebug(`Switching to ${currentStreamMode()} stream`);
+        currentStreamUrl = url;
+        swapPlayerSource(url);
+    } catch (err) {
+        logDebug(`Stream mode switch failed: ${err.message}`);
+    }
+}
+
 // ============================================
 // Lyrics Modal Handlers
 // ============================================
@@ -342,14 +397,14 @@ function updateSourceLabel(source) {
 }
 
 // Load lyrics for a video (simplified - returns plain text)
-async function loadLyrics(videoId, videoTitle = '') {
+async function loadLyrics(videoId, videoTitle = '', duration = 0) {
     if (lyricsContent) lyricsContent.innerHTML = '<div class="lyrics-loading">Searching for lyrics...</div>';
     currentLyricsText = '';
     currentVideoId = videoId;
 
     try {
-        // Pass title to speed up the search (avoids yt-dlp lookup)
-        const data = await API.getSubtitles(videoId, videoTitle);
+        // Pass title to speed up the search (avoids yt-dlp lookup), duration to pick the right version
+        const data = await API.getSubtitles(videoId, videoTitle, duration);
 
         // Update current info
         currentArtist = data.artist || '';
@@ -576,6 +631,8 @@ function addToPlaylist(item) {
     renderPlaylist();
     if (currentIndex === -1) {
         playSong(0);
+    } else if (playlist.length - 1 === currentIndex + 1) {
+        prefetchNext();
     }
 }
 
@@ -703,8 +760,11 @@ async function playSong(index) {
     nowPlayingTitle.innerText = `Now Playing: ${item.title}`;
     renderPlaylist();
 
-    // Load lyrics for this video (pass title to speed up search)
-    loadLyrics(item.id, item.title);
+    // Load lyrics for this video (pass title and duration to speed up search)
+    loadLyrics(item.id, item.title, item.duration);
+
+    // Warm the server caches for the song after this one
+    prefetchNext();
 
     logDebug(`Loading song: ${item.title}`);
 
@@ -763,7 +823,7 @@ async function playSongWithProxy(item, thisRequestId) {
     player.load();
 
     try {
-        const streamUrl = await API.getStreamUrl(item.id);
+        const streamUrl = await API.getStreamUrl(item.id, currentStreamMode());
         if (thisRequestId !== playRequestId) return; // Ignore if another song was requested while resolving
 
         if (!streamUrl) {
@@ -772,7 +832,12 @@ async function playSongWithProxy(item, thisRequestId) {
 
         logDebug(`Got URL: ${streamUrl.substring(0, 50)}...`);
 
+        currentStreamUrl = streamUrl;
+        usingServerKaraoke = false;
         player.src = streamUrl;
+        if (karaokeKnob.classList.contains('active')) {
+            setServerKaraoke(true);
+        }
 
         if (audioCtx && audioCtx.state === 'suspended') {
             audioCtx.resume();
@@ -830,6 +895,15 @@ async function playSongWithProxy(item, thisRequestId) {
     }
 }
 
+// Prefetch the next playlist entry so the transition starts quickly
+function prefetchNext() {
+    const next = playlist[currentIndex + 1];
+    if (!next) return;
+    API.prefetch(next.id, next.title, !useYouTubePlayer, currentStreamMode(), next.duration).catch(err => {
+        logDebug(`Prefetch failed: ${err.message}`);
+    });
+}
+
 function playNext() {
     if (currentIndex + 1 < playlist.length) {
         playSong(currentIndex + 1);
@@ -884,11 +958,68 @@ const updateModeUI = (isSinging) => {
     }
 };
 
+// ============================================
+// Server-side Karaoke Rendition
+// ============================================
+// When the server has an instrumental rendition of the song, Sing mode plays
+// that file instead of cancelling vocals in the browser with Web Audio.
+let currentStreamUrl = '';
+let usingServerKaraoke = false;
+let renditionPollTimer = null;
+
+function swapPlayerSource(url) {
+    const resumeAt = player.currentTime;
+    const wasPlaying = !player.paused;
+    player.src = url;
+    player.addEventListener('loadedmetadata', () => {
+        player.currentTime = resumeAt;
+        if (wasPlaying) player.play().catch(() => {});
+    }, { once: true });
+}
+
+function setWebAudioKaraoke(isSinging) {
+    if (!audioCtx) return;
+    dryGain.gain.setTargetAtTime(isSinging ? 0 : 1, audioCtx.currentTime, 0.1);
+    wetGain.gain.setTargetAtTime(isSinging ? 1 : 0, audioCtx.currentTime, 0.1);
+}
+
+async function setServerKaraoke(isSinging) {
+    clearTimeout(renditionPollTimer);
+    const videoId = currentVideoId;
+
+    if (!isSinging || useYouTubePlayer || !videoId || !currentStreamUrl) {
+        if (usingServerKaraoke && currentStreamUrl) {
+            usingServerKaraoke = false;
+            swapPlayerSource(currentStreamUrl);
+        }
+        return;
+    }
+
+    try {
+        const data = await API.getRendition(videoId);
+        if (videoId !== currentVideoId || !karaokeKnob.classList.contains('active')) return;
+
+        if (data.ready) {
+            logDebug('Using server-side karaoke rendition');
+            usingServerKaraoke = true;
+            setWebAudioKaraoke(false); // Vocals are already removed in the file
+            swapPlayerSource(data.url);
+        } else if (data.state === 'pending') {
+            // Keep Web Audio removal going until the rendition is ready
+            renditionPollTimer = setTimeout(() => setServerKaraoke(true), 5000);
+        }
+    } catch (err) {
+        logDebug(`Rendition check failed: ${err.message}`);
+    }
+}
+
 karaokeKnob.addEventListener('click', () => {
     const isSinging = !karaokeKnob.classList.contains('active');
     updateModeUI(isSinging);
 
-    if (!audioCtx) return;
+    setServerKaraoke(isSinging);
+
+    if (!audioCtx || usingServerKaraoke) return;
 
     if (isSinging) {
         // Crossfade to wet (Singing Mode - No vocals)